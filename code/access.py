@@ -0,0 +1,142 @@
+import numpy as np
+
+# WGS-84 ellipsoid used for ground stations and line of sight (km)
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+
+class AccessConstraints:
+    """
+    Constraints of a link, like the access constraints of STK objects. A ground station sees everything above its
+    elevation mask, two satellites see each other unless the earth is in between. Both can be limited in range.
+    """
+
+    def __init__(self, min_elevation=0.0, elevation_mask=None, max_range=None):
+        """
+        :param min_elevation: Minimum elevation in degrees, only for ground stations
+        :param elevation_mask: Azimuth dependent minimum elevation as list of (azimuth, elevation) in degrees,
+                               interpolated between the points (e.g. terrain or buildings). Replaces min_elevation
+        :param max_range: Maximum range in km, unlimited if None
+        """
+        self.min_elevation = min_elevation
+        self.elevation_mask = None
+        if elevation_mask is not None:
+            azimuths, elevations = np.asarray(elevation_mask, dtype=np.float64).reshape(-1, 2).T
+            order = np.argsort(azimuths % 360)
+            self.elevation_mask = (azimuths[order] % 360, elevations[order])
+        self.max_range = max_range
+
+    def min_sine_elevation(self, azimuths):
+        """
+        :param azimuths: in radians, only used for azimuth dependent masks
+        :return: sine of the minimum elevation
+        """
+        if self.elevation_mask is None:
+            return np.sin(np.radians(self.min_elevation))
+        return np.sin(np.radians(np.interp(np.degrees(azimuths) % 360, *self.elevation_mask, period=360)))
+
+
+# Default of STK: ground stations see everything above the horizon, no range limit
+NO_CONSTRAINTS = AccessConstraints()
+
+
+def line_of_sight_clearance(positions1, positions2) -> np.ndarray:
+    """
+    Distance between the line of sight and the WGS-84 ellipsoid, negative if the earth lies between both positions.
+    Scaling the z axis turns the ellipsoid into a sphere, so a segment to sphere distance is sufficient.
+    :param positions1: shape (..., 3) in km
+    :param positions2: shape (..., 3) in km
+    :return: clearance in (scaled) km, continuous in the positions
+    """
+    scale = np.array([1.0, 1.0, WGS84_A / WGS84_B])
+    p1 = positions1 * scale
+    direction = positions2 * scale - p1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = np.clip(-np.sum(p1 * direction, axis=-1) / np.sum(direction * direction, axis=-1), 0.0, 1.0)
+    closest = p1 + s[..., np.newaxis] * direction
+    return np.linalg.norm(closest, axis=-1) - WGS84_A
+
+
+def earth_blocks_line_of_sight(positions1, positions2) -> np.ndarray:
+    """
+    Checks if the WGS-84 ellipsoid lies between two positions
+    :param positions1: shape (..., 3) in km
+    :param positions2: shape (..., 3) in km
+    :return: boolean array
+    """
+    return line_of_sight_clearance(positions1, positions2) < 0.0
+
+
+def range_margin(ranges, constraints):
+    # Positive while in range, infinite without range limit
+    if constraints.max_range is None:
+        return np.full_like(ranges, np.inf)
+    return constraints.max_range - ranges
+
+
+def ground_access_margins(station_positions, station_frames, target_positions, constraints=NO_CONSTRAINTS):
+    """
+    Access margins of ground station links, continuous in time (see CoverageWindows)
+    :param station_positions: shape (..., 3) in km, broadcastable to the targets
+    :param station_frames: Local east, north and up vectors of the station (see GroundStation.frames), shape
+                           (..., 3, 3)
+    :param target_positions: shape (..., 3) in km
+    :return: ranges in km and the smallest margin in km, positive while the station sees the target: height above
+             the elevation mask and distance to the max range
+    """
+    line_of_sight = target_positions - station_positions
+    ranges = np.linalg.norm(line_of_sight, axis=-1)
+    height = np.sum(line_of_sight * station_frames[..., 2, :], axis=-1)
+
+    azimuths = None
+    if constraints.elevation_mask is not None:
+        azimuths = np.arctan2(np.sum(line_of_sight * station_frames[..., 0, :], axis=-1),
+                              np.sum(line_of_sight * station_frames[..., 1, :], axis=-1))
+
+    # Elevation above the mask, as a height so that it stays continuous through the zenith
+    elevation_margin = height - ranges * constraints.min_sine_elevation(azimuths)
+    return ranges, np.minimum(elevation_margin, range_margin(ranges, constraints))
+
+
+def satellite_access_margins(positions1, positions2, constraints=NO_CONSTRAINTS):
+    """
+    Access margins of satellite to satellite links
+    :param positions1: shape (..., 3) in km
+    :param positions2: shape (..., 3) in km
+    :return: ranges in km and the smallest margin in km, positive while the earth is not in between and the
+             satellites are in range
+    """
+    ranges = np.linalg.norm(positions2 - positions1, axis=-1)
+    return ranges, np.minimum(line_of_sight_clearance(positions1, positions2), range_margin(ranges, constraints))
+
+
+def ground_access_ranges(station_positions, station_frames, target_positions, constraints=NO_CONSTRAINTS):
+    """
+    :return: ranges in km, NaN without access. See ground_access_margins
+    """
+    ranges, margins = ground_access_margins(station_positions, station_frames, target_positions, constraints)
+    ranges[margins < 0.0] = np.nan
+    return ranges
+
+
+def satellite_access_ranges(positions1, positions2, constraints=NO_CONSTRAINTS):
+    """
+    :return: ranges in km, NaN without access. See satellite_access_margins
+    """
+    ranges, margins = satellite_access_margins(positions1, positions2, constraints)
+    ranges[margins < 0.0] = np.nan
+    return ranges
+
+
+def access_range_data(offsets, ranges):
+    """
+    Same semantics as the AER reports of STK (see STKInterface.get_range_data): only samples in access
+    :param offsets: Seconds since scenario start, shape (times,)
+    :param ranges: Ranges in km, shape (times,), NaN without access
+    :return: offsets (int64) and ranges in access
+    """
+    in_access = ~np.isnan(ranges)
+    return np.rint(np.asarray(offsets)[in_access]).astype(np.int64), ranges[in_access]
+
@@ -0,0 +1,245 @@
+import argparse
+import glob
+import json
+import os.path
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+import stk_dates
+from decision_window_calc import decisionDelay, decisionDelayBatch
+from propagation import propagate, sgp4_init, time_grid
+from sat_manager import get_ssc_mapping_from_file
+from satellite_catalog import CATALOG_FIELDS, SatelliteCatalog
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = os.path.join(BASE_DIR, "benchmarks")
+
+CATALOG_SIZES = [1000, 10000, 30000]
+STEP_SIZES = [1, 10, 60]  # sec
+
+# 1 day window
+WINDOW_START = "1 Jan 2024 00:00:00.000000000"
+WINDOW_END = "2 Jan 2024 00:00:00.000000000"
+
+# Satellite samples per propagation call, bounds the memory for large catalogs at small steps
+PROPAGATION_BLOCK_SAMPLES = 1000000
+# Larger windows (e.g. 30k satellites at 1s, 2.6 billion samples) are timed on their first blocks and extrapolated
+PROPAGATION_MAX_SAMPLES = 50000000
+
+
+def measure(function, repeat=3):
+    """
+    :return: fastest and median wall time of function() in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": float(np.median(timings))}
+
+
+def synthetic_catalog(size, seed=0) -> SatelliteCatalog:
+    """
+    :param size: Number of satellites
+    :return: Random low earth orbit catalog with the layout of celestrak.json
+    """
+    random = np.random.default_rng(seed)
+    records = np.zeros(size, dtype=[(field, "U16" if dtype is str else dtype)
+                                    for field, dtype in CATALOG_FIELDS.items()])
+
+    records["OBJECT_NAME"] = np.char.add("SYNTHETIC ", np.arange(size).astype(str))
+    records["OBJECT_ID"] = "2024-001A"
+    records["EPOCH"] = np.datetime64("2024-01-01T00:00:00", "us")
+    records["MEAN_MOTION"] = random.uniform(11.0, 16.0, size)
+    records["ECCENTRICITY"] = random.uniform(0.0, 0.02, size)
+    records["INCLINATION"] = random.uniform(0.0, 100.0, size)
+    records["RA_OF_ASC_NODE"] = random.uniform(0.0, 360.0, size)
+    records["ARG_OF_PERICENTER"] = random.uniform(0.0, 360.0, size)
+    records["MEAN_ANOMALY"] = random.uniform(0.0, 360.0, size)
+    records["CLASSIFICATION_TYPE"] = "U"
+    records["NORAD_CAT_ID"] = 100000 + np.arange(size)
+    records["ELEMENT_SET_NO"] = 999
+    records["BSTAR"] = random.uniform(1e-5, 1e-3, size)
+
+    return SatelliteCatalog(records)
+
+
+def benchmark_decision_delay():
+    random = np.random.default_rng(0)
+    AtoD, DtoV, AtoV = random.uniform(5e5, 3e6, (3, 1000000))
+
+    results = {}
+    number_of_calls = 100000
+    scalar = measure(lambda: [decisionDelay(AtoD[i], DtoV[i], AtoV[i], 0.005) for i in range(number_of_calls)])
+    results["decisionDelay scalar (per call)"] = {key: value / number_of_calls for key, value in scalar.items()}
+
+    batch = measure(lambda: decisionDelayBatch(AtoD, DtoV, AtoV, 0.005))
+    results["decisionDelayBatch 1M (per element)"] = {key: value / len(AtoD) for key, value in batch.items()}
+    return results
+
+
+def benchmark_dates():
+    # One STK date per second of the window, like an AER report at 1s steps
+    times = time_grid(WINDOW_START, WINDOW_END, 1)
+    dates = stk_dates.datetime64_to_stk_dates(times)
+
+    results = {}
+    number_of_dates = 10000
+    scalar = measure(lambda: [stk_dates.stk_date_to_datetime(date) for date in dates[:number_of_dates]])
+    results["stk_date_to_datetime (per date)"] = {key: value / number_of_dates for key, value in scalar.items()}
+
+    parse = measure(lambda: stk_dates.stk_dates_to_datetime64(dates))
+    results["stk_dates_to_datetime64 (per date)"] = {key: value / len(dates) for key, value in parse.items()}
+
+    offsets = measure(lambda: stk_dates.stk_dates_to_offsets(dates, WINDOW_START))
+    results["stk_dates_to_offsets (per date)"] = {key: value / len(dates) for key, value in offsets.items()}
+
+    formatting = measure(lambda: stk_dates.datetime64_to_stk_dates(times))
+    results["datetime64_to_stk_dates (per date)"] = {key: value / len(dates) for key, value in formatting.items()}
+    return results
+
+
+def benchmark_catalog(celestrak_file):
+    results = {}
+    results["get_ssc_mapping_from_file"] = measure(lambda: get_ssc_mapping_from_file(celestrak_file))
+    results["SatelliteCatalog.load without sidecar"] = measure(
+        lambda: SatelliteCatalog.load(celestrak_file, use_sidecar=False))
+    return results
+
+
+def benchmark_propagation(catalog_sizes, step_sizes):
+    results = {}
+    for size in catalog_sizes:
+        catalog = synthetic_catalog(size)
+        elements = catalog.elements()
+        results[f"sgp4_init {size}"] = measure(lambda: sgp4_init(elements))
+
+        record = sgp4_init(elements)
+        for step_size in step_sizes:
+            times = time_grid(WINDOW_START, WINDOW_END, step_size)
+
+            block_size = max(1, PROPAGATION_BLOCK_SAMPLES // size)
+            timed_times = times[:max(block_size, PROPAGATION_MAX_SAMPLES // size)]
+
+            def propagate_window():
+                for block_start in range(0, len(timed_times), block_size):
+                    propagate(elements, timed_times[block_start:block_start + block_size], record)
+
+            timing = measure(propagate_window, repeat=1)
+            timing["samples per second"] = size * len(timed_times) / timing["min"]
+            timing["extrapolated"] = len(timed_times) < len(times)
+            for key in ["min", "median"]:
+                timing[key] *= len(times) / len(timed_times)
+
+            results[f"propagate {size} satellites, 1 day at {step_size}s"] = timing
+            print(f"Propagated {size} satellites at {step_size}s steps in {round(timing['min'], 3)}s"
+                  f"{' (extrapolated)' if timing['extrapolated'] else ''}")
+    return results
+
+
+def benchmark_experiments():
+    # Runs write their reports into a temporary directory, so results/ is not touched
+    import experiment1
+    import experiment2
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        experiment1.BASE_DIR = experiment2.BASE_DIR = temporary_dir
+
+        results["Exp1 sgp4"] = measure(lambda: experiment1.one_to_one_experiment(backend="sgp4"), repeat=1)
+        results["Exp1 stk-sim"] = measure(
+            lambda: experiment1.one_to_one_experiment(backend="stk-sim", latency_scale=0, resume=False), repeat=1)
+
+        experiment2.CONSTELLATIONS = ["starlink"]
+        results["Exp2 sgp4 starlink"] = measure(lambda: experiment2.many_to_one_experiment(backend="sgp4"), repeat=1)
+
+        # Every satellite is a single STK call sequence, a small constellation keeps the run short
+        experiment2.CONSTELLATIONS = ["iridium", "globalstar"]
+        results["Exp2 stk-sim iridium globalstar"] = measure(
+            lambda: experiment2.many_to_one_experiment(backend="stk-sim", latency_scale=0, resume=False), repeat=1)
+
+    return results
+
+
+def get_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_to_previous(results, results_file):
+    # Latest other result file, e.g. of the previous commit
+    previous_files = [f for f in glob.glob(os.path.join(BENCHMARK_DIR, "*.json")) if f != results_file]
+    if not previous_files:
+        return
+
+    previous_file = max(previous_files, key=os.path.getmtime)
+    with open(previous_file, "r") as f:
+        previous_results = json.load(f)["results"]
+
+    print(f"Compared to {os.path.basename(previous_file)} (> 1 is slower):")
+    for group, cases in results.items():
+        for case, timing in cases.items():
+            previous_timing = previous_results.get(group, {}).get(case)
+            if previous_timing and previous_timing["min"] > 0:
+                print(f"{case}: {round(timing['min'] / previous_timing['min'], 3)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the hot paths, results are stored per commit in "
+                                                 "benchmarks/")
+    parser.add_argument("--quick", action="store_true", help="Only the smallest catalog at 60s steps")
+    parser.add_argument("--skip-experiments", action="store_true", help="Skip the end to end runs")
+    args = parser.parse_args()
+
+    catalog_sizes = CATALOG_SIZES[:1] if args.quick else CATALOG_SIZES
+    step_sizes = STEP_SIZES[-1:] if args.quick else STEP_SIZES
+    celestrak_file = os.path.join(BASE_DIR, "celestrak.json")
+
+    results = {
+        "decision delay": benchmark_decision_delay(),
+        "dates": benchmark_dates(),
+        "catalog": benchmark_catalog(celestrak_file),
+        "propagation": benchmark_propagation(catalog_sizes, step_sizes),
+    }
+    if not args.skip_experiments:
+        results["experiments"] = benchmark_experiments()
+
+    commit = get_commit()
+    output = {
+        "commit": commit,
+        "date": str(datetime.now()),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results
+    }
+
+    if not os.path.isdir(BENCHMARK_DIR):
+        os.mkdir(BENCHMARK_DIR)
+
+    results_file = os.path.join(BENCHMARK_DIR, f"{commit}.json")
+    with open(results_file, "w") as outfile:
+        json.dump(output, outfile, indent=1)
+
+    for group, cases in results.items():
+        print(group)
+        for case, timing in cases.items():
+            print(f"  {case}: {timing['min']:.3g}s")
+
+    compare_to_previous(results, results_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import csv
+import json
+import os
+from itertools import repeat
+
+import numpy as np
+
+SLOT_COLUMNS = ["time_index", "time", "AtoV"]
+DEFENDER_COLUMNS = ["time_index", "constellation", "satellite", "ssc_number", "AtoD", "DtoV", "decision_delay"]
+WINDOW_COLUMNS = ["constellation", "satellite", "ssc_number", "start", "end"]
+COVERAGE_WINDOW_COLUMNS = ["constellation", "start", "end"]
+ROW_FILES = ["defenders.csv", "windows.csv", "coverage_windows.csv"]
+REPORT_FILES = ["meta.json", "slots.csv", "coverage.npy"] + ROW_FILES
+
+
+class ColumnarReportWriter:
+    """
+    Streams the report of Experiment 2 into a directory instead of one nested JSON file:
+    - meta.json: setup, runtime, constellations and their summary (defended times, defend percentage, ...)
+    - slots.csv: time_index, time (STK date) and AtoV (km) of every time slot
+    - defenders.csv: one row per defender and time slot in the order they were added, AtoD and DtoV in m,
+      decision_delay in s
+    - coverage.npy: bool array (constellations, slots), True for every defended time slot
+    Event based reports (see CoverageWindows) have windows.csv and coverage_windows.csv (STK dates) instead of
+    defenders.csv and coverage.npy. Defender rows can be added while a constellation is evaluated (see add_defenders),
+    they are flushed after every constellation, so the report of a running experiment can already be analysed.
+    """
+
+    def __init__(self, report_dir, setup, target_times, AtoV_ranges, finished=None):
+        """
+        :param report_dir: Directory of the report, created if missing
+        :param setup: JSON serializable setup of the run
+        :param target_times: STK dates of the time slots
+        :param AtoV_ranges: Range between attacker and victim at each time slot in km
+        :param finished: Journal entries ("constellation", "summary" and "offsets", see offsets) of the constellations
+                         a previous run of the same setup has written, their rows are kept and everything after them
+                         is dropped. The report is started from scratch if None or empty
+        """
+        self.report_dir = report_dir
+        os.makedirs(report_dir, exist_ok=True)
+
+        self.meta = {"setup": setup, "constellations": [], "summary": {}}
+        self.number_of_slots = len(target_times)
+        self.coverage = []
+        self.files = {}
+        self.constellation_name = None
+        self.constellation_coverage = None
+
+        if finished:
+            self.resume(finished)
+            return
+
+        # Files of a previous report would be mixed into this one
+        for name in REPORT_FILES:
+            if os.path.isfile(os.path.join(report_dir, name)):
+                os.remove(os.path.join(report_dir, name))
+
+        with open(os.path.join(report_dir, "slots.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(SLOT_COLUMNS)
+            writer.writerows(zip(range(len(target_times)), target_times, np.asarray(AtoV_ranges).tolist()))
+
+        self.write_meta()
+
+    def resume(self, finished):
+        meta_file = os.path.join(self.report_dir, "meta.json")
+        if not os.path.isfile(meta_file):
+            print(f"Columnar report {self.report_dir} of the journal is missing! Delete the journal or run with "
+                  f"resume=False.")
+            exit(1)
+        with open(meta_file, "r") as f:
+            previous_setup = json.load(f)["setup"]
+        if previous_setup != json.loads(json.dumps(self.meta["setup"])):
+            print(f"Columnar report {self.report_dir} belongs to a different setup! Delete the journal or run with "
+                  f"resume=False.")
+            exit(1)
+
+        # Rows written after the last finished constellation belong to the interrupted one
+        offsets = finished[-1]["offsets"]
+        for name in ROW_FILES:
+            file = os.path.join(self.report_dir, name)
+            if name not in offsets:
+                if os.path.isfile(file):
+                    os.remove(file)
+                continue
+            if not os.path.isfile(file) or os.path.getsize(file) < offsets[name]:
+                print(f"Columnar report {self.report_dir} is shorter than the journal! Delete the journal or run "
+                      f"with resume=False.")
+                exit(1)
+            with open(file, "r+b") as f:
+                f.truncate(offsets[name])
+            f = open(file, "a", newline="")
+            self.files[name] = (f, csv.writer(f))
+
+        coverage_file = os.path.join(self.report_dir, "coverage.npy")
+        if offsets.get("coverage.npy"):
+            if not os.path.isfile(coverage_file):
+                print(f"Columnar report {self.report_dir} is shorter than the journal! Delete the journal or run "
+                      f"with resume=False.")
+                exit(1)
+            self.coverage = list(np.load(coverage_file)[:offsets["coverage.npy"]])
+            self.write_coverage()
+        elif os.path.isfile(coverage_file):
+            os.remove(coverage_file)
+
+        for entry in finished:
+            self.meta["constellations"].append(entry["constellation"])
+            self.meta["summary"][entry["constellation"]] = entry["summary"]
+        self.write_meta()
+
+    def writer(self, name, columns):
+        # Files are only created for the rows that are actually written
+        if name not in self.files:
+            f = open(os.path.join(self.report_dir, name), "w", newline="")
+            self.files[name] = (f, csv.writer(f))
+            self.files[name][1].writerow(columns)
+        return self.files[name]
+
+    def write_meta(self):
+        # Replace atomically, an interrupted write must not leave a broken meta.json behind
+        temporary_file = os.path.join(self.report_dir, "meta.json.tmp")
+        with open(temporary_file, "w") as f:
+            json.dump(self.meta, f, indent=1)
+        os.replace(temporary_file, os.path.join(self.report_dir, "meta.json"))
+
+    def write_coverage(self):
+        temporary_file = os.path.join(self.report_dir, "coverage.npy.tmp")
+        with open(temporary_file, "wb") as coverage_file:
+            np.save(coverage_file, np.array(self.coverage), allow_pickle=False)
+        os.replace(temporary_file, os.path.join(self.report_dir, "coverage.npy"))
+
+    def offsets(self):
+        """
+        :return: size of every row file and rows of coverage.npy, journaled after each constellation to resume the
+                 report with these rows
+        """
+        offsets = {name: f.tell() for name, (f, _) in self.files.items()}
+        offsets["coverage.npy"] = len(self.coverage)
+        return offsets
+
+    def start_constellation(self, constellation_name):
+        """
+        Starts the time slots of a constellation, see add_defenders and end_constellation
+        """
+        self.constellation_name = constellation_name
+        self.constellation_coverage = np.zeros(self.number_of_slots, dtype=bool)
+
+    def add_defenders(self, time_indices, satellite_names, ssc_numbers, AtoD, DtoV, decision_delays):
+        """
+        Writes defender rows of the current constellation, in any number of batches
+        :param time_indices: Time slot of each row
+        :param satellite_names: Name of each defender
+        :param ssc_numbers: SSC number of each defender
+        :param AtoD: Distances in m
+        :param DtoV: Distances in m
+        :param decision_delays: Decision delays in seconds
+        """
+        _, writer = self.writer("defenders.csv", DEFENDER_COLUMNS)
+        time_indices = np.asarray(time_indices, dtype=np.int64)
+        writer.writerows(zip(time_indices.tolist(), repeat(self.constellation_name), satellite_names, ssc_numbers,
+                             np.asarray(AtoD).tolist(), np.asarray(DtoV).tolist(),
+                             np.asarray(decision_delays).tolist()))
+        self.constellation_coverage[time_indices] = True
+
+    def add_time_defender_mapping(self, time_defender_mapping, ssc_numbers):
+        """
+        :param time_defender_mapping: Defenders of each time slot as in report_Exp2.json
+        :param ssc_numbers: Mapping from satellite name to SSC number
+        """
+        for time_index, defenders in enumerate(time_defender_mapping.values()):
+            self.add_defenders([time_index] * len(defenders), list(defenders),
+                               [ssc_numbers.get(satellite_name, "") for satellite_name in defenders],
+                               [defender["AtoD"] for defender in defenders.values()],
+                               [defender["DtoV"] for defender in defenders.values()],
+                               [defender["decision_delay"] for defender in defenders.values()])
+
+    def end_constellation(self, summary):
+        """
+        :param summary: Report of the constellation without the defenders
+        """
+        for f, _ in self.files.values():
+            f.flush()
+
+        if self.constellation_coverage is not None:
+            self.coverage.append(self.constellation_coverage)
+            self.write_coverage()
+
+        self.meta["constellations"].append(self.constellation_name)
+        self.meta["summary"][self.constellation_name] = summary
+        self.write_meta()
+        self.constellation_name = None
+        self.constellation_coverage = None
+
+    def write_constellation(self, constellation_name, report, ssc_numbers):
+        """
+        :param constellation_name: Name of the constellation
+        :param report: Report of the constellation as in report_Exp2.json
+        :param ssc_numbers: Mapping from satellite name to SSC number
+        """
+        if "coverage" in report:
+            self.constellation_name = constellation_name
+            self.write_windows(constellation_name, report, ssc_numbers)
+        else:
+            self.start_constellation(constellation_name)
+            self.add_time_defender_mapping(report["defenders"], ssc_numbers)
+
+        self.end_constellation({key: value for key, value in report.items() if key not in ("defenders", "coverage")})
+
+    def write_windows(self, constellation_name, report, ssc_numbers):
+        _, writer = self.writer("windows.csv", WINDOW_COLUMNS)
+        for satellite_name, windows in report["defenders"].items():
+            writer.writerows([constellation_name, satellite_name, ssc_numbers.get(satellite_name, ""), start, end]
+                             for start, end in windows)
+
+        _, writer = self.writer("coverage_windows.csv", COVERAGE_WINDOW_COLUMNS)
+        writer.writerows([constellation_name, start, end] for start, end in report["coverage"])
+
+    def close(self, runtime=None):
+        """
+        :param runtime: Runtime block of the report
+        """
+        for f, _ in self.files.values():
+            f.close()
+        self.files = {}
+
+        if runtime is not None:
+            self.meta["runtime"] = runtime
+        self.write_meta()
+
+
+class ColumnarReport:
+    """
+    Reads a report written by ColumnarReportWriter. Nothing but meta.json is read up front, the rows can be iterated
+    without loading the whole file and coverage.npy is memory-mapped.
+    """
+
+    def __init__(self, report_dir):
+        self.report_dir = report_dir
+        with open(os.path.join(report_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+
+    @property
+    def setup(self):
+        return self.meta["setup"]
+
+    @property
+    def constellations(self):
+        return self.meta["constellations"]
+
+    def iter_rows(self, name):
+        """
+        :param name: CSV file of the report, e.g. "defenders.csv"
+        :return: generator of dicts, numbers are converted
+        """
+        file = os.path.join(self.report_dir, name)
+        if not os.path.isfile(file):
+            return
+
+        with open(file, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                if "time_index" in row:
+                    row["time_index"] = int(row["time_index"])
+                for column in ("AtoV", "AtoD", "DtoV", "decision_delay"):
+                    if column in row:
+                        row[column] = float(row[column])
+                yield row
+
+    def columns(self, name, constellation=None):
+        """
+        :return: dict of column name to numpy array, only the rows of the constellation if given
+        """
+        rows = [row for row in self.iter_rows(name) if constellation is None or row["constellation"] == constellation]
+        columns = {}
+        for column in (rows[0].keys() if rows else []):
+            columns[column] = np.array([row[column] for row in rows])
+        return columns
+
+    def slots(self):
+        return self.columns("slots.csv")
+
+    def defenders(self, constellation=None):
+        return self.columns("defenders.csv", constellation)
+
+    def windows(self, constellation=None):
+        return self.columns("windows.csv", constellation)
+
+    def coverage(self, constellation=None):
+        """
+        :return: bool array (constellations, slots), or (slots,) for a single constellation
+        """
+        coverage = np.load(os.path.join(self.report_dir, "coverage.npy"), mmap_mode="r")
+        if constellation is None:
+            return coverage
+        return coverage[self.constellations.index(constellation)]
+
+    def to_json(self):
+        """
+        :return: Report in the format of report_Exp2.json
+        """
+        report = {}
+        for constellation_name in self.constellations:
+            report[constellation_name] = dict(self.meta["summary"][constellation_name])
+            report[constellation_name]["defenders"] = {}
+
+        if os.path.isfile(os.path.join(self.report_dir, "windows.csv")):
+            for row in self.iter_rows("windows.csv"):
+                defenders = report[row["constellation"]]["defenders"]
+                defenders.setdefault(row["satellite"], []).append([row["start"], row["end"]])
+            for constellation_name in self.constellations:
+                report[constellation_name]["coverage"] = []
+            for row in self.iter_rows("coverage_windows.csv"):
+                report[row["constellation"]]["coverage"].append([row["start"], row["end"]])
+        else:
+            slots = list(self.iter_rows("slots.csv"))
+            for constellation_name in self.constellations:
+                report[constellation_name]["defenders"] = {slot["time"]: {} for slot in slots}
+            for row in self.iter_rows("defenders.csv"):
+                slot = slots[row["time_index"]]
+                report[row["constellation"]]["defenders"][slot["time"]][row["satellite"]] = {
+                    "AtoV": slot["AtoV"],
+                    "AtoD": row["AtoD"],
+                    "DtoV": row["DtoV"],
+                    "decision_delay": row["decision_delay"]
+                }
+
+        output = {"setup": self.setup}
+        if "runtime" in self.meta:
+            output["runtime"] = self.meta["runtime"]
+        output["report"] = report
+        return output
+
+
+def export_json(report_dir, report_file):
+    """
+    Writes a columnar report as report_Exp2.json
+    :param report_dir: Directory written by ColumnarReportWriter
+    :param report_file: Path of the JSON file
+    """
+    with open(report_file, "w") as outfile:
+        json.dump(ColumnarReport(report_dir).to_json(), outfile, indent=1)
@@ -0,0 +1,227 @@
+from functools import reduce
+
+import numpy as np
+
+from access import ground_access_margins, satellite_access_margins
+from propagation import sgp4_propagate
+from spatial_index import find_candidate_defenders, range_budget
+from stk_dates import offsets_to_datetime64
+
+# Satellite samples per evaluation of the coarse grid, bounds the memory for long time windows
+EVALUATION_BLOCK_SAMPLES = 2000000
+
+# Extra km on the feasibility ellipsoid of the candidate search, covers the rounding of the sample times to microseconds
+CANDIDATE_MARGIN = 1.0
+
+
+class CoverageWindows:
+    """
+    Event based alternative to the time slots of Experiment 2. Whether a satellite can defend is the sign of a few
+    continuous functions of time (margins in km, see defense_margins). Their minimum is sampled on a coarse grid, the
+    sign changes are bracketed and refined by bisection, so windows are exact up to the tolerance instead of the step
+    size. Windows shorter than the coarse step can fall between two samples and be missed.
+    Defense margins are only evaluated at the samples inside the visibility windows and only for the satellites inside
+    the feasibility ellipsoid of the sample (see DefenderIndex), all others can't defend at that sample.
+    """
+
+    def __init__(self, propagation_interface, tail_time, coarse_step=30, tolerance=1e-3):
+        """
+        :param propagation_interface: PropagationInterface with attacker, victim and the time window
+        :param tail_time: in seconds
+        :param coarse_step: Seconds between the samples used to bracket the window edges, should be below the
+                            shortest window of interest (Starlink windows over a day are 18s and longer)
+        :param tolerance: Accuracy of the window edges in seconds
+        """
+        self.propagation_interface = propagation_interface
+        self.tail_time = tail_time
+        self.budget = range_budget(tail_time)
+        self.coarse_step = coarse_step
+        self.tolerance = tolerance
+
+        self.start = offsets_to_datetime64([0], propagation_interface.start_time)[0]
+        stop = offsets_to_datetime64([0], propagation_interface.stop_time)[0]
+        self.duration = (stop - self.start) / np.timedelta64(1, "s")
+
+        # Minutes from the element set epochs to the scenario start, the engine works on seconds since scenario start
+        self.record = propagation_interface.record
+        self.epoch_minutes = (self.start - self.record["epoch"]) / np.timedelta64(1, "m")
+        self.victim_record = propagation_interface.victim_object.record
+        self.victim_epoch_minutes = (self.start - self.victim_record["epoch"]) / np.timedelta64(1, "m")
+
+    def victim_positions(self, offsets):
+        tsince = self.victim_epoch_minutes[:, np.newaxis] + offsets.reshape(1, -1) / 60
+        return sgp4_propagate(self.victim_record, tsince).reshape(offsets.shape + (3,))
+
+    def attacker_positions(self, offsets):
+        """
+        :return: Attacker positions in TEME, shape of offsets + (3,), and local east, north and up vectors, shape of
+                 offsets + (3, 3)
+        """
+        attacker = self.propagation_interface.attacker_object
+        times = self.start + np.rint(offsets.ravel() * 1e6).astype(np.int64).astype("timedelta64[us]")
+        return (attacker.positions(times).reshape(offsets.shape + (3,)),
+                attacker.frames(times).reshape(offsets.shape + (3, 3)))
+
+    def visibility_margins(self, rows, offsets):
+        """
+        :param rows: Ignored, the victim is the only object
+        :param offsets: Seconds since scenario start, shape (1, times)
+        :return: Access margin of the attacker to the victim in km, see ground_access_margins
+        """
+        victims = self.victim_positions(offsets)
+        attackers, frames = self.attacker_positions(offsets)
+        return ground_access_margins(attackers, frames, victims, self.propagation_interface.ground_constraints)[1]
+
+    def defense_margins(self, rows, offsets):
+        """
+        :param rows: Catalog rows of the defenders, shape (satellites,)
+        :param offsets: Seconds since scenario start, shape (satellites, times) or (1, times)
+        :return: Smallest margin in km of shape (satellites, times), positive while the satellite can defend. NaN where
+                 SGP4 fails
+        """
+        record = {name: values[rows] for name, values in self.record.items()}
+        defenders = sgp4_propagate(record, self.epoch_minutes[rows][:, np.newaxis] + offsets / 60)
+        victims = self.victim_positions(offsets)
+        attackers, frames = self.attacker_positions(offsets)
+
+        ground_constraints = self.propagation_interface.ground_constraints
+        AtoV, victim_access = ground_access_margins(attackers, frames, victims, ground_constraints)
+        AtoD, defender_access = ground_access_margins(attackers, frames, defenders, ground_constraints)
+        DtoV, link_access = satellite_access_margins(defenders, victims,
+                                                     self.propagation_interface.satellite_constraints)
+        return reduce(np.minimum, [
+            self.budget + AtoV - AtoD - DtoV,  # decisionDelay > 0, see range_budget
+            victim_access,  # victim above the elevation mask of the attacker
+            defender_access,  # defender above the elevation mask of the attacker
+            link_access  # earth not between defender and victim
+        ])
+
+    def refine(self, margin_function, rows, outside, inside):
+        """
+        Vectorized bisection of all brackets at once
+        :param outside: Offsets without coverage, shape (brackets,)
+        :param inside: Offsets with coverage, shape (brackets,)
+        :return: Offsets of the window edges
+        """
+        outside = outside.astype(np.float64)
+        inside = inside.astype(np.float64)
+        while rows.size and np.max(np.abs(inside - outside)) > self.tolerance:
+            middle = (inside + outside) / 2
+            covered = margin_function(rows, middle[:, np.newaxis])[:, 0] > 0
+            inside = np.where(covered, middle, inside)
+            outside = np.where(covered, outside, middle)
+
+        return (inside + outside) / 2
+
+    def candidates(self, rows, offsets, visibility_starts, visibility_ends):
+        """
+        :param rows: Catalog rows of the defenders, shape (satellites,)
+        :param offsets: Seconds since scenario start, shape (times,)
+        :param visibility_starts: Start of the windows in which the attacker can reach the victim
+        :param visibility_ends: End of these windows
+        :return: boolean array (satellites, times), True for the satellites inside the feasibility ellipsoid at the
+                 times the victim is visible. Only these times are propagated
+        """
+        window_indices = np.searchsorted(visibility_starts, offsets - self.tolerance, side="right") - 1
+        visible = (window_indices >= 0) & (offsets <= np.asarray(visibility_ends)[window_indices] + self.tolerance)
+
+        candidates = np.zeros((len(rows), len(offsets)), dtype=bool)
+        if visible.any():
+            times = self.start + np.rint(offsets[visible] * 1e6).astype(np.int64).astype("timedelta64[us]")
+            candidates[:, visible], _ = find_candidate_defenders(self.propagation_interface, times, self.tail_time,
+                                                                 rows, CANDIDATE_MARGIN)
+        return candidates
+
+    def find_windows(self, margin_function, rows, candidate_function=None):
+        """
+        :param margin_function: Called with rows (n,) and offsets (n, times) or (1, times), returns margins of shape
+                                (n, times)
+        :param rows: Rows passed to margin_function
+        :param candidate_function: Called with rows (n,) and the offsets of the coarse grid (times,), returns a
+                                   boolean array (n, times) that is False where the margin is known to be negative.
+                                   Margins are then only evaluated for the remaining pairs
+        :return: rows, start and end (seconds since scenario start) of every window, sorted by row and start
+        """
+        coarse_offsets = np.append(np.arange(0, self.duration, self.coarse_step, dtype=np.float64), self.duration)
+        block_size = max(1, EVALUATION_BLOCK_SAMPLES // len(coarse_offsets))
+
+        window_rows, window_starts, window_ends = [], [], []
+        for block_start in range(0, len(rows), block_size):
+            block_rows = rows[block_start:block_start + block_size]
+            with np.errstate(invalid="ignore"):
+                if candidate_function is None:
+                    # One row of offsets for all satellites, attacker and victim are only propagated once per sample
+                    covered = np.broadcast_to(margin_function(block_rows, coarse_offsets[np.newaxis]) > 0,
+                                              (len(block_rows), len(coarse_offsets)))
+                else:
+                    covered = candidate_function(block_rows, coarse_offsets)
+                    candidate_indices, candidate_samples = np.nonzero(covered)
+                    if candidate_indices.size:
+                        covered[candidate_indices, candidate_samples] = margin_function(
+                            block_rows[candidate_indices], coarse_offsets[candidate_samples, np.newaxis])[:, 0] > 0
+
+            # Padding turns windows that are open at the scenario start or stop into edges as well
+            edges = np.diff(np.pad(covered, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+            rise_indices, rise_samples = np.nonzero(edges == 1)
+            fall_indices, fall_samples = np.nonzero(edges == -1)
+
+            # Rising edges lie between sample - 1 (not covered) and sample (covered), falling edges between
+            # sample - 1 (covered) and sample (not covered). Edges at the scenario start and stop are exact.
+            starts = coarse_offsets[np.minimum(rise_samples, len(coarse_offsets) - 1)]
+            refined = rise_samples > 0
+            starts[refined] = self.refine(margin_function, block_rows[rise_indices[refined]],
+                                          coarse_offsets[rise_samples[refined] - 1], starts[refined])
+
+            ends = coarse_offsets[fall_samples - 1]
+            refined = fall_samples < len(coarse_offsets)
+            ends[refined] = self.refine(margin_function, block_rows[fall_indices[refined]],
+                                        coarse_offsets[np.minimum(fall_samples, len(coarse_offsets) - 1)[refined]],
+                                        ends[refined])
+
+            window_rows.append(block_rows[rise_indices])
+            window_starts.append(starts)
+            window_ends.append(ends)
+
+        if not window_rows:
+            return np.array([], dtype=np.int64), np.array([]), np.array([])
+        return np.concatenate(window_rows), np.concatenate(window_starts), np.concatenate(window_ends)
+
+    def visibility_windows(self):
+        """
+        :return: start and end of the windows in which the attacker can reach the victim
+        """
+        _, starts, ends = self.find_windows(self.visibility_margins, np.array([0]))
+        return starts, ends
+
+    def defense_windows(self, rows, visibility_starts, visibility_ends):
+        """
+        :param rows: Catalog rows of the potential defenders
+        :param visibility_starts: Start of the windows in which the attacker can reach the victim, see
+                                  visibility_windows. Nobody can defend outside of them
+        :param visibility_ends: End of these windows
+        :return: rows, start and end of the windows in which each satellite can defend the victim
+        """
+        return self.find_windows(self.defense_margins, np.asarray(rows, dtype=np.int64),
+                                 lambda block_rows, offsets: self.candidates(block_rows, offsets, visibility_starts,
+                                                                             visibility_ends))
+
+
+def union_windows(starts, ends):
+    """
+    :return: start and end of the union of all windows, sorted and non-overlapping
+    """
+    if not len(starts):
+        return np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
+
+    order = np.argsort(starts, kind="stable")
+    starts = np.asarray(starts)[order]
+    ends = np.maximum.accumulate(np.asarray(ends)[order])
+
+    # A new window begins where a start lies behind all previous ends
+    begins = np.append(True, starts[1:] > ends[:-1])
+    finishes = np.append(begins[1:], True)
+    return starts[begins], ends[finishes]
+
+
+def windows_duration(starts, ends):
+    return float(np.sum(np.asarray(ends) - np.asarray(starts)))
@@ -1,4 +1,5 @@
-import scipy
+# m/s, numpy and scipy are not needed for the scalar calculations, so they are not imported here
+SPEED_OF_LIGHT = 299792458.0
 
 bit_rate = 9600  # in bits per second
 tail_size = 6 * 8
@@ -15,7 +16,7 @@ DtoV = 200 * 1000
 
 # function to calculate the time it takes for a signal to propagate (seconds)
 def time(distance):
-    return distance / scipy.constants.speed_of_light
+    return distance / SPEED_OF_LIGHT
 
 
 def decisionDelay(AtoD, DtoV, AtoV, tailtime):
@@ -36,6 +37,25 @@ def decisionDelay(AtoD, DtoV, AtoV, tailtime):
     return tailtime - delay
 
 
+def decisionDelayBatch(AtoD, DtoV, AtoV, tailtime):
+    """
+    Array version of decisionDelay for whole catalogs and time grids
+    :param AtoD: Distances in m, shape (satellites, timestamps), NaN if not in range
+    :param DtoV: Distances in m, shape (satellites, timestamps), NaN if not in range
+    :param AtoV: Distances in m, shape (timestamps,) or (satellites, timestamps)
+    :param tailtime: Scalar or broadcastable to (satellites, timestamps)
+    :return: decision delay matrix in seconds and mask of satellites that can defend at each timestamp
+    """
+    import numpy as np
+
+    decision_delay = decisionDelay(np.asarray(AtoD, dtype=np.float64), np.asarray(DtoV, dtype=np.float64),
+                                   np.asarray(AtoV, dtype=np.float64), np.asarray(tailtime, dtype=np.float64))
+
+    # NaN distances compare as False, so out of range satellites never defend
+    can_defend = decision_delay > 0
+    return decision_delay, can_defend
+
+
 def main():
     decision_delay = decisionDelay(AtoD, DtoV, AtoV, tail_time)
     print(f"Decision delay of {decision_delay*1000}ms")
@@ -0,0 +1,131 @@
+import json
+import os
+
+import numpy as np
+
+from propagation import propagate, time_grid
+
+# Bytes of float64 positions propagated at once when filling the store, SGP4 needs a few times this while propagating
+PROPAGATION_CHUNK_BYTES = 256 * 1024 ** 2
+
+
+def element_set_keys(elements):
+    """
+    :param elements: OMM elements, e.g. from SatelliteCatalog.elements
+    :return: one key per satellite that changes whenever a new element set is published
+    """
+    return [f"{norad_cat_id}_{epoch}_{element_set_no}" for norad_cat_id, epoch, element_set_no in
+            zip(elements["NORAD_CAT_ID"].tolist(), np.datetime_as_string(elements["EPOCH"]).tolist(),
+                elements["ELEMENT_SET_NO"].tolist())]
+
+
+class EphemerisStore:
+    """
+    Propagated positions on disk, one store per scenario window and step size.
+    positions.dat holds float64 TEME positions in km with the fixed layout (satellites, times, 3), index.json maps each
+    element set to its row. The file is opened with numpy.memmap, so reading a prebuilt store doesn't copy or
+    propagate anything. Element sets that are not in the store yet are propagated once and appended in chunks of
+    PROPAGATION_CHUNK_BYTES, so filling a cold store doesn't need the positions of all satellites in memory.
+    """
+
+    def __init__(self, store_dir, start_time, stop_time, step_size):
+        """
+        :param store_dir: Directory for all stores, a sub directory is created per scenario window
+        :param start_time: STK date
+        :param stop_time: STK date
+        :param step_size: in seconds
+        """
+        self.times = time_grid(start_time, stop_time, step_size)
+        self.step = self.times[1] - self.times[0] if len(self.times) > 1 else np.timedelta64(1, "s")
+
+        window_name = "_".join(np.datetime_as_string(self.times[[0, -1]], unit="s").tolist()).replace(":", "")
+        self.path = os.path.join(store_dir, f"{window_name}_{step_size}s")
+        self.positions_file = os.path.join(self.path, "positions.dat")
+        self.index_file = os.path.join(self.path, "index.json")
+
+        self.row_bytes = len(self.times) * 3 * np.dtype(np.float64).itemsize
+
+        self.keys = []
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, "r") as f:
+                index = json.load(f)
+            self.keys = index["keys"]
+
+            # Rows after the indexed ones are orphans of an interrupted append, they are overwritten by the next one
+            expected_bytes = index.get("bytes", len(self.keys) * self.row_bytes)
+            if expected_bytes != len(self.keys) * self.row_bytes or \
+                    not os.path.isfile(self.positions_file) or os.path.getsize(self.positions_file) < expected_bytes:
+                print(f"Ephemeris store {self.path} is corrupt, positions.dat doesn't match index.json!")
+                exit(1)
+        self.key_rows = {key: row for row, key in enumerate(self.keys)}
+
+        self.positions = None
+        self.open_positions()
+
+    def open_positions(self):
+        if self.keys:
+            self.positions = np.memmap(self.positions_file, dtype=np.float64, mode="r",
+                                       shape=(len(self.keys), len(self.times), 3))
+
+    def append(self, keys, positions):
+        os.makedirs(self.path, exist_ok=True)
+
+        # Rows are only appended, existing rows never move. Appending starts right after the indexed rows, so orphan
+        # rows of an interrupted append are dropped instead of shifting every later row
+        with open(self.positions_file, "r+b" if os.path.isfile(self.positions_file) else "wb") as f:
+            f.seek(len(self.keys) * self.row_bytes)
+            f.truncate()
+            f.write(np.ascontiguousarray(positions, dtype=np.float64).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        for key in keys:
+            self.key_rows[key] = len(self.keys)
+            self.keys.append(key)
+
+        # Replace index atomically, an interrupted write must not corrupt the store
+        temporary_index_file = self.index_file + ".tmp"
+        with open(temporary_index_file, "w") as f:
+            json.dump({"times": len(self.times), "bytes": len(self.keys) * self.row_bytes, "keys": self.keys}, f)
+        os.replace(temporary_index_file, self.index_file)
+
+        self.open_positions()
+
+    def get_positions(self, elements, time_indices=None):
+        """
+        :param elements: OMM elements, e.g. from SatelliteCatalog.elements
+        :param time_indices: Times of the store to read (see time_indices), all if None
+        :return: positions of shape (satellites, times, 3), a view of the file if the rows are stored in order and all
+                 times are read
+        """
+        keys = element_set_keys(elements)
+
+        # Unique, an element set listed twice must only be appended once
+        missing = list({key: index for index, key in enumerate(keys) if key not in self.key_rows}.values())
+        if missing:
+            print(f"Propagating {len(missing)} element sets missing in ephemeris store {self.path}")
+            chunk_size = max(PROPAGATION_CHUNK_BYTES // self.row_bytes, 1)
+            for chunk_start in range(0, len(missing), chunk_size):
+                chunk = missing[chunk_start:chunk_start + chunk_size]
+                chunk_elements = {field: values[chunk] for field, values in elements.items()}
+                self.append([keys[index] for index in chunk], propagate(chunk_elements, self.times))
+
+        rows = np.array([self.key_rows[key] for key in keys], dtype=np.int64)
+        if time_indices is not None:
+            # Only the requested times of each row are read from the file
+            return self.positions[rows[:, np.newaxis], np.asarray(time_indices)[np.newaxis, :]]
+        if len(rows) and np.all(np.diff(rows) == 1):
+            return self.positions[rows[0]:rows[-1] + 1]
+        return self.positions[rows]
+
+    def time_indices(self, times):
+        """
+        :param times: datetime64 array
+        :return: index of each time in the store, None if any of them is not on the time grid of the store
+        """
+        offsets = np.asarray(times, dtype="datetime64[us]") - self.times[0]
+        indices = offsets // self.step
+        if np.any(offsets % self.step != np.timedelta64(0)) or np.any(indices < 0) or \
+                np.any(indices >= len(self.times)):
+            return None
+        return indices.astype(np.int64)
@@ -1,35 +1,54 @@
 import json
 import os.path
-import string
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from decision_window_calc import decisionDelay
-from sat_manager import get_ssc_mapping_from_file
-from stk_interface import STKInterface
+import numpy as np
+
+from decision_window_calc import decisionDelay, decisionDelayBatch
+from geometry_backend import convert_name, create_stk_backend
+from instrumentation import PhaseTimer, ProgressPrinter, print_phases, run_profiled
+from propagation import PropagationInterface, time_grid
+from results_journal import ResultsJournal
+from results_store import ResultsStore, catalog_keys
+from sat_manager import get_satellite_catalog, get_ssc_mapping_from_file, prefilter_orbital_shells
+from sharding import get_worker_interface, run_sharded
+from spatial_index import find_candidate_defenders
+from stk_dates import lookup_ranges
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Scenario of STK/STK_Exp1 for the sgp4 backend (see Attacker.f and Victim_OPS-SAT_44878.sa)
+ATTACKER_POSITION = (32.790241, -117.252447, -0.032479)  # latitude, longitude in degrees, altitude in km
+VICTIM_SSC_NUMBER = "44878"
+SCENARIO_START_TIME = "1 Jan 2024 02:59:45.000000000"
+SCENARIO_STOP_TIME = "1 Jan 2024 03:01:45.000000000"
 
-def convert_name(satellite_name):
-    satellite_name = satellite_name.replace(" ", "_")
-    allowed_chars = string.ascii_letters + string.digits + "_"
+# Timings of the STK calls, recorded by every stk run and used by the stk-sim backend
+STK_TIMINGS_FILE = "stk_call_timings.json"
 
-    satellite_name = "".join(filter(lambda c: c in allowed_chars, list(satellite_name)))
-    return satellite_name
+# Default settings of the experiment, see README.md
+TARGET_TIME = "1 Jan 2024 03:00:45.000000000"
+BIT_RATE = 9600  # in bits per second
+TAIL_SIZE = 6 * 8  # in bits
+CELESTRAK_FILE = "celestrak.json"
 
 
-def show_results_in_stk():
+def show_results_in_stk(report_file=None, celestrak_file=CELESTRAK_FILE):
+    """
+    :param report_file: Report of Experiment 1, results/report_Exp1.json if None
+    :param celestrak_file: Catalog used for the SSC numbers of the defenders
+    """
     # Load report
-    results_dir = os.path.join(BASE_DIR, "results")
-    report_file = os.path.join(results_dir, "report.json")
+    if report_file is None:
+        report_file = os.path.join(BASE_DIR, "results", "report_Exp1.json")
     with open(report_file, "r") as outfile:
         results = json.load(outfile)
 
     # Setup STK
+    from stk_interface import STKInterface
     stk_interface = STKInterface(cleanup=False) # False, so satellites stay in scenario
 
     # Get ssc number mapping
-    celestrak_file = "celestrak.json"
     satellite_ssc_number_mapping = get_ssc_mapping_from_file(celestrak_file)
 
     # Get satellites capable of defending
@@ -45,49 +64,70 @@ def show_results_in_stk():
         stk_interface.add_satellite(stk_satellite_name, ssc_number)
 
 
-def one_to_one_experiment():
-    # Time run
-    experiment_start = datetime.now()
+def prune_ssc_mapping(propagation_interface, satellite_ssc_number_mapping, times, tail_time, margin):
+    # Keep satellites that are inside the feasibility ellipsoid at any of the times
+    candidates, _ = find_candidate_defenders(propagation_interface, times, tail_time, margin=margin)
+    candidate_ssc_numbers = set(propagation_interface.elements["NORAD_CAT_ID"][candidates.any(axis=1)].tolist())
 
-    # Setup STK
-    stk_interface = STKInterface()
+    pruned_mapping = {satellite_name: ssc_number for satellite_name, ssc_number in satellite_ssc_number_mapping.items()
+                      if int(ssc_number) in candidate_ssc_numbers}
+    print(f"Pruned {len(satellite_ssc_number_mapping) - len(pruned_mapping)} of {len(satellite_ssc_number_mapping)} "
+          f"satellites outside the feasibility ellipsoid")
+    return pruned_mapping
 
-    # Set experiment time
-    target_time = "1 Jan 2024 03:00:45.000000000"
 
-    # Set experiment bit_rate and related parameters
-    bit_rate = 9600  # in bits per second
-    tail_size = 6 * 8
-    tail_time = 1 / bit_rate * tail_size
+def range_at(interface, object1, object2, target_offset):
+    """
+    :return: Range in m at the target time (seconds since scenario start), NaN if not in range
+    """
+    offsets, ranges = interface.get_range_data(object1, object2)
+    return lookup_ranges(offsets, ranges, [target_offset])[0] * 1000
 
-    # Get all active satellites and their SSC number
-    celestrak_file = "celestrak.json"
-    satellite_ssc_number_mapping = get_ssc_mapping_from_file(celestrak_file)
+
+def find_defenders_stk(stk_interface, satellite_ssc_number_mapping, target_time, tail_time, journal=None,
+                       timer=None):
+    """
+    :param timer: PhaseTimer for the STK calls and decisions
+    """
+    if timer is None:
+        timer = PhaseTimer()
 
     # Get attacker and victim form stk scenario
     attacker = stk_interface.attacker_object
     victim = stk_interface.victim_object
 
+    # Look up the target time by its offset, the report times and target_time differ in their format
+    target_offset = stk_interface.time_offsets([target_time])[0]
+
     # Calculate static values for experiment
-    AtoV = None
-    AtoV_aer = stk_interface.get_aer_report_data(attacker, victim)
-    if AtoV_aer:
-        if target_time in AtoV_aer.keys():
-            AtoV = AtoV_aer[target_time] * 1000  # we want it in m
-    if not AtoV:
+    with timer.phase("AER execution"):
+        AtoV = range_at(stk_interface, attacker, victim, target_offset)
+    if np.isnan(AtoV):
         # Not in range during the time window of the simulation
         print(f"Attacker and Victim are not in range of each other!")
         exit(1)
 
+    # Satellites checked before a restart are not simulated again
+    finished_satellites = set()
+    if journal is not None:
+        finished_satellites = {entry["satellite"] for entry in journal.entries}
+
     # Start experiment
     print("Starting experiment...")
     report = {}
+    progress_printer = ProgressPrinter()
     loop_round = 0
     for satellite_name, ssc_number in satellite_ssc_number_mapping.items():
         # Give user feedback
         loop_round += 1
         progress = (loop_round / len(satellite_ssc_number_mapping)) * 100
-        print(f"Run {loop_round} of {len(satellite_ssc_number_mapping)} | {progress}% done")
+        progress_printer.print(f"Run {loop_round} of {len(satellite_ssc_number_mapping)} | {progress:.1f}% done",
+                               force=loop_round == len(satellite_ssc_number_mapping))
+
+        if satellite_name in finished_satellites:
+            timer.count("satellites resumed from journal")
+            continue
+        timer.count("satellites checked")
 
         # Artificial limit
         """if round >= 150:
@@ -95,73 +135,316 @@ def one_to_one_experiment():
 
         # Add current defender satellite to stk scenario
         stk_satellite_name = "Defender_" + convert_name(satellite_name)
-        defender = stk_interface.add_satellite(stk_satellite_name, ssc_number)
-
-        # Calculate distances
-        AtoD = None
-        AtoD_aer = stk_interface.get_aer_report_data(attacker, defender)
-        if AtoD_aer:
-            if target_time in AtoD_aer.keys():
-                AtoD = AtoD_aer[target_time] * 1000  # we want it in m
-        if not AtoD:
-            # Not in range during the time window of the simulation
-            stk_interface.remove_satellite(defender)
-            continue
+        with timer.phase("add satellite"):
+            defender = stk_interface.add_satellite(stk_satellite_name, ssc_number)
 
-        DtoV = None
-        DtoV_aer = stk_interface.get_aer_report_data(defender, victim)
-        if DtoV_aer:
-            if target_time in DtoV_aer.keys():
-                DtoV = DtoV_aer[target_time] * 1000  # we want it in m
-        if not DtoV:
-            # Not in range during the time window of the simulation
-            stk_interface.remove_satellite(defender)
-            continue
+        # Calculate distances, NaN if not in range during the time window of the simulation
+        with timer.phase("AER execution"):
+            AtoD = range_at(stk_interface, attacker, defender, target_offset)
+            DtoV = range_at(stk_interface, defender, victim, target_offset) if not np.isnan(AtoD) else np.nan
 
         # Calculate decision delay in seconds
-        decision_delay = decisionDelay(AtoD, DtoV, AtoV, tail_time)
-
-        # Check if we could react
-        if decision_delay > 0:
-            report[satellite_name] = {
-                "AtoV": AtoV,
-                "AtoD": AtoD,
-                "DtoV": DtoV,
-                "decision_delay": decision_delay
-            }
+        result = None
+        if not np.isnan(DtoV):
+            with timer.phase("decision evaluation"):
+                decision_delay = decisionDelay(AtoD, DtoV, AtoV, tail_time)
+
+            # Check if we could react
+            if decision_delay > 0:
+                result = {
+                    "AtoV": float(AtoV),
+                    "AtoD": float(AtoD),
+                    "DtoV": float(DtoV),
+                    "decision_delay": float(decision_delay)
+                }
+
+        if result:
+            report[satellite_name] = result
+        if journal is not None:
+            with timer.phase("journal write"):
+                journal.append({"satellite": satellite_name, "defender": result})
 
         # Cleanup for next iteration
-        stk_interface.remove_satellite(defender)
+        with timer.phase("cleanup"):
+            stk_interface.remove_satellite(defender)
+
+    # Report is assembled from the journal, so it includes the satellites of previous runs
+    if journal is not None:
+        report = {entry["satellite"]: entry["defender"] for entry in journal.entries if entry["defender"]}
+
+    return report
+
+
+def stored_report(results_store, satellite_names, satellite_keys):
+    """
+    :param satellite_names: Satellites of the report in report order
+    :param satellite_keys: Mapping from satellite name to element set key
+    :return: report of all satellites with a stored result that can defend
+    """
+    report = {}
+    for satellite_name in satellite_names:
+        result = results_store.get(satellite_keys[satellite_name])
+        if result:
+            report[satellite_name] = result
+    return report
+
+
+def get_AtoV_sgp4(propagation_interface, target_time):
+    # Single sample at target time
+    times = time_grid(target_time, target_time, 1)
+
+    attacker = propagation_interface.attacker_object
+    victim = propagation_interface.victim_object
+    AtoV = propagation_interface.get_range_series(attacker, victim, times)[0] * 1000  # we want it in m
+    if np.isnan(AtoV):
+        # Not in range at target time
+        print(f"Attacker and Victim are not in range of each other!")
+        exit(1)
+
+    return AtoV, times
+
+
+def find_defenders_sgp4(propagation_interface, target_time, tail_time, rows=None, timer=None):
+    """
+    :param rows: Catalog rows to check, all if None
+    :param timer: PhaseTimer for propagation and decisions
+    """
+    if timer is None:
+        timer = PhaseTimer()
+
+    victim = propagation_interface.victim_object
+
+    # Calculate static values for experiment
+    AtoV, times = get_AtoV_sgp4(propagation_interface, target_time)
+
+    # Propagate all satellites at once and keep the satellites inside the feasibility ellipsoid
+    print("Starting experiment...")
+    if rows is None:
+        rows = np.arange(len(propagation_interface.elements["NORAD_CAT_ID"]))
+    with timer.phase("propagate"):
+        candidates, catalog_positions = find_candidate_defenders(propagation_interface, times, tail_time, rows)
+    candidate_indices = np.nonzero(candidates[:, 0])[0]
+    candidate_rows = rows[candidate_indices]
+    print(f"{len(candidate_rows)} of {len(candidates)} satellites are candidates")
+    timer.count("satellites checked", len(rows))
+    timer.count("candidates", len(candidate_rows))
+
+    with timer.phase("range calculation"):
+        candidate_positions = catalog_positions[candidate_indices]
+        AtoD, DtoV = propagation_interface.get_defender_ranges(candidate_positions, times)
+        AtoD = AtoD[:, 0] * 1000  # we want it in m
+        DtoV = DtoV[:, 0] * 1000
+
+    # Calculate decision delay in seconds
+    with timer.phase("decision evaluation"):
+        decision_delay, can_defend = decisionDelayBatch(AtoD, DtoV, AtoV, tail_time)
+
+    # The victim can't protect itself
+    can_defend &= propagation_interface.elements["NORAD_CAT_ID"][candidate_rows] != int(victim.ssc_number)
+
+    report = {}
+    for index in np.nonzero(can_defend)[0]:
+        report[str(propagation_interface.elements["OBJECT_NAME"][candidate_rows[index]])] = {
+            "AtoV": float(AtoV),
+            "AtoD": float(AtoD[index]),
+            "DtoV": float(DtoV[index]),
+            "decision_delay": float(decision_delay[index])
+        }
+
+    return report
+
+
+def find_defenders_sgp4_shard(rows, target_time, tail_time):
+    return find_defenders_sgp4(get_worker_interface(), target_time, tail_time, rows)
+
+
+def find_defenders_sharded(propagation_interface, catalog, target_time, tail_time, workers, rows=None):
+    """
+    :param rows: Catalog rows to check, all if None
+    """
+    # Fail before starting the workers
+    get_AtoV_sgp4(propagation_interface, target_time)
+
+    if rows is None:
+        rows = np.arange(len(catalog))
+    partial_reports, _ = run_sharded(find_defenders_sgp4_shard, rows, propagation_interface, catalog, workers,
+                                     args=(target_time, tail_time))
+
+    # Shards are returned in catalog order, so the report matches the one of find_defenders_sgp4
+    report = {}
+    for partial_report in partial_reports:
+        report.update(partial_report)
+
+    return report
+
+
+def one_to_one_experiment(backend="stk", prune_margin=None, resume=True, workers=None, latency_scale=1.0,
+                          profiler=None, results_store=None, target_time=TARGET_TIME, bit_rate=BIT_RATE,
+                          tail_size=TAIL_SIZE, celestrak_file=CELESTRAK_FILE):
+    """
+    :param backend: "stk" to simulate each satellite in the running STK instance, "sgp4" to propagate the
+                    CelesTrak elements in-process, "stk-sim" to run the stk code path against a local stand-in
+                    (see SimulatedSTKInterface)
+    :param prune_margin: Only for the stk backend. If set, satellites that are not inside the feasibility ellipsoid
+                         according to SGP4 (plus this margin in km) are not loaded into STK
+    :param resume: Only for the stk backend. Continue the run of results/journal_Exp1.jsonl if it has the same setup
+    :param workers: Only for the sgp4 backend. If set, the catalog is split into shards that are evaluated by this
+                    many processes
+    :param latency_scale: Only for the stk-sim backend. Factor for the latency of the STK calls, 0 to not wait at all
+    :param profiler: "cprofile" or "pyinstrument" to profile the run into results/profile_Exp1.prof/.html
+    :param results_store: Only for the sgp4 backend. Directory of a ResultsStore. Satellites whose element set was
+                          already evaluated with the same parameters are taken from the store, only new or changed
+                          ones are evaluated. STK loads the element sets from its online source, so its results are
+                          not tied to the local element sets the store is keyed by
+    :param target_time: STK date at which the attacker sends the tail, within the STK scenario for the stk backend
+    :param bit_rate: In bits per second
+    :param tail_size: In bits
+    :param celestrak_file: Satellite catalog in the CelesTrak JSON format
+    """
+    arguments = dict(locals())
+    if results_store is not None and backend != "sgp4":
+        print("The results store is only available for the sgp4 backend, STK doesn't use the element sets of the "
+              "catalog!")
+        exit(1)
+    if profiler is not None:
+        results_dir = os.path.join(BASE_DIR, "results")
+        if not os.path.isdir(results_dir):
+            os.mkdir(results_dir)
+        return run_profiled(lambda: one_to_one_experiment(**{**arguments, "profiler": None}),
+                            profiler, os.path.join(results_dir, "profile_Exp1"))
 
     # Time run
-    experiment_end = datetime.now()
-    print(f"Start: {experiment_start}")
-    print(f"End: {experiment_end}")
-    print(f"Runtime: {experiment_end - experiment_start}")
+    experiment_start = datetime.now()
+    timer = PhaseTimer()
 
-    output = {
-        "setup": {
-            "Attacker": stk_interface.attacker_object.InstanceName,
-            "Victim": stk_interface.victim_object.InstanceName,
-            "Target Time": target_time,
-            "Bit rate": bit_rate
-        },
-        "runtime": {
-            "start": str(experiment_start),
-            "end": str(experiment_end),
-            "runtime": str(experiment_end - experiment_start)
-        },
-        "report": report
+    # Set experiment bit_rate and related parameters
+    tail_time = 1 / bit_rate * tail_size
+
+    # Get all active satellites and their SSC number
+    with timer.phase("catalog load"):
+        catalog = get_satellite_catalog(celestrak_file)
+
+        # Drop satellites that never get low enough to defend the victim
+        catalog = prefilter_orbital_shells(catalog, VICTIM_SSC_NUMBER, tail_time,
+                                           attacker_altitude=ATTACKER_POSITION[2])
+
+    with timer.phase("backend setup"):
+        if backend == "sgp4":
+            interface = PropagationInterface(catalog, target_time, target_time, ATTACKER_POSITION,
+                                             VICTIM_SSC_NUMBER)
+        else:
+            # Setup STK
+            interface = create_stk_backend(backend, catalog, SCENARIO_START_TIME, SCENARIO_STOP_TIME,
+                                           ATTACKER_POSITION, VICTIM_SSC_NUMBER,
+                                           os.path.join(BASE_DIR, "results", STK_TIMINGS_FILE), latency_scale)
+            satellite_ssc_number_mapping = catalog.get_ssc_mapping()
+
+    if backend != "sgp4" and prune_margin is not None:
+        with timer.phase("prune"):
+            propagation_interface = PropagationInterface(catalog, target_time, target_time,
+                                                         ATTACKER_POSITION, VICTIM_SSC_NUMBER)
+            satellite_ssc_number_mapping = prune_ssc_mapping(propagation_interface, satellite_ssc_number_mapping,
+                                                             time_grid(target_time, target_time, 1), tail_time,
+                                                             prune_margin)
+
+    setup = {
+        "Attacker": interface.attacker_object.InstanceName,
+        "Victim": interface.victim_object.InstanceName,
+        "Target Time": target_time,
+        "Bit rate": bit_rate,
+        "Tail size": tail_size,
+        "Tail time": tail_time,
+        "Backend": backend,
+        "Celestrak file": celestrak_file,
+        "Satellites after prefilter": len(catalog)
     }
 
-    # Store report
+    store = None
+    if results_store is not None:
+        # Results only depend on the element sets of the defender and the victim besides these parameters
+        satellite_keys = catalog_keys(catalog)
+        store = ResultsStore(results_store, {
+            "Experiment": "Exp1",
+            "Attacker": ATTACKER_POSITION,
+            "Victim": satellite_keys[catalog.row_by_ssc_number(VICTIM_SSC_NUMBER)],
+            "Target Time": target_time,
+            "Tail time": tail_time,
+            "Backend": backend
+        })
+        setup["Results store"] = store.path
+
     results_dir = os.path.join(BASE_DIR, "results")
     if not os.path.isdir(results_dir):
         os.mkdir(results_dir)
 
-    report_file = os.path.join(results_dir, "report_Exp1.json")
-    with open(report_file, "w") as outfile:
-        json.dump(output, outfile, indent=1)
+    journal = None
+    if backend == "sgp4":
+        rows = np.arange(len(catalog))
+        if store is not None:
+            rows = rows[store.split(satellite_keys)]
+            print(f"{len(catalog) - len(rows)} of {len(catalog)} satellites are in the results store")
+
+        if not len(rows):
+            report = {}
+        elif workers is not None:
+            # Phases of the workers are not collected, only the whole sharded evaluation is timed
+            with timer.phase("sharded evaluation"):
+                report = find_defenders_sharded(interface, catalog, target_time, tail_time, workers, rows)
+        else:
+            report = find_defenders_sgp4(interface, target_time, tail_time, rows, timer)
+
+        if store is not None:
+            satellite_names = catalog["OBJECT_NAME"].tolist()
+            store.put_many({satellite_keys[row]: report.get(satellite_names[row]) for row in rows})
+            report = stored_report(store, satellite_names, dict(zip(satellite_names, satellite_keys)))
+    else:
+        # Stream each checked satellite to the journal, a crashed run continues where it stopped
+        journal = ResultsJournal(os.path.join(results_dir, "journal_Exp1.jsonl"), setup, resume)
+        report = find_defenders_stk(interface, satellite_ssc_number_mapping, target_time, tail_time, journal, timer)
+        timer.count("AER cache hits", interface.aer_cache.hits)
+        timer.count("AER cache misses", interface.aer_cache.misses)
+        if backend == "stk-sim":
+            for call_name, call_count in interface.call_counts.items():
+                timer.count(f"simulated {call_name} calls", call_count)
+    if store is not None:
+        timer.count("results store hits", store.hits)
+        timer.count("results store misses", store.misses)
+
+    # Time run
+    experiment_end = datetime.now()
+    print(f"Start: {experiment_start}")
+    print(f"End: {experiment_end}")
+    print(f"Runtime: {experiment_end - experiment_start}")
+
+    # The report write itself is only in the printed summary, it ends after the runtime block is serialized
+    with timer.phase("report write"):
+        output = {
+            "setup": setup,
+            "runtime": {
+                "start": str(experiment_start),
+                "end": str(experiment_end),
+                "runtime": str(experiment_end - experiment_start),
+                **timer.to_dict()
+            },
+            "report": report
+        }
+
+        # Store report
+        report_file = os.path.join(results_dir, "report_Exp1.json")
+        with open(report_file, "w") as outfile:
+            json.dump(output, outfile, indent=1)
+
+    # Run is complete, the next one starts from scratch
+    if journal is not None:
+        journal.remove()
+
+    print_phases(timer)
+
+    if backend == "stk":
+        interface.save_call_timings(os.path.join(results_dir, STK_TIMINGS_FILE))
+    elif backend == "stk-sim":
+        print(f"STK calls: {dict(interface.call_counts)} | Simulated STK latency: "
+              f"{timedelta(seconds=interface.simulated_latency)}")
 
 
 if __name__ == "__main__":
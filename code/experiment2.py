@@ -2,9 +2,22 @@ import json
 import os.path
 from datetime import datetime, timedelta
 
-from decision_window_calc import decisionDelay
-from sat_manager import get_ssc_mapping_from_file
-from stk_interface import STKInterface
+import numpy as np
+
+from columnar_report import ColumnarReportWriter, export_json
+from coverage_windows import CoverageWindows, union_windows, windows_duration
+from decision_window_calc import decisionDelay, decisionDelayBatch
+from ephemeris_store import EphemerisStore
+from geometry_backend import create_stk_backend
+from instrumentation import PhaseTimer, ProgressPrinter, print_phases, run_profiled
+from propagation import PropagationInterface
+from results_journal import ResultsJournal
+from results_store import ResultsStore, catalog_keys
+from sat_manager import build_constellation_index, get_satellite_catalog, prefilter_orbital_shells
+from sharding import get_worker_coverage, get_worker_interface, run_sharded
+from spatial_index import find_candidate_defenders
+from stk_dates import lookup_ranges, offsets_to_datetime64
+from top_defenders import TopDefenders
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -12,166 +25,783 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # CONSTELLATIONS = ["globalstar", "iridium", "jilin", "beidou", "orbcomm", "kepler"]
 CONSTELLATIONS = ["starlink"]
 
-def set_animation_time(stk_interface, start_time, target_time):
-    start_time_datetime = stk_interface.stk_date_to_datetime(start_time)
-    target_time_datetime = stk_interface.stk_date_to_datetime(target_time)
+# Scenario of STK/STK_Exp2 for the sgp4 backend (see Attacker.f and Victim_OPS-SAT_44878.sa)
+ATTACKER_POSITION = (32.790241, -117.252447, -0.032479)  # latitude, longitude in degrees, altitude in km
+VICTIM_SSC_NUMBER = "44878"
 
-    offset_in_seconds = target_time_datetime - start_time_datetime
-    stk_interface.root.CurrentTime = offset_in_seconds.total_seconds()
+# Timings of the STK calls, recorded by every stk run and used by the stk-sim backend
+STK_TIMINGS_FILE = "stk_call_timings.json"
 
-def many_to_one_experiment():
-    # Time run
-    experiment_start = datetime.now()
-
-    # Setup STK
-    stk_interface = STKInterface()
-
-    # Set experiment time window
-    time_window_start = "1 Jan 2024 00:00:00.000000000"
-    time_window_end = "2 Jan 2024 00:00:00.000000000"
-    stk_interface.scenario.SetTimePeriod(time_window_start, time_window_end)
+# Default settings of the experiment, see README.md
+TIME_WINDOW_START = "1 Jan 2024 00:00:00.000000000"
+TIME_WINDOW_END = "2 Jan 2024 00:00:00.000000000"
+TIME_STEP_SIZE = 60  # 10  # sec
+TAIL_TIME = 8 / 1000  # sec
+CELESTRAK_FILE = "celestrak.json"
 
-    # Set experiment step size of time
-    time_step_size = 60 # 10  # sec
+# Time slots evaluated in float64 as well to check precision="float32" without time blocks
+PRECISION_CHECK_SLOTS = 256
 
-    # Set experiment bit_rate and related parameters
-    """bit_rate = 9600  # in bits per second
-    tail_size = 6 * 8
-    tail_time = 1 / bit_rate * tail_size"""
-    tail_time = 8 / 1000
+def set_animation_time(stk_interface, target_offset):
+    # Animation time is given in seconds since scenario start
+    stk_interface.root.CurrentTime = float(target_offset)
 
-
-    # Get all active satellites and their SSC number
-    celestrak_file = "celestrak.json"
-    satellite_ssc_number_mapping = get_ssc_mapping_from_file(celestrak_file)
+def find_constellation_defenders_stk(stk_interface, sat_name_ssc_map, target_times, AtoV_offsets, AtoV_ranges,
+                                     tail_time, experiment_start, constellation_name, constellation_progress,
+                                     journal=None, timer=None):
+    """
+    :param timer: PhaseTimer for the STK calls and decisions
+    """
+    if timer is None:
+        timer = PhaseTimer()
 
     # Get attacker and victim form stk scenario
     attacker = stk_interface.attacker_object
     victim = stk_interface.victim_object
 
-    # Start experiment
-    print("Starting experiment...")
+    time_defender_mapping = {}
+    # Fill time_defender_mapping with time slot where we need to defend
+    for target_time in target_times:
+        time_defender_mapping[target_time] = {}
+
+    # Restore the satellites checked before a restart, they are not simulated again
+    finished_satellites = set()
+    if journal is not None:
+        for entry in journal.entries:
+            if entry.get("constellation") == constellation_name and "satellite" in entry:
+                finished_satellites.add(entry["satellite"])
+                for target_time, defender in entry["defenders"].items():
+                    time_defender_mapping[target_time][entry["satellite"]] = defender
+
+    # For each satellite in constellation check time at which they can protect
+    time_for_one_check = timedelta(minutes=3)
+    progress_printer = ProgressPrinter()
+    satellite_loop_round = 0
+    for satellite_name, satellite_ssc_number in sat_name_ssc_map.items():
+        satellite_loop_round += 1
+
+        # For runtime estimations
+        one_check_start = datetime.now()
+
+        # Skip if we already defend all time slots
+        if all(time_defender_mapping.values()):
+            print(f"Skipping checks for {constellation_name}. All time slots already defended!")
+            break
+
+        if satellite_name in finished_satellites:
+            timer.count("satellites resumed from journal")
+            continue
+        timer.count("satellites checked")
+
+        # Give feedback during run, at most every few seconds
+        satellite_progress = round((satellite_loop_round / len(sat_name_ssc_map.keys())) * 100, 3)
+        current_runtime = datetime.now() - experiment_start
+        satellites_checks_left = len(sat_name_ssc_map.keys()) - satellite_loop_round
+        estimated_runtime = current_runtime + time_for_one_check * satellites_checks_left
+        progress_printer.print(f"Checking {satellite_name} | Satellite {satellite_progress}% | Constellation "
+                               f"{constellation_progress}% | Runtime: {current_runtime} | Estimated runtime until next "
+                               f"constellation check {estimated_runtime}")
+
+        # Add satellite to simulation
+        stk_satellite_name = stk_interface.convert_name(satellite_name)
+        with timer.phase("add satellite"):
+            satellite_object = stk_interface.add_satellite(stk_satellite_name, satellite_ssc_number)
 
-    # Get slots of victim in range of attacker during experiment time window
-    AtoV_time_range_map = stk_interface.get_aer_report_data(attacker, victim, step_size=time_step_size)
+        # Range series over the whole time window, fetched once and aligned to the time slots
+        with timer.phase("AER execution"):
+            AtoD_offsets, AtoD_ranges = stk_interface.get_range_data(attacker, satellite_object)
+            DtoV_offsets, DtoV_ranges = stk_interface.get_range_data(satellite_object, victim)
+            AtoD_slots = lookup_ranges(AtoD_offsets, AtoD_ranges, AtoV_offsets) * 1000  # we want it in m
+            DtoV_slots = lookup_ranges(DtoV_offsets, DtoV_ranges, AtoV_offsets) * 1000  # we want it in m
+
+        # Check for each timeslot in which we need protection
+        satellite_defenders = {}
+        for slot, target_time in enumerate(target_times):
+            # Skip if we already have a defender for that time slot
+            if time_defender_mapping[target_time]:
+                continue
+
+            # Set animation time to target time to have visual feedback
+            set_animation_time(stk_interface, AtoV_offsets[slot])
+
+            # Calculate distances
+            AtoD = AtoD_slots[slot]
+            if np.isnan(AtoD):
+                # Defender not in range of attacker
+                continue
+
+            DtoV = DtoV_slots[slot]
+            if np.isnan(DtoV):
+                # Victim not in range of defender
+                continue
+
+            # Calculate decision delay in seconds
+            AtoV = AtoV_ranges[slot]
+            AtoV_meters = AtoV * 1000
+            with timer.phase("decision evaluation"):
+                decision_delay = decisionDelay(AtoD, DtoV, AtoV_meters, tail_time)
 
-    if not AtoV_time_range_map:
-        print("Attacker is never in range of victim in this scenario!")
+            # Check if satellite could react
+            if decision_delay > 0:
+                satellite_defenders[target_time] = {
+                    "AtoV": float(AtoV),
+                    "AtoD": float(AtoD),
+                    "DtoV": float(DtoV),
+                    "decision_delay": float(decision_delay)
+                }
+                time_defender_mapping[target_time][satellite_name] = satellite_defenders[target_time]
+
+        # Remove satellite from simulation
+        with timer.phase("cleanup"):
+            stk_interface.remove_satellite(satellite_object)
+
+        if journal is not None:
+            with timer.phase("journal write"):
+                journal.append({"constellation": constellation_name, "satellite": satellite_name,
+                                "defenders": satellite_defenders})
+
+        # For runtime estimations
+        one_check_end = datetime.now()
+        time_for_one_check = one_check_end - one_check_start
+
+    return time_defender_mapping
+
+def evaluate_constellation_defenders_sgp4(propagation_interface, rows, slot_times, AtoV_ranges, tail_time,
+                                          timer=None, dtype=np.float64):
+    """
+    :param timer: PhaseTimer for propagation and decisions
+    :param dtype: Precision of the positions, see PropagationInterface.propagate_catalog
+    :return: catalog rows, time slot indices, AtoD and DtoV in m and decision delays of the satellite/slot pairs that
+             can defend
+    """
+    if timer is None:
+        timer = PhaseTimer()
+
+    victim = propagation_interface.victim_object
+
+    # Propagate the whole constellation over all slots at once and keep the satellite/slot pairs inside the
+    # feasibility ellipsoid
+    with timer.phase("propagate"):
+        candidates, positions = find_candidate_defenders(propagation_interface, slot_times, tail_time, rows,
+                                                         dtype=dtype)
+    satellite_indices, slot_indices = np.nonzero(candidates)
+    print(f"{len(satellite_indices)} of {candidates.size} satellite/slot pairs are candidates")
+    timer.count("satellites checked", len(rows))
+    timer.count("candidate pairs", len(satellite_indices))
+
+    with timer.phase("range calculation"):
+        pair_positions = positions[satellite_indices, slot_indices][np.newaxis]
+        pair_times = slot_times[slot_indices]
+        AtoD, DtoV = propagation_interface.get_defender_ranges(pair_positions, pair_times)
+        AtoD = AtoD[0] * 1000  # we want it in m
+        DtoV = DtoV[0] * 1000  # we want it in m
+
+    # Calculate decision delay in seconds for all candidate pairs
+    AtoV = AtoV_ranges
+    with timer.phase("decision evaluation"):
+        decision_delay, can_defend = decisionDelayBatch(AtoD, DtoV, AtoV[slot_indices] * 1000, tail_time)
+
+    # The victim can't protect itself
+    can_defend &= propagation_interface.elements["NORAD_CAT_ID"][rows[satellite_indices]] != int(victim.ssc_number)
+
+    pairs = np.nonzero(can_defend)[0]
+    return rows[satellite_indices[pairs]], slot_indices[pairs], AtoD[pairs], DtoV[pairs], decision_delay[pairs]
+
+def evaluate_constellation_blocks(propagation_interface, rows, slot_times, AtoV_ranges, tail_time,
+                                  time_block_size=None, chunk_size=None, dtype=np.float64, timer=None):
+    """
+    Evaluates the satellite/slot pairs in blocks of time slots and chunks of satellites, each block is reduced to the
+    pairs that can defend before the next one is propagated. So only positions of time_block_size x chunk_size are in
+    memory at once, independent of the length of the time window.
+    :param time_block_size: Time slots per block, all at once if None
+    :param chunk_size: Satellites per chunk, all at once if None
+    :param dtype: Precision of the positions, see PropagationInterface.propagate_catalog
+    :return: iterator over the results of evaluate_constellation_defenders_sgp4, slot indices into slot_times. Chunks
+             of a block are in catalog order and blocks in time order
+    """
+    time_block_size = time_block_size or max(len(slot_times), 1)
+    chunk_size = chunk_size or max(len(rows), 1)
+    for block_start in range(0, len(slot_times), time_block_size):
+        block = slice(block_start, block_start + time_block_size)
+        for chunk_start in range(0, len(rows), chunk_size):
+            defender_rows, slot_indices, AtoD, DtoV, decision_delay = evaluate_constellation_defenders_sgp4(
+                propagation_interface, rows[chunk_start:chunk_start + chunk_size], slot_times[block],
+                AtoV_ranges[block], tail_time, timer, dtype)
+            yield defender_rows, slot_indices + block_start, AtoD, DtoV, decision_delay
+
+def check_precision(propagation_interface, rows, slot_times, AtoV_ranges, tail_time, dtype, chunk_size=256):
+    """
+    Evaluates the same time slots with float64 and dtype positions
+    :param chunk_size: Satellites propagated at once, see evaluate_constellation_blocks
+    :return: largest range (m) and decision delay (s) error of the pairs that can defend in both, number of pairs that
+             can only defend in one of them
+    """
+    results = []
+    for precision in (np.float64, dtype):
+        chunk_results = list(evaluate_constellation_blocks(propagation_interface, rows, slot_times, AtoV_ranges,
+                                                           tail_time, chunk_size=chunk_size, dtype=precision))
+        results.append([np.concatenate([chunk_result[index] for chunk_result in chunk_results] +
+                                       [np.array([], dtype=np.int64 if index < 2 else np.float64)])
+                        for index in range(5)])
+    pair_keys = [defender_rows * len(slot_times) + slot_indices for defender_rows, slot_indices, *_ in results]
+    common, reference_pairs, pairs = np.intersect1d(*pair_keys, return_indices=True)
+
+    reference, result = results
+    range_errors = [np.abs(result[index][pairs] - reference[index][reference_pairs]) for index in (2, 3)]
+    return {
+        "time slots": len(slot_times),
+        "max range error": float(np.max(range_errors, initial=0.0)),
+        "max decision delay error": float(np.max(np.abs(result[4][pairs] - reference[4][reference_pairs]),
+                                                 initial=0.0)),
+        "decision mismatches": len(pair_keys[0]) + len(pair_keys[1]) - 2 * len(common)
+    }
+
+def find_constellation_defenders_sgp4(propagation_interface, rows, slot_times, target_times, AtoV_ranges, tail_time,
+                                      timer=None, time_block_size=None, dtype=np.float64, chunk_size=None):
+    """
+    :param timer: PhaseTimer for propagation and decisions
+    :param time_block_size: see evaluate_constellation_blocks
+    :param chunk_size: see evaluate_constellation_blocks
+    :param dtype: Precision of the positions, see PropagationInterface.propagate_catalog
+    """
+    time_defender_mapping = {}
+    # Fill time_defender_mapping with time slot where we need to defend
+    for target_time in target_times:
+        time_defender_mapping[target_time] = {}
+
+    for defender_rows, slot_indices, AtoD, DtoV, decision_delay in evaluate_constellation_blocks(
+            propagation_interface, rows, slot_times, AtoV_ranges, tail_time, time_block_size, chunk_size, dtype,
+            timer):
+        for pair in range(len(defender_rows)):
+            satellite_name = str(propagation_interface.elements["OBJECT_NAME"][defender_rows[pair]])
+            time_defender_mapping[target_times[slot_indices[pair]]][satellite_name] = {
+                "AtoV": float(AtoV_ranges[slot_indices[pair]]),
+                "AtoD": float(AtoD[pair]),
+                "DtoV": float(DtoV[pair]),
+                "decision_delay": float(decision_delay[pair])
+            }
+
+    return time_defender_mapping
+
+def find_constellation_top_defenders_sgp4(propagation_interface, rows, slot_times, AtoV_ranges, tail_time,
+                                          top_defenders, chunk_size=256, timer=None, time_block_size=None,
+                                          dtype=np.float64):
+    """
+    Like find_constellation_defenders_sgp4, but the satellites are evaluated in chunks and only the best defenders of
+    each time slot are kept (see TopDefenders). Memory is bounded by chunk_size x slots instead of growing with the
+    constellation.
+    :param top_defenders: Defenders kept per time slot
+    :param chunk_size: Satellites propagated at once
+    :param time_block_size: see evaluate_constellation_blocks
+    :return: TopDefenders over the catalog rows
+    """
+    top = TopDefenders(len(slot_times), len(propagation_interface.elements["OBJECT_NAME"]), top_defenders)
+    for block_result in evaluate_constellation_blocks(propagation_interface, rows, slot_times, AtoV_ranges,
+                                                      tail_time, time_block_size, chunk_size, dtype, timer):
+        top.add(*block_result)
+    return top
+
+def stream_constellation_defenders_sgp4(report_writer, propagation_interface, rows, slot_times, AtoV_ranges,
+                                        tail_time, ssc_numbers, timer=None, time_block_size=None, dtype=np.float64,
+                                        chunk_size=None):
+    """
+    Like find_constellation_defenders_sgp4, but the pairs of every block are written to the columnar report right
+    away instead of being collected in a mapping
+    :param report_writer: ColumnarReportWriter with the constellation started
+    :param ssc_numbers: SSC number of each catalog row
+    """
+    satellite_names = propagation_interface.elements["OBJECT_NAME"]
+    for defender_rows, slot_indices, AtoD, DtoV, decision_delay in evaluate_constellation_blocks(
+            propagation_interface, rows, slot_times, AtoV_ranges, tail_time, time_block_size, chunk_size, dtype,
+            timer):
+        report_writer.add_defenders(slot_indices, satellite_names[defender_rows].tolist(),
+                                    ssc_numbers[defender_rows].tolist(), AtoD, DtoV, decision_delay)
+
+def stream_stored_defenders(report_writer, results_store, target_times, satellite_names, satellite_keys,
+                            ssc_numbers):
+    """
+    Writes the stored results of the satellites to the columnar report, see stored_time_defender_mapping
+    :param satellite_names: Satellites of the constellation in catalog order
+    :param satellite_keys: Element set keys of the satellites
+    :param ssc_numbers: SSC numbers of the satellites
+    """
+    time_indices = {target_time: time_index for time_index, target_time in enumerate(target_times)}
+    for satellite_name, satellite_key, ssc_number in zip(satellite_names, satellite_keys, ssc_numbers):
+        defenders = results_store.get(satellite_key)
+        report_writer.add_defenders([time_indices[target_time] for target_time in defenders],
+                                    [satellite_name] * len(defenders), [ssc_number] * len(defenders),
+                                    [defender["AtoD"] for defender in defenders.values()],
+                                    [defender["DtoV"] for defender in defenders.values()],
+                                    [defender["decision_delay"] for defender in defenders.values()])
+
+def slot_summary(coverage):
+    """
+    :param coverage: bool array, True for every defended time slot
+    :return: report of a constellation as in report_Exp2.json without the defenders
+    """
+    number_of_defended_times = int(np.count_nonzero(coverage))
+    total_number_of_target_times = len(coverage)
+    return {
+        "defended times": number_of_defended_times,
+        "not defended times": total_number_of_target_times - number_of_defended_times,
+        "defend percentage": (number_of_defended_times/total_number_of_target_times)*100
+    }
+
+def defenders_by_satellite(time_defender_mapping, satellite_names):
+    """
+    :param time_defender_mapping: Defenders of each time slot, see find_constellation_defenders_sgp4
+    :param satellite_names: Satellites to split the mapping into
+    :return: mapping from satellite name to the time slots it defends, like the journal entries of the satellites
+    """
+    defenders = {satellite_name: {} for satellite_name in satellite_names}
+    for target_time, time_defenders in time_defender_mapping.items():
+        for satellite_name, defender in time_defenders.items():
+            defenders[satellite_name][target_time] = defender
+    return defenders
+
+def stored_time_defender_mapping(results_store, target_times, satellite_names, satellite_keys):
+    """
+    Inverse of defenders_by_satellite for the stored results
+    :param satellite_names: Satellites of the constellation in catalog order
+    :param satellite_keys: Element set keys of the satellites
+    """
+    time_defender_mapping = {}
+    for target_time in target_times:
+        time_defender_mapping[target_time] = {}
+
+    for satellite_name, satellite_key in zip(satellite_names, satellite_keys):
+        for target_time, defender in results_store.get(satellite_key).items():
+            time_defender_mapping[target_time][satellite_name] = defender
+    return time_defender_mapping
+
+def find_constellation_coverage_windows(coverage_windows, rows, visibility_starts, visibility_ends, timer=None):
+    """
+    Event based counterpart of find_constellation_defenders_sgp4, see CoverageWindows
+    :param coverage_windows: CoverageWindows of the experiment
+    :param rows: Catalog rows of the constellation
+    :param visibility_starts: Start of the windows in which the attacker can reach the victim
+    :param visibility_ends: End of these windows
+    :return: report of the constellation with the exact windows of each defender instead of time slots
+    """
+    if timer is None:
+        timer = PhaseTimer()
+
+    propagation_interface = coverage_windows.propagation_interface
+    victim = propagation_interface.victim_object
+
+    # The victim can't protect itself
+    rows = rows[propagation_interface.elements["NORAD_CAT_ID"][rows] != int(victim.ssc_number)]
+    timer.count("satellites checked", len(rows))
+
+    with timer.phase("window search"):
+        window_rows, window_starts, window_ends = coverage_windows.defense_windows(rows, visibility_starts,
+                                                                                    visibility_ends)
+    timer.count("defense windows", len(window_rows))
+
+    coverage_starts, coverage_ends = union_windows(window_starts, window_ends)
+    defended_seconds = windows_duration(coverage_starts, coverage_ends)
+    visible_seconds = windows_duration(visibility_starts, visibility_ends)
+
+    defenders = {}
+    satellite_names = propagation_interface.elements["OBJECT_NAME"][window_rows].tolist()
+    start_dates = propagation_interface.offsets_to_stk_dates(window_starts).tolist()
+    end_dates = propagation_interface.offsets_to_stk_dates(window_ends).tolist()
+    for satellite_name, start_date, end_date in zip(satellite_names, start_dates, end_dates):
+        defenders.setdefault(satellite_name, []).append([start_date, end_date])
+
+    return {
+        "defended seconds": defended_seconds,
+        "not defended seconds": visible_seconds - defended_seconds,
+        "defend percentage": (defended_seconds / visible_seconds) * 100,
+        "coverage": [list(window) for window in zip(propagation_interface.offsets_to_stk_dates(coverage_starts).tolist(),
+                                                    propagation_interface.offsets_to_stk_dates(coverage_ends).tolist())],
+        "defenders": defenders
+    }
+
+def find_constellation_defenders_shard(rows, slot_times, target_times, AtoV_ranges, tail_time, chunk_size):
+    propagation_interface = get_worker_interface()
+    coverage = get_worker_coverage()
+
+    time_defender_mapping = {}
+    for target_time in target_times:
+        time_defender_mapping[target_time] = {}
+
+    for chunk in np.array_split(rows, -(-len(rows) // chunk_size)):
+        # Only time slots that no worker has defended yet, like the skips of the stk backend
+        open_slots = np.nonzero(~coverage)[0]
+        if not open_slots.size:
+            print("Skipping remaining checks. All time slots already defended!")
+            break
+
+        chunk_mapping = find_constellation_defenders_sgp4(propagation_interface, chunk, slot_times[open_slots],
+                                                          [target_times[slot] for slot in open_slots],
+                                                          AtoV_ranges[open_slots], tail_time)
+        for slot in open_slots:
+            if chunk_mapping[target_times[slot]]:
+                time_defender_mapping[target_times[slot]].update(chunk_mapping[target_times[slot]])
+                coverage[slot] = True
+
+    return time_defender_mapping
+
+def find_constellation_defenders_sharded(propagation_interface, catalog, rows, slot_times, target_times, AtoV_ranges,
+                                         tail_time, workers, chunk_size=256):
+    """
+    Like find_constellation_defenders_sgp4, but split into shards for a process pool. As with the stk backend, time
+    slots are only checked until a defender is found, the workers share which slots are defended in a coverage bitmap
+    """
+    partial_mappings, coverage = run_sharded(find_constellation_defenders_shard, rows, propagation_interface, catalog,
+                                             workers, coverage_size=len(target_times),
+                                             args=(slot_times, target_times, AtoV_ranges, tail_time, chunk_size))
+
+    time_defender_mapping = {}
+    for target_time in target_times:
+        time_defender_mapping[target_time] = {}
+
+    for partial_mapping in partial_mappings:
+        for target_time, defenders in partial_mapping.items():
+            time_defender_mapping[target_time].update(defenders)
+
+    print(f"{coverage.sum()} of {len(coverage)} time slots defended")
+    return time_defender_mapping
+
+def many_to_one_experiment(backend="stk", prune_margin=None, ephemeris_dir=None, resume=True, workers=None,
+                           latency_scale=1.0, profiler=None, event_based=False, coarse_step=30,
+                           report_format="json", results_store=None, top_defenders=None, time_block_size=None,
+                           precision="float64", constellations=None,
+                           time_window_start=TIME_WINDOW_START, time_window_end=TIME_WINDOW_END,
+                           time_step_size=TIME_STEP_SIZE, tail_time=TAIL_TIME, celestrak_file=CELESTRAK_FILE):
+    """
+    :param backend: "stk" to simulate each satellite in the running STK instance, "sgp4" to propagate the
+                    CelesTrak elements in-process, "stk-sim" to run the stk code path against a local stand-in
+                    (see SimulatedSTKInterface)
+    :param prune_margin: Only for the stk backend. If set, satellites that are never inside the feasibility
+                         ellipsoid according to SGP4 (plus this margin in km) are not loaded into STK
+    :param ephemeris_dir: If set, SGP4 positions are stored in and reused from this directory (see EphemerisStore)
+    :param resume: Continue the run of results/journal_Exp2.jsonl if it has the same setup
+    :param workers: Only for the sgp4 backend. If set, the satellites of each constellation are split into shards that
+                    are evaluated by this many processes, see find_constellation_defenders_sharded
+    :param latency_scale: Only for the stk-sim backend. Factor for the latency of the STK calls, 0 to not wait at all
+    :param profiler: "cprofile" or "pyinstrument" to profile the run into results/profile_Exp2.prof/.html
+    :param event_based: Only for the sgp4 backend. Report exact defense windows and the coverage timeline instead of
+                        time slots, see CoverageWindows
+    :param coarse_step: Only with event_based. Seconds between the samples used to find the window edges
+    :param report_format: "json" for results/report_Exp2.json, "columnar" to stream the report into
+                          results/report_Exp2/ (see ColumnarReportWriter), "both" to also export the JSON report from
+                          the columnar one at the end. The sgp4 backend writes the defenders to the columnar report
+                          as they are evaluated, with workers and the stk backends the mapping of a constellation is
+                          built first
+    :param results_store: Only for the sgp4 backend, see one_to_one_experiment. Directory of a ResultsStore.
+                          Satellites whose element set was already evaluated with the same parameters are taken from
+                          the store, only new or changed ones are evaluated. Not with workers or event_based, they
+                          skip time slots that are already defended
+    :param top_defenders: Only for the sgp4 backend. If set, only this many defenders with the largest decision delay
+                          are kept per time slot, the report adds the defended time slots and best decision delay of
+                          every satellite. Memory no longer grows with satellites x time slots
+    :param time_block_size: Only for the sgp4 backend. If set, the time window is propagated and evaluated in blocks of
+                            this many time slots, so the memory of the positions no longer grows with the time window
+    :param precision: Only for the sgp4 backend. "float32" to keep the positions in single precision, SGP4 runs in
+                      float64 on chunks that are cast into them (see PropagationInterface.propagate_catalog). The
+                      first block of each constellation (or the first PRECISION_CHECK_SLOTS time slots without time
+                      blocks) is also evaluated in "float64" and the errors are added to the report
+    :param constellations: Names of the constellations, CONSTELLATIONS if None
+    :param time_window_start: STK date, within the STK scenario for the stk backend
+    :param time_window_end: STK date
+    :param time_step_size: Seconds between the time slots
+    :param tail_time: In seconds
+    :param celestrak_file: Satellite catalog in the CelesTrak JSON format
+    """
+    arguments = dict(locals())
+    if event_based and backend != "sgp4":
+        print("Event based coverage windows are only available for the sgp4 backend!")
+        exit(1)
+    if results_store is not None and backend != "sgp4":
+        print("The results store is only available for the sgp4 backend, STK doesn't use the element sets of the "
+              "catalog!")
+        exit(1)
+    if results_store is not None and (workers is not None or event_based):
+        print("The results store needs the complete results of every satellite, it can't be used with workers or "
+              "event based coverage windows!")
+        exit(1)
+    if top_defenders is not None and (backend != "sgp4" or workers is not None or event_based or
+                                      results_store is not None):
+        print("Top defenders are only available for the sgp4 backend without workers, event based coverage windows "
+              "or results store!")
+        exit(1)
+    if (time_block_size is not None or precision != "float64") and (backend != "sgp4" or workers is not None or
+                                                                     event_based):
+        print("Time blocks and precision are only available for the sgp4 backend without workers or event based "
+              "coverage windows!")
+        exit(1)
+    if precision not in ("float64", "float32"):
+        print(f"Unknown precision {precision}!")
         exit(1)
+    dtype = np.dtype(precision)
+    # With time blocks the satellites are chunked as well, so the block size alone bounds the memory
+    chunk_size = None if time_block_size is None else 256
 
-    constellation_time_defender_mapping = {}
+    if profiler is not None:
+        results_dir = os.path.join(BASE_DIR, "results")
+        if not os.path.isdir(results_dir):
+            os.mkdir(results_dir)
+        return run_profiled(lambda: many_to_one_experiment(**{**arguments, "profiler": None}),
+                            profiler, os.path.join(results_dir, "profile_Exp2"))
 
-    constellation_loop_round = 0
-    for constellation_name in CONSTELLATIONS:
-        constellation_loop_round += 1
-        print(f"Start testing constellation {constellation_name}")
+    if constellations is None:
+        constellations = CONSTELLATIONS
 
-        # Collect all satellite scc numbers of that constellation
-        satellite_name_filter = lambda sat: constellation_name.lower() in sat.lower()
-        satellite_names = list(filter(satellite_name_filter, list(satellite_ssc_number_mapping.keys())))
+    # Time run
+    experiment_start = datetime.now()
+    timer = PhaseTimer()
+
+    # Get all active satellites and their SSC number
+    with timer.phase("catalog load"):
+        catalog = get_satellite_catalog(celestrak_file)
+
+        # Drop satellites that never get low enough to defend the victim
+        catalog = prefilter_orbital_shells(catalog, VICTIM_SSC_NUMBER, tail_time,
+                                           attacker_altitude=ATTACKER_POSITION[2])
+
+        # Catalog rows of each constellation, see CONSTELLATION_PATTERNS in sat_manager.py
+        constellation_index = build_constellation_index(catalog, constellations)
+    satellite_names = catalog["OBJECT_NAME"]
+    satellite_ssc_numbers = catalog.ssc_numbers()
+
+    with timer.phase("backend setup"):
+        if backend == "sgp4" or prune_margin is not None:
+            ephemeris_store = None
+            if ephemeris_dir is not None:
+                ephemeris_store = EphemerisStore(ephemeris_dir, time_window_start, time_window_end, time_step_size)
+
+            propagation_interface = PropagationInterface(catalog, time_window_start, time_window_end,
+                                                         ATTACKER_POSITION, VICTIM_SSC_NUMBER, ephemeris_store)
+
+        if backend == "sgp4":
+            interface = propagation_interface
+        else:
+            # Setup STK
+            interface = create_stk_backend(backend, catalog, time_window_start, time_window_end, ATTACKER_POSITION,
+                                           VICTIM_SSC_NUMBER, os.path.join(BASE_DIR, "results", STK_TIMINGS_FILE),
+                                           latency_scale)
+            interface.scenario.SetTimePeriod(time_window_start, time_window_end)
 
-        sat_name_ssc_map = {}
-        for satellite_name in satellite_names:
-            sat_name_ssc_map[satellite_name] = satellite_ssc_number_mapping[satellite_name]
+    # Get attacker and victim form stk scenario
+    attacker = interface.attacker_object
+    victim = interface.victim_object
 
-        time_defender_mapping = {}
-        # Fill time_defender_mapping with time slot where we need to defend
-        for target_time in AtoV_time_range_map.keys():
-            time_defender_mapping[target_time] = {}
+    # Start experiment
+    print("Starting experiment...")
 
-        # For each satellite in constellation check time at which they can protect
-        time_for_one_check = timedelta(minutes=3)
-        satellite_loop_round = 0
-        for satellite_name, satellite_ssc_number in sat_name_ssc_map.items():
-            satellite_loop_round += 1
+    # Get slots of victim in range of attacker during experiment time window, in seconds since time_window_start
+    with timer.phase("AER execution"):
+        if time_block_size is not None:
+            AtoV_offsets, AtoV_ranges = interface.get_range_data(attacker, victim, step_size=time_step_size,
+                                                                 block_size=time_block_size)
+        else:
+            AtoV_offsets, AtoV_ranges = interface.get_range_data(attacker, victim, step_size=time_step_size)
 
-            # For runtime estimations
-            one_check_start = datetime.now()
+    if not AtoV_offsets.size:
+        print("Attacker is never in range of victim in this scenario!")
+        exit(1)
 
-            # Skip if we already defend all time slots
-            if all(time_defender_mapping.values()):
-                print(f"Skipping checks for {constellation_name}. All time slots already defended!")
-                break
+    # Dates are only formatted for the report
+    slot_times = offsets_to_datetime64(AtoV_offsets, time_window_start)
+    target_times = interface.offsets_to_stk_dates(AtoV_offsets).tolist()
+
+    setup = {
+        "Attacker": interface.attacker_object.InstanceName,
+        "Victim": interface.victim_object.InstanceName,
+        "Start time": time_window_start,
+        "End time": time_window_end,
+        # "Bit rate": bit_rate,
+        # "Tail size": tail_size,
+        "Tail time": tail_time,
+        "Time step size": time_step_size,
+        "Number of observations": len(target_times),
+        "Backend": backend,
+        "Celestrak file": celestrak_file,
+        "Satellites after prefilter": len(catalog)
+    }
+    if event_based:
+        setup["Coverage"] = "windows"
+        setup["Coarse step size"] = coarse_step
+    if top_defenders is not None:
+        setup["Top defenders"] = top_defenders
+    if time_block_size is not None:
+        setup["Time block size"] = time_block_size
+    if precision != "float64":
+        setup["Precision"] = precision
+    if report_format != "json":
+        # Journals of the columnar report only hold the summary of each constellation
+        setup["Report format"] = report_format
+
+    store = None
+    if results_store is not None:
+        # Results only depend on the element sets of the defender and the victim besides these parameters
+        satellite_keys = np.array(catalog_keys(catalog), dtype=object)
+        store = ResultsStore(results_store, {
+            "Experiment": "Exp2",
+            "Attacker": ATTACKER_POSITION,
+            "Victim": satellite_keys[catalog.row_by_ssc_number(VICTIM_SSC_NUMBER)],
+            "Start time": time_window_start,
+            "End time": time_window_end,
+            "Time step size": time_step_size,
+            "Tail time": tail_time,
+            "Backend": backend,
+            "Precision": precision
+        })
+        setup["Results store"] = store.path
 
-            # Add satellite to simulation
-            stk_satellite_name = stk_interface.convert_name(satellite_name)
-            satellite_object = stk_interface.add_satellite(stk_satellite_name, satellite_ssc_number)
+    results_dir = os.path.join(BASE_DIR, "results")
+    if not os.path.isdir(results_dir):
+        os.mkdir(results_dir)
 
-            # Check for each timeslot in which we need protection
-            time_loop_round = 0
-            for target_time, AtoV in AtoV_time_range_map.items():
-                # Give feedback during run
-                time_loop_round += 1
-
-                # Skip if we already have a defender for that time slot
-                if time_defender_mapping[target_time]:
-                    print(f"Skipping {target_time}. Defender already found!")
-                    continue
-
-                time_progress = round((time_loop_round / len(AtoV_time_range_map.keys())) * 100, 3)
-                satellite_progress = round((satellite_loop_round / len(sat_name_ssc_map.keys())) * 100, 3)
-                constellation_progress = round((constellation_loop_round / len(CONSTELLATIONS)) * 100, 3)
-                print(f"Checking time {target_time} | Time {time_progress}% | Satellite {satellite_progress}% | Constellation {constellation_progress}%")
-                current_runtime = datetime.now() - experiment_start
-                satellites_checks_left = len(sat_name_ssc_map.keys()) - satellite_loop_round
-                estimated_runtime = current_runtime + time_for_one_check * satellites_checks_left
-                print(f"Runtime: {current_runtime} | Estimated runtime until next constellation check {estimated_runtime}")
-
-                # Set animation time to target time to have visual feedback
-                set_animation_time(stk_interface, time_window_start, target_time)
-
-                # Calculate distances
-                AtoD = None
-                AtoD_aer = stk_interface.get_aer_report_data(attacker, satellite_object)
-                if AtoD_aer:
-                    if target_time in AtoD_aer.keys():
-                        AtoD = AtoD_aer[target_time] * 1000  # we want it in m
-                if not AtoD:
-                    # Defender not in range of attacker
-                    continue
-
-                DtoV = None
-                DtoV_aer = stk_interface.get_aer_report_data(satellite_object, victim)
-                if DtoV_aer:
-                    if target_time in DtoV_aer.keys():
-                        DtoV = DtoV_aer[target_time] * 1000  # we want it in m
-                if not DtoV:
-                    # Victim not in range of defender
-                    continue
-
-                # Calculate decision delay in seconds
-                AtoV_meters = AtoV * 1000
-                decision_delay = decisionDelay(AtoD, DtoV, AtoV_meters, tail_time)
+    # Stream finished satellites and constellations to the journal, a crashed run continues where it stopped. With the
+    # columnar report only the summary of a constellation is journaled, its rows are already in the report
+    journal = ResultsJournal(os.path.join(results_dir, "journal_Exp2.jsonl"), setup, resume)
+    finished_constellations = {entry["constellation"] for entry in journal.entries
+                               if "report" in entry or "summary" in entry}
+
+    # Defenders are streamed to the columnar report while a constellation is evaluated
+    report_writer = None
+    report_dir = os.path.join(results_dir, "report_Exp2")
+    if report_format in ("columnar", "both"):
+        ssc_numbers = dict(zip(satellite_names.tolist(), satellite_ssc_numbers.tolist()))
+        report_writer = ColumnarReportWriter(report_dir, setup, target_times, AtoV_ranges,
+                                             [entry for entry in journal.entries if "summary" in entry])
+
+    if event_based:
+        coverage_windows = CoverageWindows(interface, tail_time, coarse_step)
+        with timer.phase("window search"):
+            visibility_starts, visibility_ends = coverage_windows.visibility_windows()
 
-                # Check if satellite could react
-                if decision_delay > 0:
-                    time_defender_mapping[target_time][satellite_name] = {
-                        "AtoV": AtoV,
-                        "AtoD": AtoV_meters,
-                        "DtoV": DtoV,
-                        "decision_delay": decision_delay
-                    }
+    constellation_loop_round = 0
+    for constellation_name in constellations:
+        constellation_loop_round += 1
+        if constellation_name in finished_constellations:
+            print(f"Skipping constellation {constellation_name}. Already finished in journal!")
+            continue
 
-            # Remove satellite from simulation
-            stk_interface.remove_satellite(satellite_object)
+        print(f"Start testing constellation {constellation_name}")
 
-            # For runtime estimations
-            one_check_end = datetime.now()
-            time_for_one_check = one_check_end - one_check_start
+        # Rows of the catalog are also the rows of the propagation interface
+        rows = constellation_index[constellation_name]
+        print(f"{len(rows)} satellites in constellation {constellation_name}")
+
+        if event_based:
+            constellation_report = find_constellation_coverage_windows(coverage_windows, rows, visibility_starts,
+                                                                       visibility_ends, timer)
+            if report_writer is not None:
+                report_writer.write_constellation(constellation_name, constellation_report, ssc_numbers)
+                journal.append({"constellation": constellation_name,
+                                "summary": report_writer.meta["summary"][constellation_name],
+                                "offsets": report_writer.offsets()})
+            else:
+                journal.append({"constellation": constellation_name, "report": constellation_report})
+            continue
+
+        precision_check = None
+        if backend == "sgp4" and precision != "float64":
+            # Only one block is checked, also without time blocks, otherwise float32 would not save anything
+            first_block = slice(0, time_block_size or PRECISION_CHECK_SLOTS)
+            with timer.phase("precision check"):
+                precision_check = check_precision(interface, rows, slot_times[first_block], AtoV_ranges[first_block],
+                                                  tail_time, dtype)
+            print(f"{precision} against float64: {precision_check}")
+
+        # Streamed evaluations write their rows to the report and leave the mapping None
+        time_defender_mapping = None
+        if report_writer is not None:
+            report_writer.start_constellation(constellation_name)
+
+        if backend == "sgp4" and workers is not None:
+            # Phases of the workers are not collected, only the whole sharded evaluation is timed
+            with timer.phase("sharded evaluation"):
+                time_defender_mapping = find_constellation_defenders_sharded(interface, catalog, rows, slot_times,
+                                                                             target_times, AtoV_ranges, tail_time,
+                                                                             workers)
+        elif backend == "sgp4" and top_defenders is not None:
+            top = find_constellation_top_defenders_sgp4(interface, rows, slot_times, AtoV_ranges, tail_time,
+                                                        top_defenders, timer=timer, time_block_size=time_block_size,
+                                                        dtype=dtype)
+            satellite_counters = top.satellite_counters(satellite_names.tolist())
+            if report_writer is not None:
+                slot_indices, defender_rows, AtoD, DtoV, decision_delay = top.pairs()
+                report_writer.add_defenders(slot_indices, satellite_names[defender_rows].tolist(),
+                                            satellite_ssc_numbers[defender_rows].tolist(), AtoD, DtoV,
+                                            decision_delay)
+            else:
+                time_defender_mapping = top.time_defender_mapping(target_times, AtoV_ranges,
+                                                                  satellite_names.tolist())
+        elif backend == "sgp4" and store is not None:
+            missing_rows = rows[store.split(satellite_keys[rows])]
+            print(f"{len(rows) - len(missing_rows)} of {len(rows)} satellites are in the results store")
+            if len(missing_rows):
+                time_defender_mapping = find_constellation_defenders_sgp4(interface, missing_rows, slot_times,
+                                                                          target_times, AtoV_ranges, tail_time, timer,
+                                                                          time_block_size, dtype, chunk_size)
+                defenders = defenders_by_satellite(time_defender_mapping, satellite_names[missing_rows].tolist())
+                store.put_many({satellite_keys[row]: defenders[satellite_names[row]] for row in missing_rows})
+            if report_writer is not None:
+                stream_stored_defenders(report_writer, store, target_times, satellite_names[rows].tolist(),
+                                        satellite_keys[rows], satellite_ssc_numbers[rows].tolist())
+            else:
+                time_defender_mapping = stored_time_defender_mapping(store, target_times,
+                                                                     satellite_names[rows].tolist(),
+                                                                     satellite_keys[rows])
+        elif backend == "sgp4" and report_writer is not None:
+            stream_constellation_defenders_sgp4(report_writer, interface, rows, slot_times, AtoV_ranges, tail_time,
+                                                satellite_ssc_numbers, timer, time_block_size, dtype, chunk_size)
+        elif backend == "sgp4":
+            time_defender_mapping = find_constellation_defenders_sgp4(interface, rows, slot_times, target_times,
+                                                                      AtoV_ranges, tail_time, timer, time_block_size,
+                                                                      dtype, chunk_size)
+        else:
+            if prune_margin is not None:
+                with timer.phase("prune"):
+                    candidates, _ = find_candidate_defenders(propagation_interface, slot_times, tail_time, rows,
+                                                             margin=prune_margin)
+                print(f"Pruned {len(rows) - candidates.any(axis=1).sum()} of {len(rows)} satellites outside the "
+                      f"feasibility ellipsoid")
+                rows = rows[candidates.any(axis=1)]
+
+            sat_name_ssc_map = dict(zip(satellite_names[rows].tolist(), satellite_ssc_numbers[rows].tolist()))
+
+            constellation_progress = round((constellation_loop_round / len(constellations)) * 100, 3)
+            time_defender_mapping = find_constellation_defenders_stk(interface, sat_name_ssc_map, target_times,
+                                                                     AtoV_offsets, AtoV_ranges, tail_time,
+                                                                     experiment_start, constellation_name,
+                                                                     constellation_progress, journal, timer)
 
         # Check if all time points have at least one possible defenders
-        number_of_defended_times = 0
-        total_number_of_target_times = len(time_defender_mapping.keys())
-        for defenders in time_defender_mapping.values():
-            if defenders:
-                number_of_defended_times += 1
-
-        constellation_time_defender_mapping[constellation_name] = {
-            "defended times": number_of_defended_times,
-            "not defended times": total_number_of_target_times - number_of_defended_times,
-            "defend percentage": (number_of_defended_times/total_number_of_target_times)*100,
-            "defenders": time_defender_mapping
-        }
+        if time_defender_mapping is not None:
+            coverage = np.array([bool(defenders) for defenders in time_defender_mapping.values()], dtype=bool)
+            if report_writer is not None:
+                report_writer.add_time_defender_mapping(time_defender_mapping, ssc_numbers)
+        else:
+            coverage = report_writer.constellation_coverage
+
+        constellation_report = slot_summary(coverage)
+        if top_defenders is not None:
+            constellation_report["satellites"] = satellite_counters
+        if precision_check is not None:
+            constellation_report["precision check"] = precision_check
+        if report_writer is not None:
+            report_writer.end_constellation(constellation_report)
+            journal.append({"constellation": constellation_name, "summary": constellation_report,
+                            "offsets": report_writer.offsets()})
+        else:
+            constellation_report["defenders"] = time_defender_mapping
+            journal.append({"constellation": constellation_name, "report": constellation_report})
+
+    if backend != "sgp4":
+        timer.count("AER cache hits", interface.aer_cache.hits)
+        timer.count("AER cache misses", interface.aer_cache.misses)
+    if backend == "stk-sim":
+        for call_name, call_count in interface.call_counts.items():
+            timer.count(f"simulated {call_name} calls", call_count)
+    if store is not None:
+        timer.count("results store hits", store.hits)
+        timer.count("results store misses", store.misses)
 
     # Time run
     experiment_end = datetime.now()
@@ -179,37 +809,46 @@ def many_to_one_experiment():
     print(f"End: {experiment_end}")
     print(f"Runtime: {experiment_end - experiment_start}")
 
-    output = {
-        "setup": {
-            "Attacker": stk_interface.attacker_object.InstanceName,
-            "Victim": stk_interface.victim_object.InstanceName,
-            "Start time": time_window_start,
-            "End time": time_window_end,
-            # "Bit rate": bit_rate,
-            # "Tail size": tail_size,
-            "Tail time": tail_time,
-            "Time step size": time_step_size,
-            "Number of observations": len(AtoV_time_range_map.keys())
-        },
-        "runtime": {
+    # The report write itself is only in the printed summary, it ends after the runtime block is serialized
+    with timer.phase("report write"):
+        runtime = {
             "start": str(experiment_start),
             "end": str(experiment_end),
-            "runtime": str(experiment_end - experiment_start)
-        },
-        "report": constellation_time_defender_mapping
-    }
-
-    # Store report
-    results_dir = os.path.join(BASE_DIR, "results")
-    if not os.path.isdir(results_dir):
-        os.mkdir(results_dir)
-
-    report_file = os.path.join(results_dir, "report_Exp2.json")
-    with open(report_file, "w") as outfile:
-        json.dump(output, outfile, indent=1)
+            "runtime": str(experiment_end - experiment_start),
+            **timer.to_dict()
+        }
+        if report_writer is not None:
+            report_writer.close(runtime)
+
+        report_file = os.path.join(results_dir, "report_Exp2.json")
+        if report_format == "json":
+            # Report is assembled from the journal, so it includes the constellations of previous runs
+            output = {
+                "setup": setup,
+                "runtime": runtime,
+                "report": {entry["constellation"]: entry["report"] for entry in journal.entries if "report" in entry}
+            }
+
+            # Store report
+            with open(report_file, "w") as outfile:
+                json.dump(output, outfile, indent=1)
+        elif report_format == "both":
+            # The nested report is only built here, from the rows of the columnar report
+            export_json(report_dir, report_file)
+
+    # Run is complete, the next one starts from scratch
+    journal.remove()
+
+    print_phases(timer)
+
+    if backend == "stk":
+        interface.save_call_timings(os.path.join(results_dir, STK_TIMINGS_FILE))
+    elif backend == "stk-sim":
+        print(f"STK calls: {dict(interface.call_counts)} | Simulated STK latency: "
+              f"{timedelta(seconds=interface.simulated_latency)}")
 
     # Cleanup
-    stk_interface.cleanup_scenario()
+    interface.cleanup_scenario()
 
 
 if __name__ == "__main__":
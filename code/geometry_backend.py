@@ -0,0 +1,224 @@
+import json
+import os.path
+import string
+import time
+from collections import Counter, OrderedDict
+from typing import Protocol
+
+import numpy as np
+
+from propagation import PropagationInterface
+
+# Mean seconds per STK call. Estimated from results/report_Exp1.json (4h 2min for the 9143 satellites of the catalog,
+# about 1.6s per satellite for add, up to two AER reports and remove). Replace them with the timings recorded by
+# STKInterface.save_call_timings for anything more precise.
+RECORDED_TIMINGS = {
+    "attach": 2.0,
+    "add_satellite": 1.2,
+    "execute_aer_report": 0.15,
+    "remove_satellite": 0.1,
+}
+
+
+class GeometryBackend(Protocol):
+    """
+    Calls the experiments make on a backend, implemented by STKInterface, SimulatedSTKInterface and (apart from
+    the STK scenario objects) PropagationInterface
+    """
+    attacker_object: object
+    victim_object: object
+
+    def convert_name(self, satellite_name: str) -> str: ...
+
+    def add_satellite(self, satellite_name: str, ssc_number: str) -> object: ...
+
+    def remove_satellite(self, satellite) -> None: ...
+
+    def cleanup_scenario(self) -> None: ...
+
+    def get_range_data(self, object1, object2, step_size=10) -> tuple[np.ndarray, np.ndarray]: ...
+
+    def get_aer_report_data(self, object1, object2, step_size=10) -> dict[str, float]: ...
+
+    def time_offsets(self, times) -> np.ndarray: ...
+
+    def offsets_to_stk_dates(self, offsets) -> np.ndarray: ...
+
+
+class RangeDataCache:
+    """
+    Executed range reports, least recently used first. Entries are keyed by the object paths first, so they can be
+    dropped when an object is removed.
+    """
+
+    def __init__(self, size=256):
+        self.entries = OrderedDict()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cache_key):
+        if cache_key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(cache_key)
+            return self.entries[cache_key]
+
+        self.misses += 1
+        return None
+
+    def put(self, cache_key, value):
+        self.entries[cache_key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, object_path=None):
+        """
+        :param object_path: Drop all cached reports involving this object, everything if None
+        :return: None
+        """
+        if object_path is None:
+            self.entries.clear()
+            return
+
+        for cache_key in [key for key in self.entries.keys() if object_path in key[:2]]:
+            del self.entries[cache_key]
+
+
+def convert_name(satellite_name):
+    """
+    :param satellite_name: Name from the catalog
+    :return: Name that STK accepts for an object, spaces replaced and other characters dropped
+    """
+    satellite_name = satellite_name.replace(" ", "_")
+    allowed_chars = string.ascii_letters + string.digits + "_"
+
+    satellite_name = "".join(filter(lambda c: c in allowed_chars, list(satellite_name)))
+    return satellite_name
+
+
+def load_call_timings(timings_file):
+    """
+    :param timings_file: JSON written by STKInterface.save_call_timings
+    :return: mean seconds per call
+    """
+    with open(timings_file, "r") as f:
+        call_timings = json.load(f)
+    return {name: float(np.mean(timings)) for name, timings in call_timings.items() if timings}
+
+
+class SimulatedScenario:
+    # The parts of the STK scenario object used by the experiments
+    def __init__(self, interface):
+        self.interface = interface
+
+    @property
+    def StartTime(self):
+        return self.interface.start_time
+
+    @property
+    def StopTime(self):
+        return self.interface.stop_time
+
+    def SetTimePeriod(self, start_time, stop_time):
+        self.interface.set_time_period(start_time, stop_time)
+
+
+class SimulatedRoot:
+    def __init__(self):
+        self.CurrentTime = 0.0
+
+
+class SimulatedSTKInterface(PropagationInterface):
+    """
+    Local stand-in for STKInterface. It behaves like STK for the experiments (satellites are added one by one,
+    duplicates are replaced, every range query is an AER report, reports are cached the same way), but the ranges
+    come from SGP4. Each STK call waits as long as it took in STK, so batching and caching can be benchmarked for
+    call counts and wall time without STK.
+    """
+
+    def __init__(self, catalog, start_time, stop_time, attacker_position, victim_ssc_number, timings=None,
+                 latency_scale=1.0, aer_cache_size=256):
+        """
+        :param timings: Seconds per call, or path of a file written by STKInterface.save_call_timings. Calls without
+                        timing use RECORDED_TIMINGS
+        :param latency_scale: Factor for the injected latency, 0 to only count the calls
+        """
+        super().__init__(catalog, start_time, stop_time, attacker_position, victim_ssc_number)
+
+        if isinstance(timings, str):
+            timings = load_call_timings(timings)
+        self.timings = {**RECORDED_TIMINGS, **(timings or {})}
+        self.latency_scale = latency_scale
+
+        # Unscaled latency STK would have needed for the calls so far
+        self.call_counts = Counter()
+        self.simulated_latency = 0.0
+
+        self.scenario = SimulatedScenario(self)
+        self.root = SimulatedRoot()
+        self.aer_cache = RangeDataCache(aer_cache_size)
+
+        self.simulate_call("attach")
+
+    def simulate_call(self, call_name):
+        latency = self.timings.get(call_name, 0.0)
+        self.call_counts[call_name] += 1
+        self.simulated_latency += latency
+        if self.latency_scale > 0:
+            time.sleep(latency * self.latency_scale)
+
+    def convert_name(self, satellite_name):
+        return convert_name(satellite_name)
+
+    def add_satellite(self, satellite_name: str, ssc_number: str):
+        # Remove satellite with same name if exists
+        for satellite in [s for s in self.added_satellites if s.InstanceName == satellite_name]:
+            self.remove_satellite(satellite)
+
+        self.simulate_call("add_satellite")
+        return super().add_satellite(satellite_name, ssc_number)
+
+    def remove_satellite(self, satellite) -> None:
+        self.simulate_call("remove_satellite")
+        self.aer_cache.invalidate(satellite.Path)
+        super().remove_satellite(satellite)
+
+    def get_range_data(self, object1, object2, step_size=10) -> tuple[np.ndarray, np.ndarray]:
+        cache_key = (object1.Path, object2.Path, self.start_time, self.stop_time, step_size)
+        range_data = self.aer_cache.get(cache_key)
+        if range_data is None:
+            self.simulate_call("execute_aer_report")
+            range_data = super().get_range_data(object1, object2, step_size)
+
+            # STK has no access between two copies of the same satellite (the victim is not in
+            # results/report_Exp1.json although it is in the catalog)
+            if getattr(object1, "ssc_number", None) is not None and \
+                    int(object1.ssc_number) == int(getattr(object2, "ssc_number", -1)):
+                range_data = (range_data[0][:0], range_data[1][:0])
+
+            self.aer_cache.put(cache_key, range_data)
+
+        return range_data
+
+
+def create_stk_backend(backend, catalog, start_time, stop_time, attacker_position, victim_ssc_number,
+                       timings_file=None, latency_scale=1.0):
+    """
+    :param backend: "stk" for the running STK instance, "stk-sim" for SimulatedSTKInterface
+    :param catalog: SatelliteCatalog, only for "stk-sim"
+    :param start_time: Scenario start as STK date, only for "stk-sim"
+    :param stop_time: Scenario stop as STK date, only for "stk-sim"
+    :param attacker_position: (latitude, longitude, altitude), only for "stk-sim"
+    :param victim_ssc_number: Only for "stk-sim"
+    :param timings_file: Timings recorded in a previous STK run, RECORDED_TIMINGS if None or missing
+    :param latency_scale: see SimulatedSTKInterface
+    :return: GeometryBackend
+    """
+    if backend == "stk-sim":
+        timings = timings_file if timings_file is not None and os.path.isfile(timings_file) else None
+        return SimulatedSTKInterface(catalog, start_time, stop_time, attacker_position, victim_ssc_number,
+                                     timings, latency_scale)
+
+    # Only import the STK API if STK is actually used
+    from stk_interface import STKInterface
+    return STKInterface()
@@ -0,0 +1,98 @@
+import cProfile
+import pstats
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    """
+    Cumulative wall time and number of calls per phase of an experiment (e.g. "add satellite", "AER execution") plus
+    free counters, written to the runtime block of the reports
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def count(self, name, number=1):
+        self.counters[name] += number
+
+    def to_dict(self):
+        return {
+            "phases": {name: {"seconds": round(seconds, 6), "calls": self.calls[name]}
+                       for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])},
+            "counters": dict(self.counters)
+        }
+
+
+class ProgressPrinter:
+    """
+    Prints progress at most once per interval, loops over thousands of satellites and time slots would otherwise
+    flood stdout
+    """
+
+    def __init__(self, interval=10.0):
+        """
+        :param interval: Minimum seconds between two messages
+        """
+        self.interval = interval
+        self.last_print = None
+
+    def print(self, message, force=False):
+        now = time.monotonic()
+        if force or self.last_print is None or now - self.last_print >= self.interval:
+            print(message)
+            self.last_print = now
+
+
+def run_profiled(function, profiler, output_file):
+    """
+    :param function: Called without arguments
+    :param profiler: "cprofile" (stats in output_file.prof, e.g. for snakeviz) or "pyinstrument" (output_file.html)
+    :param output_file: Path without extension
+    :return: result of function
+    """
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed! Use profiler='cprofile' or run: pip install pyinstrument")
+            exit(1)
+
+        pyinstrument_profiler = Profiler()
+        pyinstrument_profiler.start()
+        try:
+            return function()
+        finally:
+            pyinstrument_profiler.stop()
+            with open(output_file + ".html", "w") as f:
+                f.write(pyinstrument_profiler.output_html())
+            print(f"Profile written to {output_file}.html")
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return function()
+    finally:
+        profile.disable()
+        profile.dump_stats(output_file + ".prof")
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(20)
+        print(f"Profile written to {output_file}.prof")
+
+
+def print_phases(timer):
+    for name, phase in timer.to_dict()["phases"].items():
+        print(f"{name}: {round(phase['seconds'], 3)}s in {phase['calls']} calls")
+    for name, count in timer.counters.items():
+        print(f"{name}: {count}")
@@ -0,0 +1,313 @@
+"""
+Orbital IPS as a long-running service. The catalog is propagated once over the service window and the k-d trees of
+DefenderIndex are built for every time step, so an event "attacker station X starts a tail at time t against victim V"
+only propagates the few satellites near the feasibility ellipsoid to the exact time t.
+
+Protocol: one JSON object per line over TCP or a Unix socket, e.g.
+
+    {"id": 1, "station": "Attacker", "victim": "44878", "time": "1 Jan 2024 03:00:45.000000000", "tail_time": 0.005}
+
+is answered with the feasible defenders, best decision delay first (distances in m, decision delay in s):
+
+    {"id": 1, "visible": true, "AtoV": 1408510.2, "defenders": [{"satellite": "...", "ssc number": "...",
+     "AtoD": ..., "DtoV": ..., "decision_delay": ...}, ...], "latency": 0.0004}
+
+"tail_time" (default TAIL_TIME) and "top" (all defenders if omitted) are optional. Invalid events are answered with
+{"id": ..., "error": "..."} and the service keeps running.
+
+    python ips_service.py
+    python letmedoitforyou.py ips-load-test --requests 10000 --concurrency 8
+"""
+import asyncio
+import json
+import numbers
+import time
+from datetime import datetime
+
+import numpy as np
+
+from access import NO_CONSTRAINTS, AccessConstraints, ground_access_ranges, satellite_access_ranges
+from decision_window_calc import decisionDelayBatch
+from ephemeris_store import EphemerisStore
+from experiment2 import CELESTRAK_FILE, TAIL_TIME
+from propagation import GroundStation, PropagationInterface, minutes_since_epoch, sgp4_propagate, time_grid
+from protection_matrix import GROUND_STATIONS, VICTIM_SSC_NUMBERS
+from sat_manager import get_satellite_catalog
+from spatial_index import DefenderIndex, range_budget
+from stk_dates import stk_date_to_datetime
+
+# Window of the hot ephemeris, events outside of it are rejected. It covers the target time of Experiment 1.
+SERVICE_WINDOW_START = "1 Jan 2024 03:00:00.000000000"
+SERVICE_WINDOW_END = "1 Jan 2024 04:00:00.000000000"
+SERVICE_STEP_SIZE = 10  # sec
+
+# Faster than any satellite at perigee (LEO ~7.8 km/s, GTO ~10.2 km/s)
+MAX_SATELLITE_SPEED = 11.0  # km/s
+
+IPS_HOST = "127.0.0.1"
+IPS_PORT = 8750
+
+
+class DefenderService:
+    """
+    Ranked defenders of single events. Positions on the time grid only select the candidates: between the grid time and
+    the event time every satellite moves at most MAX_SATELLITE_SPEED * step_size / 2, so AtoD + DtoV changes by at
+    most twice that. The candidates are then propagated to the exact event time and evaluated with decisionDelayBatch.
+    """
+
+    def __init__(self, catalog, ground_stations=GROUND_STATIONS, start_time=SERVICE_WINDOW_START,
+                 stop_time=SERVICE_WINDOW_END, step_size=SERVICE_STEP_SIZE, ephemeris_store=None,
+                 ground_constraints=NO_CONSTRAINTS, satellite_constraints=NO_CONSTRAINTS):
+        """
+        :param catalog: SatelliteCatalog, all satellites are defender candidates
+        :param ground_stations: list of (name, latitude, longitude, altitude), see protection_matrix
+        :param start_time: STK date, start of the hot ephemeris
+        :param stop_time: STK date
+        :param step_size: Seconds between the positions of the hot ephemeris
+        :param ephemeris_store: EphemerisStore to load the hot ephemeris from
+        """
+        # The attacker and victim of the interface are not used, both are given per event
+        self.interface = PropagationInterface(catalog, start_time, stop_time, ground_stations[0][1:],
+                                              str(catalog["NORAD_CAT_ID"][0]), ephemeris_store, ground_constraints,
+                                              satellite_constraints)
+        self.stations = {station[0]: GroundStation(*station) for station in ground_stations}
+
+        self.times = time_grid(start_time, stop_time, step_size)
+        self.step = np.timedelta64(int(round(step_size * 1e6)), "us")
+        self.margin = MAX_SATELLITE_SPEED * step_size
+
+        # Hot ephemeris, the trees of all time steps are built up front so no event pays for them
+        self.positions = self.interface.propagate_catalog(self.times)
+        self.index = DefenderIndex(self.positions)
+        for time_index in range(len(self.times)):
+            self.index.tree(time_index)
+
+        self.names = self.interface.elements["OBJECT_NAME"].astype(str).tolist()
+        self.ssc_numbers = self.interface.elements["NORAD_CAT_ID"].astype(str).tolist()
+
+    def records(self, rows):
+        return {name: values[rows] for name, values in self.interface.record.items()}
+
+    def propagate(self, rows, event_time):
+        """
+        :return: TEME positions in km of the rows at the event time, shape (rows, 3)
+        """
+        record = self.records(rows)
+        return sgp4_propagate(record, minutes_since_epoch(record["epoch"], event_time[np.newaxis]))[:, 0]
+
+    def time_index(self, event_time):
+        if not self.times[0] <= event_time <= self.times[-1]:
+            raise ValueError(f"Time {event_time} is outside of the service window {self.times[0]} - {self.times[-1]}")
+        return int(np.rint((event_time - self.times[0]) / self.step))
+
+    def decide(self, station_name, victim_ssc_number, event_time, tail_time=TAIL_TIME, top=None):
+        """
+        :param station_name: Name of the attacker ground station
+        :param victim_ssc_number: SSC number of the victim
+        :param event_time: datetime64 at which the attacker starts the tail
+        :param tail_time: In seconds
+        :param top: Number of defenders to return, all if None
+        :return: whether the attacker sees the victim, AtoV in m and the feasible defenders sorted by decision delay
+        """
+        station = self.stations.get(station_name)
+        if station is None:
+            raise ValueError(f"Unknown station {station_name}")
+        victim_row = self.interface.ssc_row_mapping.get(int(victim_ssc_number))
+        if victim_row is None:
+            raise ValueError(f"Victim {victim_ssc_number} not found in catalog")
+        # bool is an int, but true or false is no tail time and no number of defenders
+        if isinstance(tail_time, bool) or not isinstance(tail_time, numbers.Real) or not 0 < tail_time < np.inf:
+            raise ValueError(f"Tail time has to be a positive number of seconds, got {tail_time!r}")
+        if top is not None and (isinstance(top, bool) or not isinstance(top, numbers.Integral) or top < 1):
+            raise ValueError(f"Top has to be a positive integer or omitted, got {top!r}")
+        time_index = self.time_index(event_time)
+
+        event_times = event_time[np.newaxis]
+        attacker_position = station.positions(event_times)
+        attacker_frame = station.frames(event_times)
+        victim_position = self.propagate([victim_row], event_time)
+
+        AtoV = ground_access_ranges(attacker_position, attacker_frame, victim_position,
+                                    self.interface.ground_constraints)[0]
+        if np.isnan(AtoV):
+            return False, None, []
+
+        rows = self.index.query(time_index, attacker_position[0], victim_position[0], range_budget(tail_time),
+                                self.margin)
+        rows = rows[rows != victim_row]
+        if not len(rows):
+            return True, float(AtoV * 1000), []
+
+        defender_positions = self.propagate(rows, event_time)
+        AtoD = ground_access_ranges(attacker_position, attacker_frame, defender_positions,
+                                    self.interface.ground_constraints)
+        DtoV = satellite_access_ranges(victim_position, defender_positions, self.interface.satellite_constraints)
+        decision_delay, can_defend = decisionDelayBatch(AtoD * 1000, DtoV * 1000, AtoV * 1000, tail_time)
+
+        ranking = np.nonzero(can_defend)[0]
+        ranking = ranking[np.argsort(-decision_delay[ranking], kind="stable")][:top]
+        return True, float(AtoV * 1000), [{
+            "satellite": self.names[rows[pair]],
+            "ssc number": self.ssc_numbers[rows[pair]],
+            "AtoD": float(AtoD[pair] * 1000),
+            "DtoV": float(DtoV[pair] * 1000),
+            "decision_delay": float(decision_delay[pair])
+        } for pair in ranking]
+
+    def handle_event(self, event):
+        """
+        :param event: Decoded request, see the protocol at the top of this file
+        :return: response
+        """
+        start = time.perf_counter()
+        response = {"id": event.get("id")}
+        try:
+            event_time = np.datetime64(stk_date_to_datetime(event["time"]), "us")
+            visible, AtoV, defenders = self.decide(event["station"], event["victim"], event_time,
+                                                   event.get("tail_time", TAIL_TIME), event.get("top"))
+            response.update({"visible": visible, "AtoV": AtoV, "defenders": defenders})
+        except (KeyError, TypeError, ValueError) as error:
+            response["error"] = f"{type(error).__name__}: {error}"
+        response["latency"] = time.perf_counter() - start
+        return response
+
+
+async def handle_connection(service, reader, writer):
+    # Events are answered in order per connection, connections are served concurrently
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                response = service.handle_event(json.loads(line))
+            except json.JSONDecodeError as error:
+                response = {"id": None, "error": f"JSONDecodeError: {error}"}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(service, host=IPS_HOST, port=IPS_PORT, socket_path=None):
+    handler = lambda reader, writer: handle_connection(service, reader, writer)
+    if socket_path is not None:
+        return await asyncio.start_unix_server(handler, socket_path)
+    return await asyncio.start_server(handler, host, port)
+
+
+def serve(host=IPS_HOST, port=IPS_PORT, socket_path=None, ground_stations=GROUND_STATIONS,
+          time_window_start=SERVICE_WINDOW_START, time_window_end=SERVICE_WINDOW_END,
+          time_step_size=SERVICE_STEP_SIZE, min_elevation=0.0, max_range=None,
+          ephemeris_dir=None, celestrak_file=CELESTRAK_FILE):
+    """
+    Loads the hot ephemeris and answers events until interrupted
+    :param host: TCP address, ignored with socket_path
+    :param port: TCP port
+    :param socket_path: Unix socket instead of TCP
+    :param ground_stations: list of (name, latitude, longitude, altitude), see protection_matrix.load_ground_stations
+    :param time_window_start: STK date, events have to lie in the time window
+    :param time_window_end: STK date
+    :param time_step_size: Seconds between the positions of the hot ephemeris, more memory but fewer candidates per
+                           event if smaller
+    :param min_elevation: Elevation mask of the ground stations in degrees
+    :param max_range: Maximum range in km of all links, unlimited if None
+    :param ephemeris_dir: see many_to_one_experiment
+    """
+    setup_start = datetime.now()
+    catalog = get_satellite_catalog(celestrak_file)
+    ephemeris_store = None
+    if ephemeris_dir is not None:
+        ephemeris_store = EphemerisStore(ephemeris_dir, time_window_start, time_window_end, time_step_size)
+    service = DefenderService(catalog, ground_stations, time_window_start, time_window_end, time_step_size,
+                              ephemeris_store, AccessConstraints(min_elevation, max_range=max_range),
+                              AccessConstraints(max_range=max_range))
+    print(f"Hot ephemeris of {service.positions.shape[0]} satellites x {service.positions.shape[1]} time steps "
+          f"({service.positions.nbytes / 2 ** 20:.0f} MiB) ready after {datetime.now() - setup_start}")
+
+    async def run():
+        server = await start_server(service, host, port, socket_path)
+        print(f"Listening on {socket_path or f'{host}:{port}'}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Stopped")
+
+
+async def run_load_test(events, concurrency, host, port, socket_path):
+    latencies = []
+    server_latencies = []
+    errors = []
+
+    async def client(client_events):
+        if socket_path is not None:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        for event in client_events:
+            start = time.perf_counter()
+            writer.write(json.dumps(event).encode() + b"\n")
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            server_latencies.append(response["latency"])
+            if "error" in response:
+                errors.append(response["error"])
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(events[offset::concurrency]) for offset in range(concurrency)])
+    return np.array(latencies), np.array(server_latencies), errors, time.perf_counter() - start
+
+
+def load_test(requests=1000, concurrency=4, host=IPS_HOST, port=IPS_PORT, socket_path=None,
+              stations=None, victim_ssc_numbers=VICTIM_SSC_NUMBERS, time_window_start=SERVICE_WINDOW_START,
+              time_window_end=SERVICE_WINDOW_END, tail_time=TAIL_TIME, top=10, seed=0):
+    """
+    Sends random events to a running service and prints the latency percentiles
+    :param requests: Number of events
+    :param concurrency: Number of connections sending events at the same time
+    :param stations: Names of the attacker stations, those of GROUND_STATIONS if None
+    :param victim_ssc_numbers: SSC numbers of the victims
+    :param time_window_start: STK date, event times are drawn uniformly from the time window
+    :param time_window_end: STK date
+    :param top: Number of defenders per response
+    :return: round trip latencies in seconds
+    """
+    if stations is None:
+        stations = [station[0] for station in GROUND_STATIONS]
+
+    generator = np.random.default_rng(seed)
+    start, stop = time_grid(time_window_start, time_window_end, 1)[[0, -1]]
+    offsets = generator.integers(0, (stop - start) // np.timedelta64(1, "ms"), requests)
+    event_times = (start + offsets.astype("timedelta64[ms]")).astype(datetime)
+    events = [{
+        "id": number,
+        "station": stations[generator.integers(len(stations))],
+        "victim": victim_ssc_numbers[generator.integers(len(victim_ssc_numbers))],
+        "time": event_time.strftime("%d %b %Y %H:%M:%S.%f"),
+        "tail_time": tail_time,
+        "top": top
+    } for number, event_time in enumerate(event_times)]
+
+    latencies, server_latencies, errors, duration = asyncio.run(run_load_test(events, concurrency, host, port,
+                                                                              socket_path))
+
+    print(f"{requests} events over {concurrency} connections in {duration:.2f}s ({requests / duration:.0f} events/s)")
+    for name, values in [("Round trip", latencies), ("Service", server_latencies)]:
+        p50, p99 = np.percentile(values, [50, 99]) * 1000
+        print(f"{name} latency: p50 {p50:.3f}ms | p99 {p99:.3f}ms | max {values.max() * 1000:.3f}ms")
+    if errors:
+        print(f"{len(errors)} errors, e.g. {errors[0]}")
+
+    return latencies
+
+
+if __name__ == "__main__":
+    serve()
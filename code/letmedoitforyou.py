@@ -0,0 +1,270 @@
+"""
+Command line interface of the experiments
+
+    python letmedoitforyou.py exp1 --backend sgp4
+    python letmedoitforyou.py exp2 --backend sgp4 --constellations starlink iridium
+    python letmedoitforyou.py visualize results/report_Exp1.json --top 10
+    python letmedoitforyou.py show results/report_Exp1.json
+    python letmedoitforyou.py decision --AtoD 1000000 --DtoV 200000 --AtoV 700000
+    python letmedoitforyou.py sweep-exp1 --backend sgp4 --bit-rates 4800 9600 --tail-sizes 32 48
+    python letmedoitforyou.py matrix --victims 44878 25544 --constellation starlink
+    python letmedoitforyou.py ips --port 8750
+    python letmedoitforyou.py ips-load-test --port 8750 --requests 10000 --concurrency 8
+
+Settings can also be given in a JSON config file with one object per subcommand, using the parameter names of the
+experiment functions, e.g. {"exp2": {"backend": "sgp4", "constellations": ["starlink"], "time_step_size": 10}}.
+Arguments on the command line take precedence. Defaults are those of one_to_one_experiment and many_to_one_experiment.
+numpy, scipy, matplotlib and the STK API are only imported by the subcommands that need them.
+"""
+import argparse
+import json
+import os.path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BACKENDS = ["stk", "sgp4", "stk-sim"]
+PROFILERS = ["cprofile", "pyinstrument"]
+
+
+def run_exp1(settings):
+    from experiment1 import one_to_one_experiment
+    one_to_one_experiment(**settings)
+
+
+def run_exp2(settings):
+    from experiment2 import many_to_one_experiment
+    many_to_one_experiment(**settings)
+
+
+def run_visualize(settings):
+    import visualize_times
+
+    report = settings.pop("report", None)
+    if report is None:
+        windows = visualize_times.timing_windows(visualize_times.AtoD, visualize_times.DtoV, visualize_times.AtoV,
+                                                 visualize_times.tail_time)
+        visualize_times.TimingDiagram().draw(windows, "TimeWindow.pdf")
+        return
+
+    settings.setdefault("output_dir", os.path.join(BASE_DIR, "results", "timing_diagrams"))
+    visualize_times.render_report(report, **settings)
+
+
+def run_show(settings):
+    from experiment1 import show_results_in_stk
+    show_results_in_stk(settings.pop("report", None), **settings)
+
+
+def run_decision(settings):
+    import decision_window_calc
+
+    AtoD = settings.get("AtoD", decision_window_calc.AtoD)
+    DtoV = settings.get("DtoV", decision_window_calc.DtoV)
+    AtoV = settings.get("AtoV", decision_window_calc.AtoV)
+    tail_time = settings.get("tail_time", decision_window_calc.tail_time)
+    if "tail_time" not in settings and ("bit_rate" in settings or "tail_size" in settings):
+        tail_time = 1 / settings.get("bit_rate", decision_window_calc.bit_rate) * \
+                    settings.get("tail_size", decision_window_calc.tail_size)
+
+    decision_delay = decision_window_calc.decisionDelay(AtoD, DtoV, AtoV, tail_time)
+    print(f"Decision delay of {decision_delay * 1000}ms")
+    if decision_delay <= 0:
+        print("The defender can't react in time!")
+
+
+def run_sweep_exp1(settings):
+    from parameter_sweep import one_to_one_sweep
+    one_to_one_sweep(**settings)
+
+
+def run_sweep_exp2(settings):
+    from parameter_sweep import many_to_one_sweep
+    many_to_one_sweep(**settings)
+
+
+def run_matrix(settings):
+    import protection_matrix
+
+    ground_stations_file = settings.pop("ground_stations_file", None)
+    if ground_stations_file is not None:
+        settings["ground_stations"] = protection_matrix.load_ground_stations(ground_stations_file)
+    protection_matrix.protection_matrix(**settings)
+
+
+def run_ips(settings):
+    import ips_service
+
+    ground_stations_file = settings.pop("ground_stations_file", None)
+    if ground_stations_file is not None:
+        from protection_matrix import load_ground_stations
+        settings["ground_stations"] = load_ground_stations(ground_stations_file)
+    ips_service.serve(**settings)
+
+
+def run_ips_load_test(settings):
+    from ips_service import load_test
+    load_test(**settings)
+
+
+def create_parser():
+    # Options are only set if given, so the config file and the defaults of the experiments apply otherwise
+    config_parser = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+    config_parser.add_argument("--config", help="JSON file with settings per subcommand")
+
+    parser = argparse.ArgumentParser(description="Let Me Do It For You: feasibility of inter-satellite friendly "
+                                                 "jamming", parents=[config_parser])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_subparser(name, help, run):
+        subparser = subparsers.add_parser(name, help=help, parents=[config_parser],
+                                          argument_default=argparse.SUPPRESS)
+        subparser.set_defaults(run=run)
+        return subparser
+
+    def add_experiment_arguments(subparser):
+        subparser.add_argument("--backend", choices=BACKENDS)
+        subparser.add_argument("--prune-margin", type=float, help="km, only load satellites near the feasibility "
+                                                                  "ellipsoid into STK")
+        subparser.add_argument("--no-resume", dest="resume", action="store_false", help="Ignore the journal")
+        subparser.add_argument("--workers", type=int, help="Processes for the sgp4 backend")
+        subparser.add_argument("--latency-scale", type=float, help="Latency factor of the stk-sim backend")
+        subparser.add_argument("--profiler", choices=PROFILERS)
+        subparser.add_argument("--results-store", help="Directory of per-satellite results, only new or changed "
+                                                       "element sets are evaluated (sgp4 backend)")
+        subparser.add_argument("--celestrak-file")
+
+    exp1 = add_subparser("exp1", "One-on-one protection (Experiment 1)", run_exp1)
+    add_experiment_arguments(exp1)
+    exp1.add_argument("--target-time", help="STK date, e.g. \"1 Jan 2024 03:00:45.000000000\"")
+    exp1.add_argument("--bit-rate", type=float, help="bits per second")
+    exp1.add_argument("--tail-size", type=int, help="bits")
+
+    exp2 = add_subparser("exp2", "Protection as a service offered by constellations (Experiment 2)", run_exp2)
+    add_experiment_arguments(exp2)
+    exp2.add_argument("--constellations", nargs="+")
+    exp2.add_argument("--start", dest="time_window_start", help="STK date")
+    exp2.add_argument("--end", dest="time_window_end", help="STK date")
+    exp2.add_argument("--step", dest="time_step_size", type=int, help="seconds between the time slots")
+    exp2.add_argument("--tail-time", type=float, help="seconds")
+    exp2.add_argument("--ephemeris-dir")
+    exp2.add_argument("--event-based", action="store_true", help="Exact coverage windows instead of time slots")
+    exp2.add_argument("--coarse-step", type=float, help="seconds, only with --event-based")
+    exp2.add_argument("--report-format", choices=["json", "columnar", "both"])
+    exp2.add_argument("--top-defenders", type=int, help="Only keep this many defenders per time slot, sgp4 only")
+    exp2.add_argument("--time-block-size", type=int, help="Time slots propagated and evaluated at once, sgp4 only")
+    exp2.add_argument("--precision", choices=["float64", "float32"], help="Precision of the positions, sgp4 only")
+
+    visualize = add_subparser("visualize", "Timing diagrams of the decision window", run_visualize)
+    visualize.add_argument("report", nargs="?", help="Report of Experiment 1 or 2, the constants of "
+                                                     "decision_window_calc.py if omitted")
+    visualize.add_argument("--top", type=int)
+    visualize.add_argument("--workers", type=int)
+    visualize.add_argument("--output-dir")
+    visualize.add_argument("--format", dest="file_format")
+
+    show = add_subparser("show", "Add the defenders of an Experiment 1 report to the running STK scenario", run_show)
+    show.add_argument("report", nargs="?", help="results/report_Exp1.json if omitted")
+    show.add_argument("--celestrak-file")
+
+    decision = add_subparser("decision", "Decision delay for a single constellation of attacker, defender and "
+                                         "victim", run_decision)
+    decision.add_argument("--AtoD", type=float, help="m")
+    decision.add_argument("--DtoV", type=float, help="m")
+    decision.add_argument("--AtoV", type=float, help="m")
+    decision.add_argument("--bit-rate", type=float, help="bits per second")
+    decision.add_argument("--tail-size", type=int, help="bits")
+    decision.add_argument("--tail-time", type=float, help="seconds, instead of bit rate and tail size")
+
+    def add_sweep_arguments(subparser):
+        subparser.add_argument("--backend", choices=BACKENDS)
+        subparser.add_argument("--bit-rates", nargs="+", type=float, help="bits per second")
+        subparser.add_argument("--tail-sizes", nargs="+", type=int, help="bits")
+        subparser.add_argument("--prune-margin", type=float, help="km, only load satellites near the feasibility "
+                                                                  "ellipsoid into STK")
+        subparser.add_argument("--latency-scale", type=float, help="Latency factor of the stk-sim backend")
+        subparser.add_argument("--celestrak-file")
+
+    sweep_exp1 = add_subparser("sweep-exp1", "Defenders of Experiment 1 for a grid of bit rates, tail sizes and "
+                                             "target times", run_sweep_exp1)
+    add_sweep_arguments(sweep_exp1)
+    sweep_exp1.add_argument("--target-times", nargs="+", help="STK dates")
+
+    sweep_exp2 = add_subparser("sweep-exp2", "Defend percentage of Experiment 2 for a grid of bit rates and tail "
+                                             "sizes", run_sweep_exp2)
+    add_sweep_arguments(sweep_exp2)
+    sweep_exp2.add_argument("--constellations", nargs="+")
+    sweep_exp2.add_argument("--start", dest="time_window_start", help="STK date")
+    sweep_exp2.add_argument("--end", dest="time_window_end", help="STK date")
+    sweep_exp2.add_argument("--step", dest="time_step_size", type=int, help="seconds between the time slots")
+
+    matrix = add_subparser("matrix", "Protection of every victim against every attacker ground station", run_matrix)
+    matrix.add_argument("--ground-stations-file", help="JSON list of {\"name\", \"latitude\", \"longitude\", "
+                                                       "\"altitude\"} in degrees and km")
+    matrix.add_argument("--victims", dest="victim_ssc_numbers", nargs="+", help="SSC numbers")
+    matrix.add_argument("--constellation", help="Only take the defenders from this constellation")
+    matrix.add_argument("--start", dest="time_window_start", help="STK date")
+    matrix.add_argument("--end", dest="time_window_end", help="STK date")
+    matrix.add_argument("--step", dest="time_step_size", type=int, help="seconds between the time slots")
+    matrix.add_argument("--tail-time", type=float, help="seconds")
+    matrix.add_argument("--min-elevation", type=float, help="degrees, elevation mask of the ground stations")
+    matrix.add_argument("--max-range", type=float, help="km, of all links")
+    matrix.add_argument("--ephemeris-dir")
+    matrix.add_argument("--celestrak-file")
+
+    def add_service_arguments(subparser):
+        subparser.add_argument("--host")
+        subparser.add_argument("--port", type=int)
+        subparser.add_argument("--socket", dest="socket_path", help="Unix socket instead of TCP")
+        subparser.add_argument("--start", dest="time_window_start", help="STK date")
+        subparser.add_argument("--end", dest="time_window_end", help="STK date")
+
+    ips = add_subparser("ips", "Service answering attack events with ranked defenders", run_ips)
+    add_service_arguments(ips)
+    ips.add_argument("--ground-stations-file", help="JSON list of {\"name\", \"latitude\", \"longitude\", "
+                                                    "\"altitude\"} in degrees and km")
+    ips.add_argument("--step", dest="time_step_size", type=float, help="seconds between the positions kept in "
+                                                                       "memory")
+    ips.add_argument("--min-elevation", type=float, help="degrees, elevation mask of the ground stations")
+    ips.add_argument("--max-range", type=float, help="km, of all links")
+    ips.add_argument("--ephemeris-dir")
+    ips.add_argument("--celestrak-file")
+
+    ips_load_test = add_subparser("ips-load-test", "Latency percentiles of a running ips service", run_ips_load_test)
+    add_service_arguments(ips_load_test)
+    ips_load_test.add_argument("--requests", type=int)
+    ips_load_test.add_argument("--concurrency", type=int, help="Connections sending events at the same time")
+    ips_load_test.add_argument("--stations", nargs="+")
+    ips_load_test.add_argument("--victims", dest="victim_ssc_numbers", nargs="+", help="SSC numbers")
+    ips_load_test.add_argument("--tail-time", type=float, help="seconds")
+    ips_load_test.add_argument("--top", type=int, help="Defenders per response")
+
+    return parser, subparsers
+
+
+def main(argv=None):
+    parser, subparsers = create_parser()
+    args = vars(parser.parse_args(argv))
+
+    command = args.pop("command")
+    run = args.pop("run")
+    config_file = args.pop("config", None)
+
+    settings = {}
+    if config_file is not None:
+        with open(config_file, "r") as f:
+            config = json.load(f)
+
+        # Only settings the subcommand knows, a typo should not be silently ignored
+        known_settings = {action.dest for action in subparsers.choices[command]._actions}
+        unknown_settings = set(config.get(command, {})) - known_settings
+        if unknown_settings:
+            print(f"Unknown settings for {command} in {config_file}: {', '.join(sorted(unknown_settings))}")
+            exit(1)
+        settings.update(config.get(command, {}))
+
+    settings.update(args)
+    run(settings)
+
+
+if __name__ == "__main__":
+    main()
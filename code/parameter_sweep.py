@@ -0,0 +1,342 @@
+import json
+import os.path
+from datetime import datetime
+
+import numpy as np
+
+import experiment1
+import experiment2
+from decision_window_calc import decisionDelayBatch
+from geometry_backend import create_stk_backend
+from instrumentation import PhaseTimer, ProgressPrinter, print_phases
+from propagation import PropagationInterface, time_grid
+from sat_manager import build_constellation_index, get_satellite_catalog, prefilter_orbital_shells
+from spatial_index import find_candidate_defenders
+from stk_dates import lookup_ranges, offsets_to_datetime64
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Default grid of the sweeps, the defaults of the experiments are part of it
+BIT_RATES = [1200, 2400, 4800, 6000, 9600, 19200]  # in bits per second
+TAIL_SIZES = [8, 16, 32, 48, 64]  # in bits
+TARGET_TIMES = ["1 Jan 2024 03:00:15.000000000", "1 Jan 2024 03:00:45.000000000", "1 Jan 2024 03:01:15.000000000"]
+
+
+def tail_time_grid(bit_rates, tail_sizes):
+    """
+    :return: tail times in seconds, shape (bit rates, tail sizes)
+    """
+    return np.asarray(tail_sizes, dtype=np.float64)[np.newaxis] / np.asarray(bit_rates, dtype=np.float64)[:, np.newaxis]
+
+
+def sweep_decision_delays(AtoD, DtoV, AtoV, tail_times):
+    """
+    Decision delays for every tail time of the grid in one array operation
+    :param AtoD: Distances in m, shape (satellites, times), NaN if not in range
+    :param DtoV: Distances in m, shape (satellites, times), NaN if not in range
+    :param AtoV: Distances in m, shape (times,)
+    :param tail_times: in seconds, shape (bit rates, tail sizes)
+    :return: decision delay and mask of the defenders, shape (bit rates, tail sizes, satellites, times)
+    """
+    return decisionDelayBatch(AtoD, DtoV, AtoV, tail_times[..., np.newaxis, np.newaxis])
+
+
+def geometry_sgp4(propagation_interface, times, tail_time, rows=None, timer=None):
+    """
+    Ranges of every satellite that can defend at any of the times with the longest tail time of the grid. Shorter
+    tail times have smaller feasibility ellipsoids, so their defenders are a subset.
+    :param times: datetime64 array
+    :param tail_time: Longest tail time of the grid in seconds
+    :param rows: Catalog rows to check, all if None
+    :return: candidate rows, AtoD and DtoV in m of shape (candidates, times)
+    """
+    if timer is None:
+        timer = PhaseTimer()
+    if rows is None:
+        rows = np.arange(len(propagation_interface.elements["NORAD_CAT_ID"]))
+
+    with timer.phase("propagate"):
+        candidates, positions = find_candidate_defenders(propagation_interface, times, tail_time, rows)
+
+    # The victim can't protect itself
+    candidate_indices = np.nonzero(candidates.any(axis=1) & (propagation_interface.elements["NORAD_CAT_ID"][rows] !=
+                                                              int(propagation_interface.victim_object.ssc_number)))[0]
+    timer.count("satellites checked", len(rows))
+    timer.count("candidates", len(candidate_indices))
+
+    with timer.phase("range calculation"):
+        candidate_positions = positions[candidate_indices]
+        AtoD, DtoV = propagation_interface.get_defender_ranges(candidate_positions, times)
+        AtoD, DtoV = AtoD * 1000, DtoV * 1000
+
+    return rows[candidate_indices], AtoD, DtoV
+
+
+def geometry_stk(stk_interface, satellite_ssc_number_mapping, target_offsets, timer=None):
+    """
+    Ranges of every satellite of the mapping, each satellite is only added to the scenario once for all target times
+    :param target_offsets: Seconds since scenario start
+    :return: satellite names, AtoD and DtoV in m of shape (satellites, target times)
+    """
+    if timer is None:
+        timer = PhaseTimer()
+
+    attacker = stk_interface.attacker_object
+    victim = stk_interface.victim_object
+
+    names = []
+    AtoD = np.full((len(satellite_ssc_number_mapping), len(target_offsets)), np.nan)
+    DtoV = np.full_like(AtoD, np.nan)
+    progress_printer = ProgressPrinter()
+    for index, (satellite_name, ssc_number) in enumerate(satellite_ssc_number_mapping.items()):
+        progress_printer.print(f"Satellite {index + 1} of {len(satellite_ssc_number_mapping)}",
+                               force=index + 1 == len(satellite_ssc_number_mapping))
+        names.append(satellite_name)
+        timer.count("satellites checked")
+
+        with timer.phase("add satellite"):
+            defender = stk_interface.add_satellite(stk_interface.convert_name(satellite_name), ssc_number)
+
+        with timer.phase("AER execution"):
+            AtoD[index] = lookup_ranges(*stk_interface.get_range_data(attacker, defender), target_offsets) * 1000
+            DtoV[index] = lookup_ranges(*stk_interface.get_range_data(defender, victim), target_offsets) * 1000
+
+        with timer.phase("cleanup"):
+            stk_interface.remove_satellite(defender)
+
+    return names, AtoD, DtoV
+
+
+def print_table(title, bit_rates, tail_sizes, values):
+    """
+    :param values: shape (bit rates, tail sizes)
+    """
+    print(title)
+    print("bit rate \\ tail size".rjust(22) + "".join(f"{tail_size:>10}" for tail_size in tail_sizes))
+    for bit_rate, row in zip(bit_rates, values):
+        print(f"{bit_rate:>22}" + "".join(f"{value:>10}" for value in row))
+
+
+def write_sweep_report(file_name, setup, experiment_start, timer, table):
+    results_dir = os.path.join(BASE_DIR, "results")
+    if not os.path.isdir(results_dir):
+        os.mkdir(results_dir)
+
+    experiment_end = datetime.now()
+    print(f"Runtime: {experiment_end - experiment_start}")
+    output = {
+        "setup": setup,
+        "runtime": {
+            "start": str(experiment_start),
+            "end": str(experiment_end),
+            "runtime": str(experiment_end - experiment_start),
+            **timer.to_dict()
+        },
+        "report": table
+    }
+    with open(os.path.join(results_dir, file_name), "w") as outfile:
+        json.dump(output, outfile, indent=1)
+    print_phases(timer)
+
+
+def one_to_one_sweep(backend="sgp4", bit_rates=BIT_RATES, tail_sizes=TAIL_SIZES, target_times=TARGET_TIMES,
+                     prune_margin=None, latency_scale=1.0, celestrak_file=experiment1.CELESTRAK_FILE):
+    """
+    Experiment 1 for a grid of bit rates, tail sizes and target times. The geometry is computed once, the feasibility
+    table (number of defenders per combination) follows from a single decision delay evaluation.
+    Report in results/report_Sweep_Exp1.json.
+    :param backend: "sgp4", "stk" or "stk-sim", see one_to_one_experiment
+    :param target_times: STK dates, within the STK scenario for the stk backends
+    :param prune_margin: Only for the stk backends, see one_to_one_experiment
+    """
+    experiment_start = datetime.now()
+    timer = PhaseTimer()
+
+    tail_times = tail_time_grid(bit_rates, tail_sizes)
+    max_tail_time = float(tail_times.max())
+    times = np.concatenate([time_grid(target_time, target_time, 1) for target_time in target_times])
+
+    with timer.phase("catalog load"):
+        catalog = get_satellite_catalog(celestrak_file)
+        catalog = prefilter_orbital_shells(catalog, experiment1.VICTIM_SSC_NUMBER, max_tail_time,
+                                           attacker_altitude=experiment1.ATTACKER_POSITION[2])
+
+    with timer.phase("backend setup"):
+        if backend == "sgp4" or prune_margin is not None:
+            propagation_interface = PropagationInterface(catalog, target_times[np.argmin(times)],
+                                                         target_times[np.argmax(times)],
+                                                         experiment1.ATTACKER_POSITION, experiment1.VICTIM_SSC_NUMBER)
+        if backend == "sgp4":
+            interface = propagation_interface
+        else:
+            interface = create_stk_backend(backend, catalog, experiment1.SCENARIO_START_TIME,
+                                           experiment1.SCENARIO_STOP_TIME, experiment1.ATTACKER_POSITION,
+                                           experiment1.VICTIM_SSC_NUMBER,
+                                           os.path.join(BASE_DIR, "results", experiment1.STK_TIMINGS_FILE),
+                                           latency_scale)
+
+    attacker = interface.attacker_object
+    victim = interface.victim_object
+    print("Starting sweep...")
+    if backend == "sgp4":
+        AtoV = interface.get_range_series(attacker, victim, times) * 1000
+        rows, AtoD, DtoV = geometry_sgp4(interface, times, max_tail_time, timer=timer)
+        names = catalog["OBJECT_NAME"][rows].tolist()
+    else:
+        target_offsets = interface.time_offsets(target_times)
+        with timer.phase("AER execution"):
+            AtoV = lookup_ranges(*interface.get_range_data(attacker, victim), target_offsets) * 1000
+
+        satellite_ssc_number_mapping = {satellite_name: ssc_number for satellite_name, ssc_number
+                                        in catalog.get_ssc_mapping().items()
+                                        if ssc_number != experiment1.VICTIM_SSC_NUMBER}
+        if prune_margin is not None:
+            with timer.phase("prune"):
+                satellite_ssc_number_mapping = experiment1.prune_ssc_mapping(
+                    propagation_interface, satellite_ssc_number_mapping, times, max_tail_time, prune_margin)
+        names, AtoD, DtoV = geometry_stk(interface, satellite_ssc_number_mapping, target_offsets, timer)
+
+    for target_time in np.asarray(target_times)[np.isnan(AtoV)]:
+        print(f"Attacker and Victim are not in range of each other at {target_time}!")
+        exit(1)
+
+    with timer.phase("decision evaluation"):
+        decision_delay, can_defend = sweep_decision_delays(AtoD, DtoV, AtoV, tail_times)
+        defenders = can_defend.sum(axis=2)
+        best_decision_delay = np.where(can_defend, decision_delay, -np.inf).max(axis=2, initial=-np.inf)
+
+    table = []
+    for (bit_rate_index, tail_size_index, time_index), number_of_defenders in np.ndenumerate(defenders):
+        best = best_decision_delay[bit_rate_index, tail_size_index, time_index]
+        table.append({
+            "Bit rate": bit_rates[bit_rate_index],
+            "Tail size": tail_sizes[tail_size_index],
+            "Tail time": float(tail_times[bit_rate_index, tail_size_index]),
+            "Target time": target_times[time_index],
+            "defenders": int(number_of_defenders),
+            "best decision delay": float(best) if np.isfinite(best) else None
+        })
+
+    for time_index, target_time in enumerate(target_times):
+        print_table(f"Defenders at {target_time}", bit_rates, tail_sizes, defenders[..., time_index])
+
+    setup = {
+        "Attacker": attacker.InstanceName,
+        "Victim": victim.InstanceName,
+        "Bit rates": list(bit_rates),
+        "Tail sizes": list(tail_sizes),
+        "Target times": list(target_times),
+        "Backend": backend,
+        "Satellites after prefilter": len(catalog),
+        "Satellites evaluated": len(names)
+    }
+    write_sweep_report("report_Sweep_Exp1.json", setup, experiment_start, timer, table)
+    return table
+
+
+def many_to_one_sweep(backend="sgp4", bit_rates=BIT_RATES, tail_sizes=TAIL_SIZES, constellations=None,
+                      prune_margin=None, latency_scale=1.0, time_window_start=experiment2.TIME_WINDOW_START,
+                      time_window_end=experiment2.TIME_WINDOW_END, time_step_size=experiment2.TIME_STEP_SIZE,
+                      celestrak_file=experiment2.CELESTRAK_FILE):
+    """
+    Experiment 2 for a grid of bit rates and tail sizes, the target times are the time slots. Only the largest
+    decision delay of each slot is kept (decisionDelay with a tail time of 0), a slot is defended for every tail time
+    that makes it positive. Report in results/report_Sweep_Exp2.json.
+    :param backend: "sgp4", "stk" or "stk-sim", see many_to_one_experiment
+    :param constellations: Names of CONSTELLATION_PATTERNS, CONSTELLATIONS of experiment2.py if None
+    :param prune_margin: Only for the stk backends, see many_to_one_experiment
+    """
+    experiment_start = datetime.now()
+    timer = PhaseTimer()
+    if constellations is None:
+        constellations = experiment2.CONSTELLATIONS
+
+    tail_times = tail_time_grid(bit_rates, tail_sizes)
+    max_tail_time = float(tail_times.max())
+
+    with timer.phase("catalog load"):
+        catalog = get_satellite_catalog(celestrak_file)
+        catalog = prefilter_orbital_shells(catalog, experiment2.VICTIM_SSC_NUMBER, max_tail_time,
+                                           attacker_altitude=experiment2.ATTACKER_POSITION[2])
+        constellation_index = build_constellation_index(catalog, constellations)
+
+    with timer.phase("backend setup"):
+        if backend == "sgp4" or prune_margin is not None:
+            propagation_interface = PropagationInterface(catalog, time_window_start, time_window_end,
+                                                         experiment2.ATTACKER_POSITION, experiment2.VICTIM_SSC_NUMBER)
+        if backend == "sgp4":
+            interface = propagation_interface
+        else:
+            interface = create_stk_backend(backend, catalog, time_window_start, time_window_end,
+                                           experiment2.ATTACKER_POSITION, experiment2.VICTIM_SSC_NUMBER,
+                                           os.path.join(BASE_DIR, "results", experiment2.STK_TIMINGS_FILE),
+                                           latency_scale)
+            interface.scenario.SetTimePeriod(time_window_start, time_window_end)
+
+    attacker = interface.attacker_object
+    victim = interface.victim_object
+    print("Starting sweep...")
+    with timer.phase("AER execution"):
+        AtoV_offsets, AtoV_ranges = interface.get_range_data(attacker, victim, step_size=time_step_size)
+    if not AtoV_offsets.size:
+        print("Attacker is never in range of victim in this scenario!")
+        exit(1)
+    slot_times = offsets_to_datetime64(AtoV_offsets, time_window_start)
+    AtoV = AtoV_ranges * 1000
+
+    table = []
+    for constellation_name in constellations:
+        rows = constellation_index[constellation_name]
+        print(f"{len(rows)} satellites in constellation {constellation_name}")
+
+        if backend == "sgp4":
+            _, AtoD, DtoV = geometry_sgp4(interface, slot_times, max_tail_time, rows, timer)
+        else:
+            satellite_ssc_number_mapping = {str(name): str(ssc_number) for name, ssc_number
+                                            in zip(catalog["OBJECT_NAME"][rows], catalog.ssc_numbers()[rows])
+                                            if str(ssc_number) != experiment2.VICTIM_SSC_NUMBER}
+            if prune_margin is not None:
+                with timer.phase("prune"):
+                    satellite_ssc_number_mapping = experiment1.prune_ssc_mapping(
+                        propagation_interface, satellite_ssc_number_mapping, slot_times, max_tail_time, prune_margin)
+            _, AtoD, DtoV = geometry_stk(interface, satellite_ssc_number_mapping, AtoV_offsets, timer)
+
+        with timer.phase("decision evaluation"):
+            # NaN of satellites out of range are ignored by fmax
+            margins, _ = decisionDelayBatch(AtoD, DtoV, AtoV, 0.0)
+            best_margin = np.fmax.reduce(margins, axis=0, initial=-np.inf)
+            defended = best_margin + tail_times[..., np.newaxis] > 0
+            defended_times = defended.sum(axis=-1)
+
+        for (bit_rate_index, tail_size_index), number_of_defended_times in np.ndenumerate(defended_times):
+            table.append({
+                "Constellation": constellation_name,
+                "Bit rate": bit_rates[bit_rate_index],
+                "Tail size": tail_sizes[tail_size_index],
+                "Tail time": float(tail_times[bit_rate_index, tail_size_index]),
+                "defended times": int(number_of_defended_times),
+                "not defended times": len(AtoV_offsets) - int(number_of_defended_times),
+                "defend percentage": int(number_of_defended_times) / len(AtoV_offsets) * 100
+            })
+
+        print_table(f"Defend percentage of {constellation_name}", bit_rates, tail_sizes,
+                    np.round(defended_times / len(AtoV_offsets) * 100, 1))
+
+    setup = {
+        "Attacker": attacker.InstanceName,
+        "Victim": victim.InstanceName,
+        "Start time": time_window_start,
+        "End time": time_window_end,
+        "Bit rates": list(bit_rates),
+        "Tail sizes": list(tail_sizes),
+        "Time step size": time_step_size,
+        "Number of observations": len(AtoV_offsets),
+        "Backend": backend,
+        "Satellites after prefilter": len(catalog)
+    }
+    write_sweep_report("report_Sweep_Exp2.json", setup, experiment_start, timer, table)
+    return table
+
+
+if __name__ == "__main__":
+    one_to_one_sweep()
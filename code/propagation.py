@@ -0,0 +1,553 @@
+import numpy as np
+
+import stk_dates
+from access import NO_CONSTRAINTS, WGS84_A, WGS84_E2, access_range_data, ground_access_ranges, satellite_access_ranges
+
+# WGS-72 constants used by SGP4 (see Vallado et al., "Revisiting Spacetrack Report #3", 2006)
+SGP4_EARTH_RADIUS = 6378.135  # km
+SGP4_MU = 398600.8  # km^3/s^2
+XKE = 60.0 / np.sqrt(SGP4_EARTH_RADIUS ** 3 / SGP4_MU)
+J2 = 0.001082616
+J3 = -0.00000253881
+J4 = -0.00000165597
+J3OJ2 = J3 / J2
+
+TWO_PI = 2 * np.pi
+MINUTES_PER_DAY = 1440.0
+
+# Satellite samples propagated at once for positions of a smaller dtype than float64. SGP4 keeps a few dozen float64
+# intermediates per sample, the chunks are cast into the result so they only exist for one chunk at a time
+PROPAGATION_CHUNK_SAMPLES = 250000
+
+# Orbital elements needed from the CelesTrak OMM records
+ELEMENT_FIELDS = ["MEAN_MOTION", "ECCENTRICITY", "INCLINATION", "RA_OF_ASC_NODE", "ARG_OF_PERICENTER",
+                  "MEAN_ANOMALY", "BSTAR"]
+
+
+def parse_epoch(epoch):
+    """
+    Converts CelesTrak EPOCH strings (ISO format, UTC) to numpy datetimes
+    :param epoch: Single string or list of strings
+    :return: datetime64[us]
+    """
+    return np.asarray(epoch, dtype="datetime64[us]")
+
+
+def sgp4_init(elements) -> dict[str, np.ndarray]:
+    """
+    Vectorized SGP4 initialisation (near earth branch of sgp4init, 'improved' operation mode).
+    Deep space objects (period >= 225 min) are propagated with the simplified drag model but without the
+    lunar/solar and resonance terms of SDP4. Those are GEO/MEO objects, far away from our LEO victims.
+    :param elements: Anything that can be indexed by the OMM field names (dict of arrays, structured array)
+    :return: SGP4 constants per satellite
+    """
+    epoch = parse_epoch(elements["EPOCH"])
+    no_kozai = np.asarray(elements["MEAN_MOTION"], dtype=np.float64) * TWO_PI / MINUTES_PER_DAY  # rad/min
+    ecco = np.asarray(elements["ECCENTRICITY"], dtype=np.float64)
+    inclo = np.radians(elements["INCLINATION"])
+    nodeo = np.radians(elements["RA_OF_ASC_NODE"])
+    argpo = np.radians(elements["ARG_OF_PERICENTER"])
+    mo = np.radians(elements["MEAN_ANOMALY"])
+    bstar = np.asarray(elements["BSTAR"], dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Recover original mean motion and semi major axis from the Kozai elements
+        eccsq = ecco * ecco
+        omeosq = 1.0 - eccsq
+        rteosq = np.sqrt(omeosq)
+        cosio = np.cos(inclo)
+        cosio2 = cosio * cosio
+        ak = (XKE / no_kozai) ** (2.0 / 3.0)
+        d1 = 0.75 * J2 * (3.0 * cosio2 - 1.0) / (rteosq * omeosq)
+        del_ = d1 / (ak * ak)
+        adel = ak * (1.0 - del_ * del_ - del_ * (1.0 / 3.0 + 134.0 * del_ * del_ / 81.0))
+        del_ = d1 / (adel * adel)
+        no_unkozai = no_kozai / (1.0 + del_)
+        ao = (XKE / no_unkozai) ** (2.0 / 3.0)
+        sinio = np.sin(inclo)
+        po = ao * omeosq
+        con42 = 1.0 - 5.0 * cosio2
+        con41 = -con42 - cosio2 - cosio2
+        posq = po * po
+        rp = ao * (1.0 - ecco)
+
+        # Low perigee satellites use a simplified drag model
+        deep_space = TWO_PI / no_unkozai >= 225.0
+        isimp = (rp < 220.0 / SGP4_EARTH_RADIUS + 1.0) | deep_space
+
+        # Atmospheric density parameters depend on the perigee height
+        perigee = (rp - 1.0) * SGP4_EARTH_RADIUS
+        low_perigee = perigee < 156.0
+        sfour_km = np.where(perigee < 98.0, 20.0, perigee - 78.0)
+        qzms24 = np.where(low_perigee, ((120.0 - sfour_km) / SGP4_EARTH_RADIUS) ** 4,
+                          ((120.0 - 78.0) / SGP4_EARTH_RADIUS) ** 4)
+        sfour = np.where(low_perigee, sfour_km / SGP4_EARTH_RADIUS + 1.0, 78.0 / SGP4_EARTH_RADIUS + 1.0)
+
+        pinvsq = 1.0 / posq
+        tsi = 1.0 / (ao - sfour)
+        eta = ao * ecco * tsi
+        etasq = eta * eta
+        eeta = ecco * eta
+        psisq = np.abs(1.0 - etasq)
+        coef = qzms24 * tsi ** 4
+        coef1 = coef / psisq ** 3.5
+        cc2 = coef1 * no_unkozai * (ao * (1.0 + 1.5 * etasq + eeta * (4.0 + etasq)) + 0.375 * J2 * tsi / psisq *
+                                    con41 * (8.0 + 3.0 * etasq * (8.0 + etasq)))
+        cc1 = bstar * cc2
+        cc3 = np.where(ecco > 1.0e-4, -2.0 * coef * tsi * J3OJ2 * no_unkozai * sinio / ecco, 0.0)
+        x1mth2 = 1.0 - cosio2
+        cc4 = 2.0 * no_unkozai * coef1 * ao * omeosq * (
+                eta * (2.0 + 0.5 * etasq) + ecco * (0.5 + 2.0 * etasq) - J2 * tsi / (ao * psisq) * (
+                -3.0 * con41 * (1.0 - 2.0 * eeta + etasq * (1.5 - 0.5 * eeta)) + 0.75 * x1mth2 * (
+                2.0 * etasq - eeta * (1.0 + etasq)) * np.cos(2.0 * argpo)))
+        cc5 = 2.0 * coef1 * ao * omeosq * (1.0 + 2.75 * (etasq + eeta) + eeta * etasq)
+
+        # Secular rates of mean anomaly, argument of perigee and node
+        cosio4 = cosio2 * cosio2
+        temp1 = 1.5 * J2 * pinvsq * no_unkozai
+        temp2 = 0.5 * temp1 * J2 * pinvsq
+        temp3 = -0.46875 * J4 * pinvsq * pinvsq * no_unkozai
+        mdot = no_unkozai + 0.5 * temp1 * rteosq * con41 + 0.0625 * temp2 * rteosq * (
+                13.0 - 78.0 * cosio2 + 137.0 * cosio4)
+        argpdot = (-0.5 * temp1 * con42 + 0.0625 * temp2 * (7.0 - 114.0 * cosio2 + 395.0 * cosio4) +
+                   temp3 * (3.0 - 36.0 * cosio2 + 49.0 * cosio4))
+        xhdot1 = -temp1 * cosio
+        nodedot = xhdot1 + (0.5 * temp2 * (4.0 - 19.0 * cosio2) + 2.0 * temp3 * (3.0 - 7.0 * cosio2)) * cosio
+        omgcof = bstar * cc3 * np.cos(argpo)
+        xmcof = np.where(ecco > 1.0e-4, -2.0 / 3.0 * coef * bstar / eeta, 0.0)
+        nodecf = 3.5 * omeosq * xhdot1 * cc1
+        t2cof = 1.5 * cc1
+        xlcof = -0.25 * J3OJ2 * sinio * (3.0 + 5.0 * cosio) / np.where(np.abs(cosio + 1.0) > 1.5e-12,
+                                                                          1.0 + cosio, 1.5e-12)
+        aycof = -0.5 * J3OJ2 * sinio
+        delmo = (1.0 + eta * np.cos(mo)) ** 3
+        sinmao = np.sin(mo)
+        x7thm1 = 7.0 * cosio2 - 1.0
+
+        # Higher order drag terms, only used by the full model
+        cc1sq = cc1 * cc1
+        d2 = 4.0 * ao * tsi * cc1sq
+        temp = d2 * tsi * cc1 / 3.0
+        d3 = (17.0 * ao + sfour) * temp
+        d4 = 0.5 * temp * ao * tsi * (221.0 * ao + 31.0 * sfour) * cc1
+        t3cof = d2 + 2.0 * cc1sq
+        t4cof = 0.25 * (3.0 * d3 + cc1 * (12.0 * d2 + 10.0 * cc1sq))
+        t5cof = 0.2 * (3.0 * d4 + 12.0 * cc1 * d3 + 6.0 * d2 * d2 + 15.0 * cc1sq * (2.0 * d2 + cc1sq))
+        d2, d3, d4, t3cof, t4cof, t5cof = [np.where(isimp, 0.0, value) for value in (d2, d3, d4, t3cof, t4cof, t5cof)]
+
+    return {
+        "epoch": epoch, "isimp": isimp, "no_unkozai": no_unkozai, "ecco": ecco, "inclo": inclo, "nodeo": nodeo,
+        "argpo": argpo, "mo": mo, "bstar": bstar, "con41": con41, "x1mth2": x1mth2, "x7thm1": x7thm1,
+        "cc1": cc1, "cc4": cc4, "cc5": cc5, "d2": d2, "d3": d3, "d4": d4, "eta": eta, "delmo": delmo,
+        "sinmao": sinmao, "mdot": mdot, "argpdot": argpdot, "nodedot": nodedot, "nodecf": nodecf,
+        "omgcof": omgcof, "xmcof": xmcof, "t2cof": t2cof, "t3cof": t3cof, "t4cof": t4cof, "t5cof": t5cof,
+        "xlcof": xlcof, "aycof": aycof,
+    }
+
+
+def sgp4_propagate(record, tsince):
+    """
+    Vectorized SGP4 position calculation
+    :param record: Result of sgp4_init
+    :param tsince: Minutes since epoch, shape (satellites, times) or broadcastable to it
+    :return: TEME positions in km, shape (satellites, times, 3). NaN where SGP4 fails (e.g. decayed)
+    """
+    column = lambda name: record[name][:, np.newaxis]
+    t = np.asarray(tsince, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Secular gravity and atmospheric drag
+        xmdf = column("mo") + column("mdot") * t
+        argpdf = column("argpo") + column("argpdot") * t
+        nodedf = column("nodeo") + column("nodedot") * t
+        t2 = t * t
+        nodem = nodedf + column("nodecf") * t2
+        tempa = 1.0 - column("cc1") * t
+        tempe = column("bstar") * column("cc4") * t
+        templ = column("t2cof") * t2
+
+        delomg = column("omgcof") * t
+        delm = column("xmcof") * ((1.0 + column("eta") * np.cos(xmdf)) ** 3 - column("delmo"))
+        temp = np.where(column("isimp"), 0.0, delomg + delm)
+        mm = xmdf + temp
+        argpm = argpdf - temp
+        t3 = t2 * t
+        t4 = t3 * t
+        tempa = tempa - column("d2") * t2 - column("d3") * t3 - column("d4") * t4
+        tempe = tempe + np.where(column("isimp"), 0.0,
+                                 column("bstar") * column("cc5") * (np.sin(mm) - column("sinmao")))
+        templ = templ + column("t3cof") * t3 + t4 * (column("t4cof") + t * column("t5cof"))
+
+        nm = column("no_unkozai")
+        am = (XKE / nm) ** (2.0 / 3.0) * tempa * tempa
+        nm = XKE / am ** 1.5
+        em = column("ecco") - tempe
+        invalid = (em >= 1.0) | (em < -0.001) | (nm <= 0.0)
+        em = np.maximum(em, 1.0e-6)
+        mm = mm + column("no_unkozai") * templ
+        xlm = mm + argpm + nodem
+        nodem = np.fmod(nodem, TWO_PI)
+        argpm = argpm % TWO_PI
+        xlm = xlm % TWO_PI
+        mm = (xlm - argpm - nodem) % TWO_PI
+
+        # Long period periodics
+        sinip = np.sin(column("inclo"))
+        cosip = np.cos(column("inclo"))
+        axnl = em * np.cos(argpm)
+        temp = 1.0 / (am * (1.0 - em * em))
+        aynl = em * np.sin(argpm) + temp * column("aycof")
+        xl = mm + argpm + nodem + temp * column("xlcof") * axnl
+
+        # Solve Kepler's equation
+        u = (xl - nodem) % TWO_PI
+        eo1 = u
+        for _ in range(10):
+            sineo1 = np.sin(eo1)
+            coseo1 = np.cos(eo1)
+            tem5 = (u - aynl * coseo1 + axnl * sineo1 - eo1) / (1.0 - coseo1 * axnl - sineo1 * aynl)
+            tem5 = np.clip(tem5, -0.95, 0.95)
+            eo1 = eo1 + tem5
+            if np.all(np.abs(tem5[~np.isnan(tem5)]) < 1.0e-12):
+                break
+
+        # Short period periodics
+        ecose = axnl * coseo1 + aynl * sineo1
+        esine = axnl * sineo1 - aynl * coseo1
+        el2 = axnl * axnl + aynl * aynl
+        pl = am * (1.0 - el2)
+        invalid |= pl < 0.0
+        rl = am * (1.0 - ecose)
+        betal = np.sqrt(1.0 - el2)
+        temp = esine / (1.0 + betal)
+        sinu = am / rl * (sineo1 - aynl - axnl * temp)
+        cosu = am / rl * (coseo1 - axnl + aynl * temp)
+        su = np.arctan2(sinu, cosu)
+        sin2u = (cosu + cosu) * sinu
+        cos2u = 1.0 - 2.0 * sinu * sinu
+        temp = 1.0 / pl
+        temp1 = 0.5 * J2 * temp
+        temp2 = temp1 * temp
+
+        mrt = rl * (1.0 - 1.5 * temp2 * betal * column("con41")) + 0.5 * temp1 * column("x1mth2") * cos2u
+        su = su - 0.25 * temp2 * column("x7thm1") * sin2u
+        xnode = nodem + 1.5 * temp2 * cosip * sin2u
+        xinc = column("inclo") + 1.5 * temp2 * cosip * sinip * cos2u
+
+        # Orientation vectors
+        sinsu = np.sin(su)
+        cossu = np.cos(su)
+        snod = np.sin(xnode)
+        cnod = np.cos(xnode)
+        sini = np.sin(xinc)
+        cosi = np.cos(xinc)
+        xmx = -snod * cosi
+        xmy = cnod * cosi
+        ux = xmx * sinsu + cnod * cossu
+        uy = xmy * sinsu + snod * cossu
+        uz = sini * sinsu
+
+        # Satellite has decayed
+        invalid |= mrt < 1.0
+
+        positions = np.stack([ux, uy, uz], axis=-1) * (mrt * SGP4_EARTH_RADIUS)[..., np.newaxis]
+    positions[invalid] = np.nan
+
+    return positions
+
+
+def minutes_since_epoch(epoch, times):
+    """
+    :param epoch: Element set epochs, datetime64 array of shape (satellites,)
+    :param times: datetime64 array of shape (times,)
+    :return: Minutes since epoch, shape (satellites, times)
+    """
+    delta = np.asarray(times, dtype="datetime64[us]")[np.newaxis, :] - parse_epoch(epoch)[:, np.newaxis]
+    return delta / np.timedelta64(1, "m")
+
+
+def propagate(elements, times, record=None):
+    """
+    Propagates all satellites over the given times in one batch
+    :param elements: OMM elements, e.g. from SatelliteCatalog.elements
+    :param times: datetime64 array
+    :param record: Result of sgp4_init, if already available
+    :return: TEME positions in km, shape (satellites, times, 3)
+    """
+    if record is None:
+        record = sgp4_init(elements)
+    return sgp4_propagate(record, minutes_since_epoch(record["epoch"], times))
+
+
+def time_grid(start_time: str, stop_time: str, step_size) -> np.ndarray:
+    """
+    Sample times between two STK dates, like the steps of an STK report
+    :param start_time: STK date
+    :param stop_time: STK date
+    :param step_size: in seconds
+    :return: datetime64[us] array including start and stop time
+    """
+    start, stop = stk_dates.stk_dates_to_datetime64([start_time, stop_time]).astype("datetime64[us]")
+    step = np.timedelta64(int(round(step_size * 1e6)), "us")
+    times = np.arange(start, stop, step)
+    if times.size == 0 or times[-1] != stop:
+        times = np.append(times, stop)
+    return times
+
+
+def gmst(times) -> np.ndarray:
+    """
+    Greenwich mean sidereal time (IAU-82, as used with SGP4)
+    :param times: datetime64 array (UTC is used as UT1)
+    :return: angle in radians
+    """
+    jd = (np.asarray(times, dtype="datetime64[us]") - np.datetime64("2000-01-01T12:00:00")) / np.timedelta64(1, "D")
+    tut1 = jd / 36525.0
+    seconds = (-6.2e-6 * tut1 * tut1 * tut1 + 0.093104 * tut1 * tut1 +
+               (876600.0 * 3600 + 8640184.812866) * tut1 + 67310.54841)
+    return (np.radians(seconds / 240.0)) % TWO_PI
+
+
+def ecef_to_teme(vectors, times) -> np.ndarray:
+    """
+    Rotates earth fixed vectors into the TEME frame of SGP4 (polar motion is neglected)
+    :param vectors: shape (3,) or (times, 3)
+    :param times: datetime64 array
+    :return: shape (times, 3)
+    """
+    theta = gmst(times)
+    cos_theta = np.cos(theta)
+    sin_theta = np.sin(theta)
+    vectors = np.broadcast_to(vectors, (theta.size, 3))
+    return np.stack([cos_theta * vectors[:, 0] - sin_theta * vectors[:, 1],
+                     sin_theta * vectors[:, 0] + cos_theta * vectors[:, 1],
+                     vectors[:, 2]], axis=-1)
+
+
+def geodetic_to_ecef(latitude, longitude, altitude):
+    """
+    :param latitude: degrees
+    :param longitude: degrees
+    :param altitude: km above the WGS-84 ellipsoid
+    :return: earth fixed position and local east, north and up vectors, shape (3, 3)
+    """
+    latitude = np.radians(latitude)
+    longitude = np.radians(longitude)
+    n = WGS84_A / np.sqrt(1.0 - WGS84_E2 * np.sin(latitude) ** 2)
+    up = np.array([np.cos(latitude) * np.cos(longitude), np.cos(latitude) * np.sin(longitude), np.sin(latitude)])
+    east = np.array([-np.sin(longitude), np.cos(longitude), 0.0])
+    north = np.cross(up, east)
+    position = np.array([(n + altitude) * up[0], (n + altitude) * up[1], (n * (1.0 - WGS84_E2) + altitude) * up[2]])
+    return position, np.array([east, north, up])
+
+
+class GroundStation:
+    # Attribute names follow the STK objects, so reports can be written the same way for both interfaces
+    def __init__(self, name, latitude, longitude, altitude):
+        self.InstanceName = name
+        self.Path = f"Facility/{name}"
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+        self.ecef_position, self.ecef_frame = geodetic_to_ecef(latitude, longitude, altitude)
+
+    def positions(self, times):
+        return ecef_to_teme(self.ecef_position, times)
+
+    def up(self, times):
+        return ecef_to_teme(self.ecef_frame[2], times)
+
+    def frames(self, times):
+        """
+        :return: local east, north and up vectors in TEME, shape (times, 3, 3)
+        """
+        return np.stack([ecef_to_teme(vector, times) for vector in self.ecef_frame], axis=1)
+
+
+class PropagatedSatellite:
+    def __init__(self, name, ssc_number, elements):
+        self.InstanceName = name
+        self.Path = f"Satellite/{name}"
+        self.ssc_number = ssc_number
+        self.elements = elements
+        self.record = sgp4_init(elements)
+
+    def positions(self, times):
+        return propagate(self.elements, times, self.record)[0]
+
+
+class PropagationInterface:
+    """
+    Drop-in for the range calculations of STKInterface that runs SGP4 in-process on the CelesTrak elements.
+    There is no scenario, the attacker is a ground station and the victim is a satellite of the catalog.
+    """
+
+    def __init__(self, catalog, start_time, stop_time, attacker_position, victim_ssc_number,
+                 ephemeris_store=None, ground_constraints=NO_CONSTRAINTS, satellite_constraints=NO_CONSTRAINTS):
+        """
+        :param catalog: SatelliteCatalog (see sat_manager.get_satellite_catalog)
+        :param start_time: STK date
+        :param stop_time: STK date
+        :param attacker_position: (latitude, longitude, altitude) in degrees and km
+        :param victim_ssc_number: SSC number of the victim satellite
+        :param ephemeris_store: EphemerisStore to reuse positions of previous runs
+        :param ground_constraints: AccessConstraints of the links of the attacker ground station (elevation mask, ...)
+        :param satellite_constraints: AccessConstraints of the links between satellites
+        """
+        self.elements = catalog.elements(["OBJECT_NAME", "NORAD_CAT_ID", "EPOCH", "ELEMENT_SET_NO"] + ELEMENT_FIELDS)
+        self.ephemeris_store = ephemeris_store
+        self.ground_constraints = ground_constraints
+        self.satellite_constraints = satellite_constraints
+        self.record = sgp4_init(self.elements)
+        self.ssc_row_mapping = {number: row for row, number in enumerate(self.elements["NORAD_CAT_ID"])}
+
+        self.start_time = start_time
+        self.stop_time = stop_time
+
+        self.attacker_object = GroundStation("Attacker", *attacker_position)
+        victim_name = self.elements["OBJECT_NAME"][self.ssc_row_mapping.get(int(victim_ssc_number), 0)]
+        self.victim_object = self.create_satellite(f"Victim_{victim_name}_{victim_ssc_number}", victim_ssc_number)
+
+        self.added_satellites = []
+
+    def set_time_period(self, start_time, stop_time):
+        self.start_time = start_time
+        self.stop_time = stop_time
+
+    def get_elements(self, rows):
+        return {field: values[rows] for field, values in self.elements.items()}
+
+    def create_satellite(self, satellite_name: str, ssc_number: str) -> PropagatedSatellite:
+        row = self.ssc_row_mapping.get(int(ssc_number))
+        if row is None:
+            print(f"Satellite {ssc_number} not found in catalog!")
+            exit(1)
+
+        return PropagatedSatellite(satellite_name, ssc_number, self.get_elements([row]))
+
+    def add_satellite(self, satellite_name: str, ssc_number: str) -> PropagatedSatellite:
+        satellite = self.create_satellite(satellite_name, ssc_number)
+        self.added_satellites.append(satellite)
+
+        return satellite
+
+    def remove_satellite(self, satellite: PropagatedSatellite) -> None:
+        if satellite in self.added_satellites:
+            self.added_satellites.remove(satellite)
+
+    def cleanup_scenario(self):
+        self.added_satellites = []
+
+    def get_range_series(self, object1, object2, times):
+        """
+        :return: Range in km between both objects at each time, NaN if they can not see each other
+        """
+        # Ranges are symmetric, keep a ground station on the target side
+        if isinstance(object2, GroundStation):
+            object1, object2 = object2, object1
+        return self.get_ranges_to_positions(object1, object2.positions(times)[np.newaxis], times)[0]
+
+    def time_offsets(self, times) -> np.ndarray:
+        """
+        :param times: STK dates
+        :return: whole seconds since scenario start
+        """
+        return stk_dates.stk_dates_to_offsets(times, self.start_time)
+
+    def offsets_to_stk_dates(self, offsets) -> np.ndarray:
+        return stk_dates.offsets_to_stk_dates(offsets, self.start_time)
+
+    def offsets_to_times(self, offsets) -> np.ndarray:
+        return stk_dates.offsets_to_datetime64(offsets, self.start_time)
+
+    def get_aer_report_data(self, object1, object2, step_size=10) -> dict[str, float]:
+        """
+        Same output as STKInterface.get_aer_report_data
+        :param object1: Ground station or satellite
+        :param object2: Ground station or satellite
+        :param step_size: in seconds
+        :return: mapping from time to range in km, only for times with line of sight
+        """
+        offsets, ranges = self.get_range_data(object1, object2, step_size)
+        return dict(zip(self.offsets_to_stk_dates(offsets).tolist(), ranges.tolist()))
+
+    def get_range_data(self, object1, object2, step_size=10, block_size=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Same output as STKInterface.get_range_data
+        :param block_size: Time steps computed at once, all if None. Bounds the memory for long time windows
+        :return: times in seconds since scenario start (int64) and ranges in km, only for times with line of sight
+        """
+        times = time_grid(self.start_time, self.stop_time, step_size)
+        block_size = block_size or len(times)
+
+        offsets = []
+        ranges = []
+        for block_start in range(0, len(times), block_size):
+            block_times = times[block_start:block_start + block_size]
+            block_offsets, block_ranges = access_range_data((block_times - times[0]) / np.timedelta64(1, "s"),
+                                                            self.get_range_series(object1, object2, block_times))
+            offsets.append(block_offsets)
+            ranges.append(block_ranges)
+        return np.concatenate(offsets), np.concatenate(ranges)
+
+    def get_catalog_ranges(self, target_object, times, rows=None):
+        """
+        Ranges from a ground station or satellite to all (selected) satellites of the catalog in one batch
+        :param target_object: Ground station or satellite
+        :param times: datetime64 array
+        :param rows: Catalog rows to use, all if None
+        :return: ranges in km, shape (satellites, times), NaN without line of sight
+        """
+        return self.get_ranges_to_positions(target_object, self.propagate_catalog(times, rows), times)
+
+    def propagate_catalog(self, times, rows=None, dtype=np.float64):
+        """
+        :param times: datetime64 array
+        :param rows: Catalog rows to use, all if None
+        :param dtype: Precision of the returned positions. SGP4 itself always runs in float64, for other dtypes in
+                      chunks of PROPAGATION_CHUNK_SAMPLES that are cast into the result, so the peak memory is the
+                      dtype positions plus one float64 chunk
+        :return: TEME positions in km, shape (satellites, times, 3)
+        """
+        # Read from the ephemeris store if the times are on its time grid
+        if self.ephemeris_store is not None:
+            time_indices = self.ephemeris_store.time_indices(times)
+            if time_indices is not None:
+                elements = self.elements if rows is None else self.get_elements(rows)
+                return self.ephemeris_store.get_positions(elements, time_indices).astype(dtype, copy=False)
+
+        record = self.record if rows is None else {name: values[rows] for name, values in self.record.items()}
+        if np.dtype(dtype) == np.float64:
+            return sgp4_propagate(record, minutes_since_epoch(record["epoch"], times))
+
+        number_of_satellites = len(record["epoch"])
+        positions = np.empty((number_of_satellites, len(times), 3), dtype=dtype)
+        chunk_size = max(PROPAGATION_CHUNK_SAMPLES // max(len(times), 1), 1)
+        for chunk_start in range(0, number_of_satellites, chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            chunk_record = {name: values[chunk] for name, values in record.items()}
+            positions[chunk] = sgp4_propagate(chunk_record, minutes_since_epoch(chunk_record["epoch"], times))
+        return positions
+
+    def get_ranges_to_positions(self, target_object, catalog_positions, times):
+        """
+        :param target_object: Ground station or satellite
+        :param catalog_positions: Result of propagate_catalog
+        :param times: datetime64 array used for the positions
+        :return: ranges in km, shape (satellites, times), NaN without line of sight
+        """
+        target_positions = target_object.positions(times)[np.newaxis, :, :]
+        if isinstance(target_object, GroundStation):
+            return ground_access_ranges(target_positions, target_object.frames(times)[np.newaxis], catalog_positions,
+                                        self.ground_constraints)
+        return satellite_access_ranges(target_positions, catalog_positions, self.satellite_constraints)
+
+    def get_defender_ranges(self, catalog_positions, times):
+        """
+        Attacker and victim links of the whole (propagated) catalog at once
+        :param catalog_positions: Result of propagate_catalog
+        :param times: datetime64 array used for the positions
+        :return: AtoD and DtoV in km, shape (satellites, times), NaN without access
+        """
+        return (self.get_ranges_to_positions(self.attacker_object, catalog_positions, times),
+                self.get_ranges_to_positions(self.victim_object, catalog_positions, times))
@@ -0,0 +1,226 @@
+import json
+import os.path
+from datetime import datetime
+
+import numpy as np
+
+from access import AccessConstraints, ground_access_ranges, satellite_access_ranges
+from decision_window_calc import decisionDelayBatch
+from ephemeris_store import EphemerisStore
+from experiment2 import CELESTRAK_FILE, TAIL_TIME, TIME_STEP_SIZE, TIME_WINDOW_END, TIME_WINDOW_START
+from instrumentation import PhaseTimer, ProgressPrinter, print_phases
+from propagation import GroundStation, PropagationInterface, time_grid
+from sat_manager import build_constellation_index, get_orbit_radii, get_satellite_catalog, prefilter_orbital_shells
+from spatial_index import DefenderIndex, range_budget
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Attackers, the first one is the ground station of Experiment 1 and 2. The others are public ground station sites.
+GROUND_STATIONS = [
+    ("Attacker", 32.790241, -117.252447, -0.032479),  # name, latitude, longitude in degrees, altitude in km
+    ("Svalbard", 78.229772, 15.407786, 0.5),
+    ("Wallops", 37.924900, -75.476600, 0.0),
+    ("Kiruna", 67.883300, 21.066700, 0.34),
+    ("Hartebeesthoek", -25.887200, 27.707800, 1.5)
+]
+
+# SSC numbers of the victims, OPS-SAT of Experiment 1 and 2 first
+VICTIM_SSC_NUMBERS = ["44878", "25544", "33591", "27424"]
+
+
+def load_ground_stations(ground_stations_file):
+    """
+    :param ground_stations_file: JSON list of {"name", "latitude", "longitude", "altitude"} (degrees and km)
+    :return: list of (name, latitude, longitude, altitude)
+    """
+    with open(ground_stations_file, "r") as f:
+        return [(station["name"], station["latitude"], station["longitude"], station["altitude"])
+                for station in json.load(f)]
+
+
+def pair_coverage(index, positions, station_positions, station_frames, victim_positions, AtoV, budget, tail_time,
+                  excluded_rows, ground_constraints, satellite_constraints):
+    """
+    Defended time slots of one attacker/victim pair
+    :param index: DefenderIndex over positions, shared by all pairs
+    :param positions: Defender positions in km, shape (satellites, times, 3)
+    :param station_positions: shape (times, 3)
+    :param station_frames: Local east, north and up vectors of the ground station, shape (times, 3, 3)
+    :param victim_positions: shape (times, 3)
+    :param AtoV: Range in km, shape (times,), NaN if the attacker can't see the victim
+    :param excluded_rows: Rows that can't defend, e.g. the victim itself
+    :param ground_constraints: AccessConstraints of the ground station links
+    :param satellite_constraints: AccessConstraints of the defender to victim links
+    :return: number of defenders at each time slot and the rows of all defenders
+    """
+    # NaN positions are skipped by the index, so only the time slots in which the attacker sees the victim are queried
+    rows, time_indices = index.feasible_pairs(station_positions, np.where(np.isnan(AtoV)[:, np.newaxis], np.nan,
+                                                                          victim_positions), budget)
+    keep = ~np.isin(rows, excluded_rows)
+    rows, time_indices = rows[keep], time_indices[keep]
+
+    pair_positions = positions[rows, time_indices]
+    AtoD = ground_access_ranges(station_positions[time_indices], station_frames[time_indices], pair_positions,
+                                ground_constraints)
+    DtoV = satellite_access_ranges(victim_positions[time_indices], pair_positions, satellite_constraints)
+
+    _, can_defend = decisionDelayBatch(AtoD * 1000, DtoV * 1000, AtoV[time_indices] * 1000, tail_time)
+    defenders = np.bincount(time_indices[can_defend], minlength=len(AtoV))
+    return defenders, np.unique(rows[can_defend])
+
+
+def protection_matrix(ground_stations=GROUND_STATIONS, victim_ssc_numbers=VICTIM_SSC_NUMBERS, constellation=None,
+                      time_window_start=TIME_WINDOW_START, time_window_end=TIME_WINDOW_END,
+                      time_step_size=TIME_STEP_SIZE, tail_time=TAIL_TIME, min_elevation=0.0, elevation_mask=None,
+                      max_range=None, ephemeris_dir=None, celestrak_file=CELESTRAK_FILE):
+    """
+    Experiment 2 for every combination of attacker ground station and victim. The catalog is propagated once and the
+    k-d trees of DefenderIndex are built once per time slot, every pair only queries them for the satellites inside
+    its feasibility ellipsoid. So the cost grows with catalog x time, the pairs only add the cheap queries. Time slots
+    in which no attacker sees any victim are not propagated at all.
+    Report in results/report_Matrix.json, the coverage of every pair and time slot in results/coverage_Matrix.npz.
+    :param ground_stations: list of (name, latitude, longitude, altitude) in degrees and km, see load_ground_stations
+    :param victim_ssc_numbers: SSC numbers of the victims, they have to be in the catalog
+    :param constellation: Name of a constellation (see build_constellation_index) to take the defenders from, the
+                          whole catalog if None
+    :param min_elevation: Elevation mask of all ground stations in degrees
+    :param elevation_mask: Azimuth dependent elevation mask of all ground stations, see AccessConstraints
+    :param max_range: Maximum range in km of all links, unlimited if None
+    :param ephemeris_dir: see many_to_one_experiment
+    """
+    experiment_start = datetime.now()
+    timer = PhaseTimer()
+
+    with timer.phase("catalog load"):
+        catalog = get_satellite_catalog(celestrak_file)
+        for victim_ssc_number in victim_ssc_numbers:
+            if catalog.row_by_ssc_number(victim_ssc_number) is None:
+                print(f"Victim {victim_ssc_number} not found in catalog!")
+                exit(1)
+
+        # The shell of the highest victim and ground station bounds the defenders of all pairs
+        highest_victim = max(victim_ssc_numbers, key=lambda ssc_number: get_orbit_radii(
+            catalog.records[catalog.row_by_ssc_number(ssc_number)])[1])
+        catalog = prefilter_orbital_shells(catalog, highest_victim, tail_time,
+                                           attacker_altitude=max(station[3] for station in ground_stations))
+
+    with timer.phase("backend setup"):
+        ephemeris_store = None
+        if ephemeris_dir is not None:
+            ephemeris_store = EphemerisStore(ephemeris_dir, time_window_start, time_window_end, time_step_size)
+        ground_constraints = AccessConstraints(min_elevation, elevation_mask, max_range)
+        satellite_constraints = AccessConstraints(max_range=max_range)
+        propagation_interface = PropagationInterface(catalog, time_window_start, time_window_end,
+                                                     ground_stations[0][1:], victim_ssc_numbers[0], ephemeris_store,
+                                                     ground_constraints, satellite_constraints)
+
+    times = time_grid(time_window_start, time_window_end, time_step_size)
+    rows = np.arange(len(catalog))
+    if constellation is not None:
+        rows = build_constellation_index(catalog, [constellation])[constellation]
+
+    victim_rows = np.array([catalog.row_by_ssc_number(ssc_number) for ssc_number in victim_ssc_numbers])
+    print("Starting experiment...")
+    with timer.phase("range calculation"):
+        victim_positions = propagation_interface.propagate_catalog(times, victim_rows)
+        stations = [GroundStation(*station) for station in ground_stations]
+        station_positions = np.array([station.positions(times) for station in stations])
+        station_frames = np.array([station.frames(times) for station in stations])
+
+        # Shape (stations, victims, times), the victim has to be above the elevation mask of the attacker
+        AtoV = ground_access_ranges(station_positions[:, np.newaxis], station_frames[:, np.newaxis],
+                                    victim_positions[np.newaxis], ground_constraints)
+    visible = ~np.isnan(AtoV)
+
+    # The catalog is only needed while at least one attacker sees one of the victims
+    active_times = np.nonzero(visible.any(axis=(0, 1)))[0]
+    with timer.phase("propagate"):
+        positions = propagation_interface.propagate_catalog(times[active_times], rows)
+
+    index = DefenderIndex(positions)
+    budget = range_budget(tail_time)
+
+    defenders = np.zeros(AtoV.shape, dtype=np.int64)
+    report = {}
+    progress_printer = ProgressPrinter()
+    for station_index, station in enumerate(stations):
+        report[station.InstanceName] = {}
+        for victim_index, victim_row in enumerate(victim_rows):
+            progress_printer.print(f"Attacker {station.InstanceName} | Victim "
+                                   f"{catalog['OBJECT_NAME'][victim_row]}")
+            # Index into positions, only the victim of the pair can't protect itself, the other victims can
+            excluded_rows = np.nonzero(rows == victim_row)[0]
+            with timer.phase("decision evaluation"):
+                defenders[station_index, victim_index, active_times], defender_rows = pair_coverage(
+                    index, positions, station_positions[station_index, active_times],
+                    station_frames[station_index, active_times], victim_positions[victim_index, active_times],
+                    AtoV[station_index, victim_index, active_times], budget, tail_time, excluded_rows,
+                    ground_constraints, satellite_constraints)
+            timer.count("pairs")
+
+            number_of_visible_times = int(np.sum(visible[station_index, victim_index]))
+            number_of_defended_times = int(np.sum(defenders[station_index, victim_index] > 0))
+            report[station.InstanceName][str(catalog["OBJECT_NAME"][victim_row])] = {
+                "ssc number": victim_ssc_numbers[victim_index],
+                "visible times": number_of_visible_times,
+                "defended times": number_of_defended_times,
+                "not defended times": number_of_visible_times - number_of_defended_times,
+                "defend percentage": (number_of_defended_times / number_of_visible_times) * 100
+                if number_of_visible_times else None,
+                "defenders": len(defender_rows)
+            }
+
+    setup = {
+        "Attackers": [list(station) for station in ground_stations],
+        "Victims": list(victim_ssc_numbers),
+        "Constellation": constellation,
+        "Start time": time_window_start,
+        "End time": time_window_end,
+        "Tail time": tail_time,
+        "Min elevation": min_elevation,
+        "Elevation mask": elevation_mask,
+        "Max range": max_range,
+        "Time step size": time_step_size,
+        "Number of observations": len(times),
+        "Backend": "sgp4",
+        "Satellites after prefilter": len(catalog),
+        "Defender candidates": len(rows)
+    }
+
+    experiment_end = datetime.now()
+    print(f"Start: {experiment_start}")
+    print(f"End: {experiment_end}")
+    print(f"Runtime: {experiment_end - experiment_start}")
+
+    results_dir = os.path.join(BASE_DIR, "results")
+    if not os.path.isdir(results_dir):
+        os.mkdir(results_dir)
+
+    output = {
+        "setup": setup,
+        "runtime": {
+            "start": str(experiment_start),
+            "end": str(experiment_end),
+            "runtime": str(experiment_end - experiment_start),
+            **timer.to_dict()
+        },
+        "report": report
+    }
+    with open(os.path.join(results_dir, "report_Matrix.json"), "w") as outfile:
+        json.dump(output, outfile, indent=1)
+
+    # Defenders per pair and time slot, 0 where the slot is not defended or the attacker can't see the victim
+    np.savez_compressed(os.path.join(results_dir, "coverage_Matrix.npz"), visible=visible, defenders=defenders,
+                        times=times.astype("datetime64[s]").astype(np.int64))
+
+    for station_name, victims in report.items():
+        print(f"{station_name}: " + " | ".join(
+            f"{victim_name} {'-' if value['defend percentage'] is None else round(value['defend percentage'], 1)}%"
+            for victim_name, value in victims.items()))
+    print_phases(timer)
+
+    return report
+
+
+if __name__ == "__main__":
+    protection_matrix()
@@ -0,0 +1,75 @@
+import json
+import os
+
+
+class ResultsJournal:
+    """
+    Append-only JSONL file with one line per finished unit of work (e.g. one satellite).
+    Every line is flushed and fsync'd before the experiment continues, so after a crash or STK hiccup the run can be
+    restarted and skips everything that is already in the journal. The first line holds the setup of the run, a
+    journal of a different setup is never resumed.
+    """
+
+    def __init__(self, journal_file, setup, resume=True):
+        """
+        :param journal_file: Path of the .jsonl file
+        :param setup: JSON serializable setup of the run
+        :param resume: Continue an existing journal, otherwise it is overwritten
+        """
+        self.journal_file = journal_file
+        self.setup = json.loads(json.dumps(setup))  # same types as read back from the file
+        self.entries = []
+
+        if resume and os.path.isfile(journal_file):
+            self.entries = self.read()
+            print(f"Resuming from journal {journal_file} with {len(self.entries)} finished entries")
+        else:
+            with open(journal_file, "w") as f:
+                f.write(json.dumps({"setup": self.setup}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.file = open(journal_file, "a")
+
+    def __del__(self):
+        self.close()
+
+    def read(self):
+        with open(self.journal_file, "r") as f:
+            lines = f.read().splitlines()
+
+        header = json.loads(lines[0]) if lines else {}
+        if header.get("setup") != self.setup:
+            print(f"Journal {self.journal_file} belongs to a different setup! Delete it or run with resume=False.")
+            exit(1)
+
+        entries = []
+        for line in lines[1:]:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Only the line being written during a crash can be incomplete
+                break
+
+        # Drop the incomplete line, so the next append starts on a new line
+        with open(self.journal_file, "w") as f:
+            f.write("\n".join([lines[0]] + [json.dumps(entry) for entry in entries]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        return entries
+
+    def append(self, entry):
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.entries.append(entry)
+
+    def close(self):
+        if getattr(self, "file", None) is not None and not self.file.closed:
+            self.file.close()
+
+    def remove(self):
+        # Called once the final report is written
+        self.close()
+        os.remove(self.journal_file)
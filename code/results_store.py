@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+
+from ephemeris_store import element_set_keys
+
+
+def catalog_keys(catalog):
+    """
+    :param catalog: SatelliteCatalog
+    :return: element set key of every row, see element_set_keys
+    """
+    return element_set_keys(catalog.elements(["NORAD_CAT_ID", "EPOCH", "ELEMENT_SET_NO"]))
+
+
+class ResultsStore:
+    """
+    Content-addressed results of single satellites. Each result is stored under the element set of the satellite
+    (NORAD_CAT_ID, EPOCH and ELEMENT_SET_NO, see element_set_keys) in a directory per set of experiment parameters.
+    After a catalog refresh only new or changed element sets are evaluated, the report is rebuilt from the stored
+    results. results.jsonl is append-only and every batch of results is fsync'd, like the journal.
+    """
+
+    def __init__(self, store_dir, parameters):
+        """
+        :param store_dir: Directory for all stores, a sub directory is created per parameter set
+        :param parameters: JSON serializable parameters the results depend on (victim element set, times, tail
+                           time, backend, ...)
+        """
+        self.parameters = json.loads(json.dumps(parameters))  # same types as read back from the file
+        digest = hashlib.sha256(json.dumps(self.parameters, sort_keys=True).encode()).hexdigest()[:16]
+        self.path = os.path.join(store_dir, digest)
+        os.makedirs(self.path, exist_ok=True)
+
+        parameters_file = os.path.join(self.path, "parameters.json")
+        if not os.path.isfile(parameters_file):
+            with open(parameters_file, "w") as f:
+                json.dump(self.parameters, f, indent=1)
+
+        self.results_file = os.path.join(self.path, "results.jsonl")
+        self.results = {}
+        if os.path.isfile(self.results_file):
+            self.results = self.read()
+            print(f"Results store {self.path} holds {len(self.results)} satellites")
+
+        self.hits = 0
+        self.misses = 0
+        self.file = open(self.results_file, "a")
+
+    def __del__(self):
+        self.close()
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def read(self):
+        with open(self.results_file, "r") as f:
+            lines = f.read().splitlines()
+
+        results = {}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the line being written during a crash can be incomplete
+                break
+            results[entry["key"]] = entry["result"]
+
+        # Drop the incomplete line, so the next append starts on a new line
+        if len(results) < len(lines):
+            with open(self.results_file, "w") as f:
+                f.writelines(json.dumps({"key": key, "result": result}) + "\n" for key, result in results.items())
+                f.flush()
+                os.fsync(f.fileno())
+
+        return results
+
+    def split(self, keys):
+        """
+        :param keys: Element set keys of the satellites to evaluate
+        :return: indices of the keys without a stored result
+        """
+        missing = [index for index, key in enumerate(keys) if key not in self.results]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return missing
+
+    def get(self, key, default=None):
+        return self.results.get(key, default)
+
+    def put(self, key, result):
+        self.put_many({key: result})
+
+    def put_many(self, results):
+        """
+        :param results: mapping from element set key to the JSON serializable result of the satellite
+        """
+        results = json.loads(json.dumps(results))
+        self.file.writelines(json.dumps({"key": key, "result": result}) + "\n" for key, result in results.items())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.results.update(results)
+
+    def close(self):
+        if getattr(self, "file", None) is not None and not self.file.closed:
+            self.file.close()
@@ -1,11 +1,43 @@
+import math
 import os.path
 import json
+import re
+
+import numpy as np
+
+from satellite_catalog import SatelliteCatalog
+
+EARTH_RADIUS = 6378.137  # km
+EARTH_MU = 398600.4418  # km^3/s^2
+SPEED_OF_LIGHT = 299792.458  # km/s
+
+# Name patterns (case insensitive regular expressions) of the constellation members. Not every operator puts the
+# constellation name into the object names, e.g. Planet calls its satellites FLOCK and SKYSAT
+CONSTELLATION_PATTERNS = {
+    "starlink": [r"starlink"],
+    "oneweb": [r"oneweb"],
+    "iridium": [r"iridium"],
+    "globalstar": [r"globalstar"],
+    "orbcomm": [r"orbcomm"],
+    "kepler": [r"kepler"],
+    "jilin": [r"jilin"],
+    "beidou": [r"beidou"],
+    "yaogan": [r"yaogan"],
+    "planet": [r"^flock", r"^skysat", r"^dove"],
+    "spire": [r"^lemur"],
+}
+
+# Launches (international designator without piece) whose objects all belong to a constellation, for members that
+# can't be recognized by their name. Empty by default: in the shipped celestrak.json every Starlink object is named
+# STARLINK-*, and the launches that carry Starlink satellites together with other payloads (e.g. "2020-038" with
+# SKYSAT-C14 to C16) must not be added, since all of their objects would be selected. Add launch groups here or pass
+# them to build_constellation_index when using a catalog with unnamed pieces, e.g.
+#   build_constellation_index(catalog, ["starlink"], launches={"starlink": ["2019-074", "2020-001"]})
+CONSTELLATION_LAUNCHES = {}
 
 
 # Get database from https://www.celestrak.org/NORAD/elements/ -> JSON -> "Active Satellites"
 def get_celestrak_data(celestrak_file):
-    scc_number_mapping = {}
-
     if not os.path.isfile(celestrak_file):
         print(f"File not found: {celestrak_file}")
         exit(1)
@@ -17,13 +49,90 @@ def get_celestrak_data(celestrak_file):
 
     return celestrak_data
 
+def get_satellite_catalog(celestrak_file) -> SatelliteCatalog:
+    if not os.path.isfile(celestrak_file):
+        print(f"File not found: {celestrak_file}")
+        exit(1)
+
+    return SatelliteCatalog.load(celestrak_file)
+
 def get_ssc_mapping_from_file(database_file):
-    scc_number_mapping = {}
-    satellite_data = get_celestrak_data(database_file)
-    for satellite_values in satellite_data:
-        # Change format to be valid for STK
-        ssc_number = str(satellite_values["NORAD_CAT_ID"])
-        scc_number_padded = "0"*(5-len(ssc_number)) + ssc_number
-        scc_number_mapping[satellite_values["OBJECT_NAME"]] = scc_number_padded
-
-    return scc_number_mapping
\ No newline at end of file
+    return get_satellite_catalog(database_file).get_ssc_mapping()
+
+def build_constellation_index(catalog, constellation_names=None, patterns=None, launches=None):
+    """
+    Finds the members of each constellation once, so selecting a constellation is a dict lookup
+    :param catalog: SatelliteCatalog
+    :param constellation_names: Constellations to index, all of patterns and launches if None. Names without pattern
+                                are matched as substring of the object name
+    :param patterns: Name patterns per constellation, defaults to CONSTELLATION_PATTERNS
+    :param launches: Launches per constellation, defaults to CONSTELLATION_LAUNCHES, e.g. {"starlink": ["2019-074"]}
+                     to also select the unnamed objects of that launch
+    :return: mapping from constellation name to sorted catalog rows
+    """
+    if patterns is None:
+        patterns = CONSTELLATION_PATTERNS
+    if launches is None:
+        launches = CONSTELLATION_LAUNCHES
+    if constellation_names is None:
+        constellation_names = list(dict.fromkeys(list(patterns.keys()) + list(launches.keys())))
+
+    object_names = catalog["OBJECT_NAME"].tolist()
+    # International designator without the piece letters, e.g. "2019-074" for "2019-074B"
+    launch_ids = catalog["OBJECT_ID"].astype("U8")
+
+    constellation_index = {}
+    for constellation_name in constellation_names:
+        name_patterns = patterns.get(constellation_name, [re.escape(constellation_name)])
+        name_regex = re.compile("|".join(name_patterns), re.IGNORECASE)
+        members = np.array([name_regex.search(name) is not None for name in object_names], dtype=bool)
+
+        members |= np.isin(launch_ids, launches.get(constellation_name, []))
+        constellation_index[constellation_name] = np.nonzero(members)[0]
+
+    return constellation_index
+
+def get_orbit_radii(satellite_values):
+    """
+    :param satellite_values: OMM record of one satellite or SatelliteCatalog
+    :return: perigee and apogee distance from earth center in km
+    """
+    mean_motion = satellite_values["MEAN_MOTION"] * 2 * math.pi / 86400  # rad/s
+    semi_major_axis = (EARTH_MU / mean_motion ** 2) ** (1 / 3)
+    eccentricity = satellite_values["ECCENTRICITY"]
+    return semi_major_axis * (1 - eccentricity), semi_major_axis * (1 + eccentricity)
+
+def prefilter_orbital_shells(catalog, victim_ssc_number, tail_time, attacker_altitude=0.0,
+                             max_attacker_victim_range=None):
+    """
+    Removes satellites whose orbit never gets low enough to defend the victim.
+    Feasible defenders lie inside the ellipsoid AtoD + DtoV < AtoV + c * tail_time, which is enclosed by the sphere
+    around the midpoint of attacker and victim with radius (AtoV + c * tail_time) / 2. So no defender is further than
+    (|A| + |V| + AtoV + c * tail_time) / 2 from the earth center.
+    :param catalog: SatelliteCatalog
+    :param victim_ssc_number: SSC number of the victim
+    :param tail_time: in seconds
+    :param attacker_altitude: Altitude of the attacker ground station in km
+    :param max_attacker_victim_range: Upper bound of AtoV in km, defaults to the distance to the horizon
+    :return: catalog without the satellites that can't defend
+    """
+    victim_row = catalog.row_by_ssc_number(victim_ssc_number)
+    if victim_row is None:
+        print(f"Victim {victim_ssc_number} not found in catalog!")
+        exit(1)
+
+    attacker_radius = EARTH_RADIUS + attacker_altitude
+    _, victim_apogee = get_orbit_radii(catalog.records[victim_row])
+    if max_attacker_victim_range is None:
+        # Attacker sees the victim at most until the horizon
+        max_attacker_victim_range = math.sqrt(victim_apogee ** 2 - attacker_radius ** 2)
+
+    max_defender_radius = (attacker_radius + victim_apogee + max_attacker_victim_range +
+                           SPEED_OF_LIGHT * tail_time) / 2
+
+    perigee_radii, _ = get_orbit_radii(catalog)
+    filtered_catalog = catalog.subset(np.nonzero(perigee_radii < max_defender_radius)[0])
+    print(f"Orbital shell prefilter eliminated {len(catalog) - len(filtered_catalog)} of {len(catalog)} "
+          f"satellites (perigee above {round(max_defender_radius - EARTH_RADIUS)}km altitude)")
+
+    return filtered_catalog
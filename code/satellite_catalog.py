@@ -0,0 +1,121 @@
+import json
+import os.path
+
+import numpy as np
+
+# OMM fields of the CelesTrak JSON and their column types
+CATALOG_FIELDS = {
+    "OBJECT_NAME": str,
+    "OBJECT_ID": str,
+    "EPOCH": "datetime64[us]",
+    "MEAN_MOTION": np.float64,
+    "ECCENTRICITY": np.float64,
+    "INCLINATION": np.float64,
+    "RA_OF_ASC_NODE": np.float64,
+    "ARG_OF_PERICENTER": np.float64,
+    "MEAN_ANOMALY": np.float64,
+    "EPHEMERIS_TYPE": np.int64,
+    "CLASSIFICATION_TYPE": str,
+    "NORAD_CAT_ID": np.int64,
+    "ELEMENT_SET_NO": np.int64,
+    "REV_AT_EPOCH": np.int64,
+    "BSTAR": np.float64,
+    "MEAN_MOTION_DOT": np.float64,
+    "MEAN_MOTION_DDOT": np.float64,
+}
+
+
+def sidecar_file(celestrak_file):
+    return os.path.splitext(celestrak_file)[0] + ".npy"
+
+
+class SatelliteCatalog:
+    """
+    CelesTrak OMM records as one NumPy structured array, one row per satellite and one column per OMM field.
+    Columns are indexed by their OMM name, e.g. catalog["MEAN_MOTION"], rows are found by name or SSC number with
+    a dict lookup. load() keeps a binary copy of the JSON next to it, later runs read that copy without parsing JSON.
+    """
+
+    def __init__(self, records):
+        """
+        :param records: Structured array with the fields of CATALOG_FIELDS
+        """
+        self.records = records
+        self.name_rows = {name: row for row, name in enumerate(records["OBJECT_NAME"].tolist())}
+        self.ssc_rows = {number: row for row, number in enumerate(records["NORAD_CAT_ID"].tolist())}
+
+    @classmethod
+    def from_celestrak_data(cls, satellite_data):
+        """
+        :param satellite_data: Parsed CelesTrak JSON (see sat_manager.get_celestrak_data)
+        """
+        columns = {field: np.array([satellite[field] for satellite in satellite_data], dtype=dtype)
+                   for field, dtype in CATALOG_FIELDS.items()}
+
+        records = np.empty(len(satellite_data), dtype=[(field, column.dtype) for field, column in columns.items()])
+        for field, column in columns.items():
+            records[field] = column
+
+        return cls(records)
+
+    @classmethod
+    def load(cls, celestrak_file, use_sidecar=True):
+        """
+        :param celestrak_file: CelesTrak JSON
+        :param use_sidecar: Read and write the binary copy (celestrak.npy for celestrak.json)
+        :return: SatelliteCatalog
+        """
+        sidecar = sidecar_file(celestrak_file)
+        if use_sidecar and os.path.isfile(sidecar) and \
+                os.path.getmtime(sidecar) >= os.path.getmtime(celestrak_file):
+            return cls(np.load(sidecar, allow_pickle=False))
+
+        with open(celestrak_file, "r") as f:
+            catalog = cls.from_celestrak_data(json.load(f))
+
+        if use_sidecar:
+            catalog.save(sidecar)
+
+        return catalog
+
+    def save(self, file):
+        # Replace atomically, an interrupted write must not leave a broken sidecar behind
+        temporary_file = file + ".tmp"
+        with open(temporary_file, "wb") as f:
+            np.save(f, self.records, allow_pickle=False)
+        os.replace(temporary_file, file)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, field):
+        return self.records[field]
+
+    def row_by_name(self, satellite_name):
+        return self.name_rows.get(satellite_name)
+
+    def row_by_ssc_number(self, ssc_number):
+        return self.ssc_rows.get(int(ssc_number))
+
+    def ssc_numbers(self) -> np.ndarray:
+        # Padded to 5 digits to be valid for STK
+        return np.char.zfill(self.records["NORAD_CAT_ID"].astype(str), 5)
+
+    def get_ssc_mapping(self) -> dict[str, str]:
+        return dict(zip(self.records["OBJECT_NAME"].tolist(), self.ssc_numbers().tolist()))
+
+    def subset(self, rows):
+        """
+        :param rows: Row indices or boolean mask
+        :return: SatelliteCatalog with only these rows
+        """
+        return SatelliteCatalog(self.records[rows])
+
+    def elements(self, fields=None) -> dict[str, np.ndarray]:
+        """
+        :param fields: OMM fields to include, all if None
+        :return: mapping from OMM field name to a contiguous array over all satellites
+        """
+        if fields is None:
+            fields = self.records.dtype.names
+        return {field: np.ascontiguousarray(self.records[field]) for field in fields}
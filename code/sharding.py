@@ -0,0 +1,62 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import RawArray
+
+import numpy as np
+
+from propagation import PropagationInterface
+from satellite_catalog import SatelliteCatalog
+
+# State of each worker process, set up once by init_worker
+worker_interface = None
+worker_coverage = None
+
+
+def init_worker(catalog_records, start_time, stop_time, attacker_position, victim_ssc_number, coverage):
+    global worker_interface, worker_coverage
+    worker_interface = PropagationInterface(SatelliteCatalog(catalog_records), start_time, stop_time,
+                                            attacker_position, victim_ssc_number)
+    worker_coverage = None if coverage is None else np.frombuffer(coverage, dtype=np.bool_)
+
+
+def get_worker_interface() -> PropagationInterface:
+    return worker_interface
+
+
+def get_worker_coverage() -> np.ndarray:
+    """
+    :return: Coverage bitmap shared by all workers, True for every time slot that already has a defender
+    """
+    return worker_coverage
+
+
+def run_sharded(shard_function, rows, propagation_interface, catalog, workers=None, coverage_size=None, args=(),
+                shards_per_worker=4):
+    """
+    Splits the catalog rows into shards and evaluates them in a process pool. Each worker builds its own
+    PropagationInterface once, only the rows of a shard are sent with each task.
+    :param shard_function: Module level function called as shard_function(shard_rows, *args) in the workers
+    :param rows: Catalog rows to evaluate
+    :param propagation_interface: Interface of the main process, its setup is copied to the workers
+    :param catalog: SatelliteCatalog the interface was built from
+    :param workers: Number of processes, all cores if None
+    :param coverage_size: If set, the workers share a coverage bitmap of this many time slots (see get_worker_coverage)
+    :param args: Further arguments of shard_function
+    :param shards_per_worker: More shards than workers keep all workers busy until the end
+    :return: results of all shards in the order of the rows and the final coverage bitmap
+    """
+    if workers is None:
+        workers = os.cpu_count()
+
+    coverage = RawArray("b", coverage_size) if coverage_size else None
+    shards = [shard for shard in np.array_split(rows, workers * shards_per_worker) if len(shard)]
+    print(f"Evaluating {len(rows)} satellites in {len(shards)} shards on {workers} workers")
+
+    attacker = propagation_interface.attacker_object
+    attacker_position = (attacker.latitude, attacker.longitude, attacker.altitude)
+    initargs = (catalog.records, propagation_interface.start_time, propagation_interface.stop_time,
+                attacker_position, propagation_interface.victim_object.ssc_number, coverage)
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=initargs) as executor:
+        results = list(executor.map(shard_function, shards, *[[arg] * len(shards) for arg in args]))
+
+    return results, None if coverage is None else np.frombuffer(coverage, dtype=np.bool_).copy()
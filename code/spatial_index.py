@@ -0,0 +1,107 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from decision_window_calc import SPEED_OF_LIGHT
+
+
+def range_budget(tail_time):
+    """
+    decisionDelay > 0 is equivalent to AtoD + DtoV - AtoV < c * tail_time
+    :param tail_time: in seconds
+    :return: c * tail_time in km
+    """
+    return SPEED_OF_LIGHT * tail_time / 1000
+
+
+class DefenderIndex:
+    """
+    k-d trees over the satellite positions of each time step.
+    All feasible defenders lie inside a prolate ellipsoid with attacker and victim as foci
+    (AtoD + DtoV < AtoV + c * tail_time). The ellipsoid is enclosed by the sphere around its center with the semi
+    major axis as radius, which the trees answer without looking at the rest of the catalog.
+    """
+
+    def __init__(self, positions):
+        """
+        :param positions: Satellite positions in km, shape (satellites, times, 3). NaN for failed propagation
+        """
+        self.positions = positions
+        self.trees = [None] * positions.shape[1]
+        self.tree_rows = [None] * positions.shape[1]
+
+    def tree(self, time_index):
+        # Trees are only built for time steps that are actually queried
+        if self.trees[time_index] is None:
+            positions = self.positions[:, time_index]
+            rows = np.nonzero(~np.isnan(positions).any(axis=-1))[0]
+            self.trees[time_index] = cKDTree(positions[rows])
+            self.tree_rows[time_index] = rows
+
+        return self.trees[time_index], self.tree_rows[time_index]
+
+    def query(self, time_index, attacker_position, victim_position, budget, margin=0.0):
+        """
+        :param time_index: Time step of the positions
+        :param attacker_position: shape (3,) in km
+        :param victim_position: shape (3,) in km
+        :param budget: c * tail_time in km, see range_budget
+        :param margin: Extra km allowed on AtoD + DtoV, e.g. to account for other element sets
+        :return: rows of the satellites inside the feasibility ellipsoid
+        """
+        if np.isnan(attacker_position).any() or np.isnan(victim_position).any():
+            return np.array([], dtype=np.int64)
+
+        focal_distance = np.linalg.norm(victim_position - attacker_position)
+        max_distance_sum = focal_distance + budget + margin
+
+        # Sphere around the ellipsoid first, the exact check only runs on the few remaining satellites
+        tree, rows = self.tree(time_index)
+        center = (attacker_position + victim_position) / 2
+        candidates = rows[np.asarray(tree.query_ball_point(center, max_distance_sum / 2), dtype=np.int64)]
+
+        candidate_positions = self.positions[candidates, time_index]
+        distance_sum = (np.linalg.norm(candidate_positions - attacker_position, axis=-1) +
+                        np.linalg.norm(candidate_positions - victim_position, axis=-1))
+        return np.sort(candidates[distance_sum < max_distance_sum])
+
+    def feasible_pairs(self, attacker_positions, victim_positions, budget, margin=0.0):
+        """
+        Sparse version of feasible_mask, the trees are shared by all attacker/victim pairs that query this index
+        :param attacker_positions: shape (times, 3) in km
+        :param victim_positions: shape (times, 3) in km
+        :return: rows and time indices of the satellite/time pairs inside the feasibility ellipsoid
+        """
+        rows = [self.query(time_index, attacker_positions[time_index], victim_positions[time_index], budget, margin)
+                for time_index in range(self.positions.shape[1])]
+        time_indices = np.repeat(np.arange(len(rows)), [len(time_rows) for time_rows in rows])
+        return np.concatenate([np.array([], dtype=np.int64)] + rows), time_indices
+
+    def feasible_mask(self, attacker_positions, victim_positions, budget, margin=0.0):
+        """
+        :param attacker_positions: shape (times, 3) in km
+        :param victim_positions: shape (times, 3) in km
+        :return: boolean mask of shape (satellites, times), True inside the feasibility ellipsoid
+        """
+        mask = np.zeros(self.positions.shape[:2], dtype=bool)
+        mask[self.feasible_pairs(attacker_positions, victim_positions, budget, margin)] = True
+
+        return mask
+
+
+def find_candidate_defenders(propagation_interface, times, tail_time, rows=None, margin=0.0, dtype=np.float64):
+    """
+    Propagates the catalog and keeps only the satellites that could possibly defend
+    :param propagation_interface: PropagationInterface with attacker and victim
+    :param times: datetime64 array
+    :param tail_time: in seconds
+    :param rows: Catalog rows to use, all if None
+    :param margin: see DefenderIndex.query
+    :param dtype: Precision of the positions, see PropagationInterface.propagate_catalog
+    :return: candidate mask of shape (satellites, times) and the propagated positions
+    """
+    positions = propagation_interface.propagate_catalog(times, rows, dtype)
+    attacker_positions = propagation_interface.attacker_object.positions(times)
+    victim_positions = propagation_interface.victim_object.positions(times)
+
+    index = DefenderIndex(positions)
+    return index.feasible_mask(attacker_positions, victim_positions, range_budget(tail_time), margin), positions
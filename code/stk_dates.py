@@ -0,0 +1,132 @@
+import datetime
+import re
+
+import numpy as np
+
+# Format STK uses for dates in reports and scenario settings, e.g. "1 Jan 2024 00:00:00.000000000"
+stk_date_format = "%d %b %Y %H:%M:%S.%f"
+stk_date_regex = re.compile(r"^(\d{1,2}\s[A-Z][a-z]{2}\s\d{4} \d{2}:\d{2}:)(\d{2}\.\d{1,})$")
+
+
+def stk_date_to_datetime(s: str) -> datetime.datetime:
+    # STK reports nanoseconds, datetime only supports microseconds
+    truncate_to_microseconds = lambda match: f"{match.group(1)}{match.group(2)[:9]}"
+    return datetime.datetime.strptime(re.sub(stk_date_regex, truncate_to_microseconds, s), stk_date_format)
+
+
+def datetime_to_stk_date(d: datetime.datetime) -> str:
+    return d.strftime(stk_date_format)
+
+
+# Vectorized codec for whole arrays of STK dates. Internally times are integer offsets from the scenario epoch.
+month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+month_bytes = np.array([list(name.encode()) for name in month_names], dtype=np.uint8)
+month_codes = month_bytes.astype(np.int64) @ np.array([65536, 256, 1])
+
+# Layout after padding the day: "DD Mon YYYY HH:MM:SS.fffffffff"
+padded_stk_date_length = 30
+
+
+def parse_number(digits, start, stop):
+    return digits[:, start:stop] @ (10 ** np.arange(stop - start - 1, -1, -1, dtype=np.int64))
+
+
+def stk_dates_to_datetime64(dates) -> np.ndarray:
+    """
+    Parses STK dates like "1 Jan 2024 00:00:00.000000000" without a Python loop
+    :param dates: list or array of STK dates
+    :return: datetime64[ns] array
+    """
+    dates = np.asarray(dates, dtype=str)
+    if dates.size == 0:
+        return np.array([], dtype="datetime64[ns]")
+
+    # Bring all dates into the same layout, single digit days and short fractions are padded
+    dates = np.where(np.char.find(dates, " ") == 1, np.char.add("0", dates), dates)
+    dates = np.char.ljust(dates, padded_stk_date_length, "0")
+    chars = dates.astype(f"S{padded_stk_date_length}").view(np.uint8).reshape(-1, padded_stk_date_length)
+    digits = chars.astype(np.int64) - ord("0")
+
+    day = parse_number(digits, 0, 2)
+    year = parse_number(digits, 7, 11)
+    hour = parse_number(digits, 12, 14)
+    minute = parse_number(digits, 15, 17)
+    second = parse_number(digits, 18, 20)
+    nanosecond = parse_number(digits, 21, 30)
+
+    codes = chars[:, 3:6].astype(np.int64) @ np.array([65536, 256, 1])
+    month = np.nonzero(codes[:, np.newaxis] == month_codes)[1]
+
+    months = (year - 1970) * 12 + month
+    return (months.astype("datetime64[M]").astype("datetime64[ns]") +
+            ((day - 1) * 86400 + hour * 3600 + minute * 60 + second).astype("timedelta64[s]") +
+            nanosecond.astype("timedelta64[ns]"))
+
+
+def datetime64_to_stk_dates(times) -> np.ndarray:
+    """
+    Formats dates like datetime_to_stk_date, e.g. "01 Jan 2024 00:00:00.000000", without a Python loop
+    :param times: datetime64 array
+    :return: array of STK dates
+    """
+    times = np.asarray(times, dtype="datetime64[us]")
+    if times.size == 0:
+        return np.array([], dtype=str)
+
+    # ISO layout "YYYY-MM-DDTHH:MM:SS.ffffff" rearranged to "DD Mon YYYY HH:MM:SS.ffffff"
+    iso = np.datetime_as_string(times.ravel(), unit="us").astype("S26").view(np.uint8).reshape(-1, 26)
+    month = (iso[:, 5].astype(np.int64) - ord("0")) * 10 + iso[:, 6] - ord("0") - 1
+
+    chars = np.full((len(iso), 27), ord(" "), dtype=np.uint8)
+    chars[:, 0:2] = iso[:, 8:10]
+    chars[:, 3:6] = month_bytes[month]
+    chars[:, 7:11] = iso[:, 0:4]
+    chars[:, 12:27] = iso[:, 11:26]
+    return chars.view("S27").ravel().astype(str).reshape(times.shape)
+
+
+def stk_dates_to_offsets(dates, epoch) -> np.ndarray:
+    """
+    :param dates: list or array of STK dates
+    :param epoch: STK date of the scenario start
+    :return: whole seconds since epoch (int64). STK doesn't always do clean jumps, so dates are rounded
+    """
+    epoch = stk_dates_to_datetime64([epoch])[0]
+    return np.rint((stk_dates_to_datetime64(dates) - epoch) / np.timedelta64(1, "s")).astype(np.int64)
+
+
+def offsets_to_datetime64(offsets, epoch) -> np.ndarray:
+    """
+    :param offsets: seconds since epoch, fractions of float offsets are kept to the microsecond
+    :param epoch: STK date of the scenario start
+    :return: datetime64[us] array
+    """
+    epoch = stk_dates_to_datetime64([epoch])[0].astype("datetime64[us]")
+    offsets = np.asarray(offsets)
+    if np.issubdtype(offsets.dtype, np.floating):
+        return epoch + np.rint(offsets * 1e6).astype(np.int64).astype("timedelta64[us]")
+    return epoch + offsets.astype(np.int64).astype("timedelta64[s]")
+
+
+def offsets_to_stk_dates(offsets, epoch) -> np.ndarray:
+    return datetime64_to_stk_dates(offsets_to_datetime64(offsets, epoch))
+
+
+def lookup_ranges(offsets, ranges, target_offsets) -> np.ndarray:
+    """
+    Picks the ranges at the target offsets with array indexing
+    :param offsets: sorted offsets of a range series
+    :param ranges: ranges of the series
+    :param target_offsets: offsets to look up
+    :return: ranges at the target offsets, NaN where the series has no sample
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    target_offsets = np.asarray(target_offsets, dtype=np.int64)
+    result = np.full(target_offsets.shape, np.nan)
+    if offsets.size == 0:
+        return result
+
+    indices = np.clip(np.searchsorted(offsets, target_offsets), 0, offsets.size - 1)
+    found = offsets[indices] == target_offsets
+    result[found] = np.asarray(ranges, dtype=np.float64)[indices[found]]
+    return result
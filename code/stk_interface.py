@@ -1,20 +1,36 @@
+from __future__ import annotations
+
 import datetime
-import re
-import string
+import json
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING
+
+import numpy as np
 
-from agi.stk12.stkdesktop import STKDesktop
-from agi.stk12.stkobjects import AgESTKObjectType, AgEVePropagatorType
+import stk_dates
+from geometry_backend import RangeDataCache, convert_name
+
+# The STK API is only imported once STK is actually attached
+if TYPE_CHECKING:
+    from agi.stk12.stkobjects import AgESTKObjectType
 
 
 class STKInterface:
-    stk_date_format = "%d %b %Y %H:%M:%S.%f"
-    stk_date_regex = re.compile(r"^(\d{1,2}\s[A-Z][a-z]{2}\s\d{4} \d{2}:\d{2}:)(\d{2}\.\d{1,})$")
+    stk_date_format = stk_dates.stk_date_format
+    stk_date_regex = stk_dates.stk_date_regex
+
+    def __init__(self, cleanup=True, aer_cache_size=256):
+        # Seconds per STK call, see save_call_timings
+        self.call_timings = defaultdict(list)
 
-    def __init__(self, cleanup=True):
         # STK management
+        from agi.stk12.stkdesktop import STKDesktop
+        attach_start = time.perf_counter()
         self.stk = STKDesktop.AttachToApplication()
         self.root = self.stk.Root
         self.scenario = self.root.CurrentScenario
+        self.call_timings["attach"].append(time.perf_counter() - attach_start)
 
         if not self.scenario:
             print("Either the scenario is not opened in STK or STK has a hiccup and needs to be restarted.")
@@ -37,6 +53,9 @@ class STKInterface:
         # Add constellation map
         self.constellations = {}
 
+        # Executed AER reports
+        self.aer_cache = RangeDataCache(aer_cache_size)
+
     def __del__(self):
         if self.cleanup:
             self.cleanup_scenario()
@@ -72,25 +91,36 @@ class STKInterface:
             self.remove_satellite(satellite)
 
     def convert_name(self, satellite_name):
-        satellite_name = satellite_name.replace(" ", "_")
-        allowed_chars = string.ascii_letters + string.digits + "_"
+        return convert_name(satellite_name)
 
-        satellite_name = "".join(filter(lambda c: c in allowed_chars, list(satellite_name)))
-        return satellite_name
+    def time_offsets(self, times) -> np.ndarray:
+        """
+        :param times: STK dates
+        :return: whole seconds since scenario start
+        """
+        return stk_dates.stk_dates_to_offsets(times, self.scenario.StartTime)
 
-    def through_away_milliseconds(self, time):
-        time_datetime = self.stk_date_to_datetime(time)
-        time_datetime = time_datetime.replace(microsecond=0)
-        return self.datetime_to_stk_date(time_datetime)
+    def offsets_to_stk_dates(self, offsets) -> np.ndarray:
+        return stk_dates.offsets_to_stk_dates(offsets, self.scenario.StartTime)
 
-    def get_aer_report_data(self, object1, object2, step_size=10) -> dict[str, str]:
+    def get_aer_report_data(self, object1, object2, step_size=10) -> dict[str, float]:
         """
-
         :param object1: Can be the path of the object or the object itself
         :param object2: Can be the path of the object or the object itself
         :param step_size:
         :return: mapping from time to range in km
         """
+        offsets, ranges = self.get_range_data(object1, object2, step_size)
+        return dict(zip(self.offsets_to_stk_dates(offsets).tolist(), ranges.tolist()))
+
+    def get_range_data(self, object1, object2, step_size=10) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Results are cached until one of the objects is removed, so repeated calls don't execute the report again
+        :param object1: Can be the path of the object or the object itself
+        :param object2: Can be the path of the object or the object itself
+        :param step_size:
+        :return: sorted times in seconds since scenario start (int64) and ranges in km, only while in access
+        """
 
         # If object is provided instead of path, convert to path
         if type(object1) is not str:
@@ -99,6 +129,29 @@ class STKInterface:
         if type(object2) is not str:
             object2 = object2.Path
 
+        cache_key = (object1, object2, self.scenario.StartTime, self.scenario.StopTime, step_size)
+        range_data = self.aer_cache.get(cache_key)
+        if range_data is None:
+            report_start = time.perf_counter()
+            range_data = self.execute_aer_report(object1, object2, step_size)
+            self.call_timings["execute_aer_report"].append(time.perf_counter() - report_start)
+            self.aer_cache.put(cache_key, range_data)
+
+        return range_data
+
+    def invalidate_aer_cache(self, object_path=None):
+        self.aer_cache.invalidate(object_path)
+
+    def save_call_timings(self, timings_file):
+        """
+        Stores the recorded seconds per call, e.g. for the latency of SimulatedSTKInterface
+        :param timings_file: JSON file
+        :return: None
+        """
+        with open(timings_file, "w") as f:
+            json.dump(self.call_timings, f, indent=1)
+
+    def execute_aer_report(self, object1: str, object2: str, step_size) -> tuple[np.ndarray, np.ndarray]:
         # Create access
         access_report = self.scenario.GetAccessBetweenObjectsByPath(object1, object2)
 
@@ -112,30 +165,30 @@ class STKInterface:
         executed_aer = default_aer_report.Exec(self.scenario.StartTime, self.scenario.StopTime, step_size)
         number_of_intervals = executed_aer.Intervals.Count
 
-        times = []
-        ranges = []
+        # Values of each access interval, concatenated once at the end
+        interval_times = []
+        interval_ranges = []
 
         # Iterate over all Access time slot
         for i in range(number_of_intervals):
             # Take values from report
             executed_aer_dataset = executed_aer.Intervals.Item(i).DataSets
-
-            if "Time" in executed_aer_dataset.ElementNames:
-                times += executed_aer_dataset.GetDataSetByName('Time').GetValues()
-            else:
+            if "Time" not in executed_aer_dataset.ElementNames or "Range" not in executed_aer_dataset.ElementNames:
                 # Out of range
-                return {}
+                return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
 
-            if "Range" in executed_aer_dataset.ElementNames:
-                ranges += executed_aer_dataset.GetDataSetByName('Range').GetValues()
-            else:
-                # Out of range
-                return {}
+            interval_times.append(np.asarray(executed_aer_dataset.GetDataSetByName('Time').GetValues()))
+            interval_ranges.append(np.asarray(executed_aer_dataset.GetDataSetByName('Range').GetValues(),
+                                              dtype=np.float64))
 
-        # Filter out milliseconds, because stk not always does clean jumps in access reports
-        times = [self.through_away_milliseconds(t) for t in times]
+        if not interval_times:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
 
-        return dict(zip(times, ranges))
+        # Whole seconds, because stk not always does clean jumps in access reports
+        offsets = self.time_offsets(np.concatenate(interval_times))
+        order = np.argsort(offsets, kind="stable")
+
+        return offsets[order], np.concatenate(interval_ranges)[order]
 
     def add_constellation(self, constellation_name, sat_name_ssc_map: dict[str, str]) -> dict[
         str, AgESTKObjectType.eSatellite]:
@@ -151,8 +204,11 @@ class STKInterface:
         return satellites_in_constellation
 
     def add_satellite(self, satellite_name: str, ssc_number: str) -> AgESTKObjectType.eSatellite:
+        from agi.stk12.stkobjects import AgESTKObjectType, AgEVePropagatorType
+
         # Remove satellite with same name if exists
         self.remove_duplicates(satellite_name)
+        add_start = time.perf_counter()
 
         # Create satellite
         satellite = self.scenario.Children.New(AgESTKObjectType.eSatellite, satellite_name)
@@ -168,6 +224,7 @@ class STKInterface:
 
         # Add to newly added satellite list
         self.added_satellites.append(satellite)
+        self.call_timings["add_satellite"].append(time.perf_counter() - add_start)
 
         return satellite
 
@@ -182,15 +239,18 @@ class STKInterface:
     def remove_satellite(self, satellite: AgESTKObjectType.eSatellite) -> None:
         if satellite in self.added_satellites:
             self.added_satellites.remove(satellite)
+
+        # A new satellite with the same name would otherwise get the old reports
+        self.invalidate_aer_cache(satellite.Path)
+        remove_start = time.perf_counter()
         satellite.Unload()
+        self.call_timings["remove_satellite"].append(time.perf_counter() - remove_start)
 
     def stk_date_to_datetime(self, s: str) -> datetime.datetime:
-        truncate_to_microseconds = lambda match: f"{match.group(1)}{round(float(match.group(2)), 6)}"
-        return datetime.datetime.strptime(re.sub(self.stk_date_regex, truncate_to_microseconds, s),
-                                          self.stk_date_format)
+        return stk_dates.stk_date_to_datetime(s)
 
     def datetime_to_stk_date(self, d: datetime.datetime) -> str:
-        return d.strftime(self.stk_date_format)
+        return stk_dates.datetime_to_stk_date(d)
 
 
 def main():
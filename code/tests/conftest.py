@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules of code/ are imported by their file name, like the experiment scripts do
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CODE_DIR)
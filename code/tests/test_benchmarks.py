@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import pytest
+
+import stk_dates
+from benchmark import WINDOW_END, WINDOW_START, synthetic_catalog
+from decision_window_calc import decisionDelayBatch
+from propagation import propagate, sgp4_init, time_grid
+from satellite_catalog import SatelliteCatalog
+
+# Microbenchmarks of the hot paths, e.g. pytest tests/test_benchmarks.py --benchmark-autosave and
+# --benchmark-compare to compare commits. benchmark.py covers what doesn't fit a microbenchmark: catalog sizes up to
+# 30k satellites with extrapolated propagation windows and the end to end runs of both experiments
+pytest.importorskip("pytest_benchmark")
+
+CELESTRAK_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "celestrak.json")
+
+
+def test_decision_delay_batch(benchmark):
+    random = np.random.default_rng(0)
+    AtoD, DtoV, AtoV = random.uniform(5e5, 3e6, (3, 1000000))
+    benchmark(decisionDelayBatch, AtoD, DtoV, AtoV, 0.005)
+
+
+def test_stk_dates_to_datetime64(benchmark):
+    # One STK date per second of the window, like an AER report at 1s steps
+    dates = stk_dates.datetime64_to_stk_dates(time_grid(WINDOW_START, WINDOW_END, 1))
+    benchmark(stk_dates.stk_dates_to_datetime64, dates)
+
+
+def test_datetime64_to_stk_dates(benchmark):
+    benchmark(stk_dates.datetime64_to_stk_dates, time_grid(WINDOW_START, WINDOW_END, 1))
+
+
+def test_catalog_load(benchmark):
+    benchmark(SatelliteCatalog.load, CELESTRAK_FILE, use_sidecar=False)
+
+
+def test_propagate(benchmark):
+    # Larger catalogs are propagated in blocks by benchmark.py, one call would need several GB
+    elements = synthetic_catalog(1000).elements()
+    record = sgp4_init(elements)
+    times = time_grid(WINDOW_START, WINDOW_END, 60)
+    benchmark(propagate, elements, times, record)
@@ -0,0 +1,167 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import stk_dates
+from decision_window_calc import decisionDelay, decisionDelayBatch
+from propagation import ELEMENT_FIELDS, MINUTES_PER_DAY, propagate, time_grid
+from results_journal import ResultsJournal
+from results_store import ResultsStore
+from top_defenders import TopDefenders
+
+CELESTRAK_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "celestrak.json")
+
+
+@pytest.fixture(scope="module")
+def near_earth_records():
+    # Every 50th satellite with a period below 225 min, the deep space terms of SDP4 are not ported
+    with open(CELESTRAK_FILE, "r") as f:
+        records = json.load(f)
+    return [record for record in records if record["MEAN_MOTION"] > MINUTES_PER_DAY / 225][::50]
+
+
+def test_sgp4_propagate_matches_sgp4_package(near_earth_records):
+    sgp4_api = pytest.importorskip("sgp4.api")
+    from sgp4 import omm
+
+    times = time_grid("1 Jan 2024 00:00:00.000000000", "2 Jan 2024 00:00:00.000000000", 600)
+    elements = {field: np.array([record[field] for record in near_earth_records])
+                for field in ELEMENT_FIELDS + ["EPOCH"]}
+    positions = propagate(elements, times)
+
+    # Julian dates as whole days and fraction, a single float64 would lose about 40 microseconds
+    since_j2000 = times - np.datetime64("2000-01-01T12:00:00", "us")
+    days = since_j2000 // np.timedelta64(1, "D")
+    whole_days = 2451545.0 + days
+    day_fractions = (since_j2000 - days * np.timedelta64(1, "D")) / np.timedelta64(1, "D")
+    for record, satellite_positions in zip(near_earth_records, positions):
+        satellite = sgp4_api.Satrec()
+        omm.initialize(satellite, record)
+        errors, reference_positions, _ = satellite.sgp4_array(whole_days, day_fractions)
+
+        valid = errors == 0
+        np.testing.assert_allclose(satellite_positions[valid], reference_positions[valid], rtol=0, atol=1e-5,
+                                   err_msg=record["OBJECT_NAME"])
+
+
+def test_stk_dates_round_trip():
+    times = np.array(["2024-01-01T00:00:00", "2024-02-29T23:59:59.999999", "2024-12-31T12:30:05.000001",
+                      "1999-07-04T01:02:03.5"], dtype="datetime64[us]")
+    dates = stk_dates.datetime64_to_stk_dates(times)
+    assert dates[0] == "01 Jan 2024 00:00:00.000000"
+    np.testing.assert_array_equal(stk_dates.stk_dates_to_datetime64(dates).astype("datetime64[us]"), times)
+
+    # Scalar codec and STK's own format with single digit days and nanoseconds
+    assert stk_dates.datetime_to_stk_date(stk_dates.stk_date_to_datetime(dates[1])) == dates[1]
+    assert stk_dates.stk_dates_to_datetime64(["1 Jan 2024 00:00:01.000000001"])[0] == \
+        np.datetime64("2024-01-01T00:00:01.000000001", "ns")
+
+    offsets = np.array([0, 59, 3600, 86400])
+    epoch = "1 Jan 2024 00:00:00.000000000"
+    np.testing.assert_array_equal(
+        stk_dates.stk_dates_to_offsets(stk_dates.offsets_to_stk_dates(offsets, epoch), epoch), offsets)
+
+
+def test_decision_delay_batch_matches_scalar():
+    random = np.random.default_rng(0)
+    AtoD, DtoV, AtoV = random.uniform(5e5, 3e6, (3, 1000))
+    AtoD[::7] = np.nan  # out of range
+    tail_time = 6 * 8 / 9600
+
+    decision_delay, can_defend = decisionDelayBatch(AtoD, DtoV, AtoV, tail_time)
+    for index in range(len(AtoD)):
+        expected = decisionDelay(AtoD[index], DtoV[index], AtoV[index], tail_time)
+        if np.isnan(expected):
+            assert np.isnan(decision_delay[index]) and not can_defend[index]
+        else:
+            assert decision_delay[index] == pytest.approx(expected, rel=0, abs=1e-15)
+            assert can_defend[index] == (expected > 0)
+    assert can_defend.any() and not can_defend.all()
+
+
+def test_journal_resumes_after_truncated_line(tmp_path):
+    journal_file = str(tmp_path / "journal.jsonl")
+    setup = {"Tail time": 0.008, "Backend": "sgp4"}
+
+    journal = ResultsJournal(journal_file, setup, resume=False)
+    journal.append({"satellite": "A", "defenders": {}})
+    journal.append({"satellite": "B", "defenders": {"t": 1.5}})
+    journal.close()
+
+    # Crash while writing the third line
+    with open(journal_file, "a") as f:
+        f.write('{"satellite": "C", "defe')
+
+    journal = ResultsJournal(journal_file, setup, resume=True)
+    assert [entry["satellite"] for entry in journal.entries] == ["A", "B"]
+    journal.append({"satellite": "C", "defenders": {}})
+    journal.close()
+
+    journal = ResultsJournal(journal_file, setup, resume=True)
+    assert [entry["satellite"] for entry in journal.entries] == ["A", "B", "C"]
+    journal.close()
+
+    # A journal of a different setup is never resumed
+    with pytest.raises(SystemExit):
+        ResultsJournal(journal_file, {**setup, "Tail time": 0.005}, resume=True)
+
+
+def test_top_defenders_batches_match_single_merge():
+    random = np.random.default_rng(1)
+    number_of_pairs = 500
+    rows = random.integers(0, 40, number_of_pairs)
+    slots = random.integers(0, 12, number_of_pairs)
+    AtoD, DtoV = random.uniform(1e5, 1e6, (2, number_of_pairs))
+    decision_delays = random.uniform(0, 0.005, number_of_pairs)
+
+    single = TopDefenders(12, 40, 3)
+    single.add(rows, slots, AtoD, DtoV, decision_delays)
+
+    batched = TopDefenders(12, 40, 3)
+    for batch in np.array_split(random.permutation(number_of_pairs), 7):
+        batched.add(rows[batch], slots[batch], AtoD[batch], DtoV[batch], decision_delays[batch])
+
+    for result in (single, batched):
+        for slot in range(12):
+            expected = np.sort(decision_delays[slots == slot])[::-1][:3]
+            kept = result.decision_delays[slot][result.rows[slot] >= 0]
+            np.testing.assert_array_equal(kept, expected)
+    np.testing.assert_array_equal(single.defended_slots, np.bincount(rows, minlength=40))
+    np.testing.assert_array_equal(single.defended_slots, batched.defended_slots)
+    np.testing.assert_array_equal(single.best_decision_delays, batched.best_decision_delays)
+
+
+def test_results_store_split_put_and_reload(tmp_path):
+    parameters = {"Experiment": "Exp2", "Tail time": 0.008}
+    store = ResultsStore(str(tmp_path), parameters)
+    assert store.split(["a", "b"]) == [0, 1]
+
+    store.put_many({"a": {"t1": {"decision_delay": 0.001}}, "b": {}})
+    assert store.split(["a", "b", "c"]) == [2]
+    assert (store.hits, store.misses) == (2, 3)
+    store.close()
+
+    # Reloaded, results of other parameters are in another directory
+    store = ResultsStore(str(tmp_path), parameters)
+    assert store.get("a") == {"t1": {"decision_delay": 0.001}}
+    assert store.get("b") == {}
+    store.close()
+    assert ResultsStore(str(tmp_path), {**parameters, "Tail time": 0.005}).split(["a"]) == [0]
+
+
+def test_defender_service_rejects_invalid_events():
+    from ips_service import DefenderService
+    from satellite_catalog import SatelliteCatalog
+
+    catalog = SatelliteCatalog.load(CELESTRAK_FILE, use_sidecar=False)
+    victim_row = catalog.row_by_ssc_number(44878)
+    service = DefenderService(catalog.subset(np.append(victim_row, np.arange(0, len(catalog), 50))))
+    event = {"id": 1, "station": "Attacker", "victim": "44878", "time": "1 Jan 2024 03:00:45.000000000"}
+
+    assert "defenders" in service.handle_event({**event, "top": 2, "tail_time": 0.005})
+    for invalid in ({"top": 0}, {"top": -1}, {"top": 1.5}, {"top": True}, {"tail_time": "x"}, {"tail_time": 0},
+                    {"tail_time": float("nan")}, {"tail_time": True}):
+        response = service.handle_event({**event, **invalid})
+        assert response["error"].startswith("ValueError"), response
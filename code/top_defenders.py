@@ -0,0 +1,102 @@
+import numpy as np
+
+
+class TopDefenders:
+    """
+    Best defenders of each time slot for Experiment 2 with bounded memory. Only the k defenders with the largest
+    decision delay are kept per slot, in fixed-size arrays of shape (slots, k), so the memory does not grow with the
+    number of satellites. Per satellite only counters are kept: number of defended slots and best decision delay.
+    Batches of defender/slot pairs can be added in any order, the result is the same as sorting all pairs at once.
+    """
+
+    def __init__(self, number_of_slots, number_of_satellites, k):
+        """
+        :param number_of_slots: Number of time slots
+        :param number_of_satellites: Number of rows the satellites are identified by (e.g. catalog rows)
+        :param k: Defenders kept per time slot
+        """
+        self.k = k
+        self.rows = np.full((number_of_slots, k), -1, dtype=np.int64)
+        self.AtoD = np.full((number_of_slots, k), np.nan)
+        self.DtoV = np.full((number_of_slots, k), np.nan)
+        self.decision_delays = np.full((number_of_slots, k), -np.inf)
+
+        self.defended_slots = np.zeros(number_of_satellites, dtype=np.int64)
+        self.best_decision_delays = np.full(number_of_satellites, -np.inf)
+
+    def add(self, rows, slot_indices, AtoD, DtoV, decision_delays):
+        """
+        :param rows: Satellite of each pair that can defend, shape (pairs,)
+        :param slot_indices: Time slot of each pair
+        :param AtoD: Distances in m
+        :param DtoV: Distances in m
+        :param decision_delays: Decision delays in seconds, all positive
+        """
+        np.add.at(self.defended_slots, rows, 1)
+        np.maximum.at(self.best_decision_delays, rows, decision_delays)
+
+        # Merge the kept defenders with the batch and keep the first k of each slot, ties are kept in the order
+        # the pairs were added
+        kept_slots, kept_ranks = np.nonzero(self.rows >= 0)
+        all_slots = np.concatenate([kept_slots, slot_indices])
+        all_rows = np.concatenate([self.rows[kept_slots, kept_ranks], rows])
+        all_AtoD = np.concatenate([self.AtoD[kept_slots, kept_ranks], AtoD])
+        all_DtoV = np.concatenate([self.DtoV[kept_slots, kept_ranks], DtoV])
+        all_decision_delays = np.concatenate([self.decision_delays[kept_slots, kept_ranks], decision_delays])
+
+        order = np.lexsort((-all_decision_delays, all_slots))
+        sorted_slots = all_slots[order]
+        # Rank of each pair within its slot
+        slot_starts = np.searchsorted(sorted_slots, sorted_slots, side="left")
+        ranks = np.arange(len(order)) - slot_starts
+        keep = ranks < self.k
+        order, sorted_slots, ranks = order[keep], sorted_slots[keep], ranks[keep]
+
+        self.rows[sorted_slots, ranks] = all_rows[order]
+        self.AtoD[sorted_slots, ranks] = all_AtoD[order]
+        self.DtoV[sorted_slots, ranks] = all_DtoV[order]
+        self.decision_delays[sorted_slots, ranks] = all_decision_delays[order]
+
+    def defended(self):
+        """
+        :return: boolean array (slots,), True if the slot has at least one defender
+        """
+        return self.rows[:, 0] >= 0
+
+    def pairs(self):
+        """
+        :return: slot indices, rows, AtoD and DtoV in m and decision delays of the kept defenders, by slot and best
+                 decision delay first
+        """
+        slots, ranks = np.nonzero(self.rows >= 0)
+        return (slots, self.rows[slots, ranks], self.AtoD[slots, ranks], self.DtoV[slots, ranks],
+                self.decision_delays[slots, ranks])
+
+    def time_defender_mapping(self, target_times, AtoV_ranges, satellite_names):
+        """
+        :param target_times: STK dates of the time slots
+        :param AtoV_ranges: Range between attacker and victim at each time slot in km
+        :param satellite_names: Name of each satellite row
+        :return: defenders of each time slot as in report_Exp2.json, best decision delay first
+        """
+        time_defender_mapping = {}
+        for slot, target_time in enumerate(target_times):
+            time_defender_mapping[target_time] = {}
+            for rank in np.nonzero(self.rows[slot] >= 0)[0]:
+                time_defender_mapping[target_time][satellite_names[self.rows[slot, rank]]] = {
+                    "AtoV": float(AtoV_ranges[slot]),
+                    "AtoD": float(self.AtoD[slot, rank]),
+                    "DtoV": float(self.DtoV[slot, rank]),
+                    "decision_delay": float(self.decision_delays[slot, rank])
+                }
+        return time_defender_mapping
+
+    def satellite_counters(self, satellite_names):
+        """
+        :param satellite_names: Name of each satellite row
+        :return: defended time slots and best decision delay of every satellite that defends at least one slot
+        """
+        return {satellite_names[row]: {
+            "defended times": int(self.defended_slots[row]),
+            "best decision delay": float(self.best_decision_delays[row])
+        } for row in np.nonzero(self.defended_slots)[0]}
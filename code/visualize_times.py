@@ -1,130 +1,267 @@
+import argparse
+import json
+import os.path
+import string
+import time as timer
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from matplotlib import pyplot as plt, transforms
 from matplotlib.collections import PolyCollection
 
-from decision_window_calc import *
+from decision_window_calc import AtoD, AtoV, DtoV, tail_time, time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 graph_scale = 1000
 
-# Initial tail arrival times
-attacker_starts_sending_tail = 0
-
-tail_victim_start_arrival = time(AtoV)
-tail_defender_start_arrival = time(AtoD)
-
-tail_victim_arrival_window = (attacker_starts_sending_tail, attacker_starts_sending_tail + tail_victim_start_arrival)
-tail_defender_arrival_window = (
-    attacker_starts_sending_tail, attacker_starts_sending_tail + tail_defender_start_arrival)
-
-# Tail full arrival window
-tail_victim_end_arrival = attacker_starts_sending_tail + tail_victim_start_arrival + tail_time
-
-full_tail_victim_arrival_window = (tail_victim_arrival_window[1], tail_victim_end_arrival)
-
-# Defender to Victim signal delay
-defender_latest_jamming_start = tail_victim_end_arrival - time(DtoV)
-
-defender_latest_jamming_arrival_window = (defender_latest_jamming_start, tail_victim_end_arrival)
-
-# Decision Window
-defender_decision_window = (tail_defender_arrival_window[1], defender_latest_jamming_start)
-
-graph_bars = {
-    1: {
-        "name": "Victim\nProcessing",
-        "color": "black",
-        "bars": {
-            "Tail arrival window": full_tail_victim_arrival_window
-        }
-    },
-    2: {
-        "name": "Defender\nProcessing",
-        "color": "black",
-        "bars": {
-            "Decision Window": defender_decision_window
-        }
-    },
-    3: {
-        "name": "Defender\nto\nVictim",
-        "color": "black",
-        "bars": {
-            "Signal \n Delay": defender_latest_jamming_arrival_window
-        }
-    },
-    4: {
-        "name": "Attacker\nto\nVictim",
-        "color": "black",
-        "bars": {
-            "Tail start arrival delay": tail_victim_arrival_window
-        }
-    },
-    5: {
-        "name": "Attacker\nto\nDefender",
-        "color": "black",
-        "bars": {
-            "Tail start arrival delay": tail_defender_arrival_window
-        }
-    }
-}
-
-verts = []
-colors = []
-
-for id in graph_bars.keys():
-    values = graph_bars[id]
-    v = []
-    for window in values["bars"].values():
-        # Add a box
-        v.append((window[0] * graph_scale, id - .4))
-        v.append((window[0] * graph_scale, id + .4))
-        v.append((window[1] * graph_scale, id + .4))
-        v.append((window[1] * graph_scale, id - .4))
-        v.append((window[0] * graph_scale, id - .4))
-
-    verts.append(v)
-    colors.append(values["color"])
-
-bars = PolyCollection(verts, facecolors=colors)
-
-fig, ax = plt.subplots()
-ax.add_collection(bars)
-ax.autoscale()
-
-# Add x labels
-x_points = {
-    0: "0ms \n Attacker starts\n sending tail",
-    tail_victim_start_arrival * graph_scale: f"{round(tail_victim_start_arrival * 1000, 2)}ms \n Victim starts\n receiving",
-    tail_defender_start_arrival * graph_scale: f"{round(tail_defender_start_arrival * 1000, 2)}ms \n Defender starts\n receiving",
-    tail_victim_end_arrival * graph_scale: f"{round(tail_victim_end_arrival * 1000, 2)}ms \n Tails was\n received entirely",
-    defender_latest_jamming_start * graph_scale: f"{round(defender_latest_jamming_start * 1000, 2)}ms \n Latest jamming\n start time"
-}
-plt.xticks(list(x_points.keys()), list(x_points.values()))
-plt.xticks(rotation=45, fontsize=9)
-
-# Add y labels
-ax.set_yticks(list(graph_bars.keys()))
-ax.set_yticklabels([value["name"] for value in graph_bars.values()])
-plt.yticks(fontsize=10)
-
-# apply offset transform to all x tick that overlaps
-dx, dy = -15/72, 0/72.
-offset = transforms.ScaledTranslation(dx, dy, fig.dpi_scale_trans)
-label = ax.xaxis.get_majorticklabels()[4]
-label.set_transform(label.get_transform() + offset)
-
-# Add text
-for id in graph_bars.keys():
-    values = graph_bars[id]
-    v = []
-    for name in values["bars"].keys():
-        window = values["bars"][name]
-        x = (window[0] * graph_scale + window[1] * graph_scale) / 2
-        y = id
-        time_window = round((window[1] - window[0]) * 1000, 2)
-        label = f"{name} \n {time_window}ms"
-        plt.text(x, y, label, horizontalalignment="center", verticalalignment="center", weight='bold', fontsize=7, color="white")
-
-fig.set_figwidth(7)
-
-plt.subplots_adjust(bottom=0.3, left=0.12)
-plt.savefig('TimeWindow.pdf')
-#plt.show()
+# Rows of the diagram from bottom to top (y = 1 ... 5)
+BAR_NAMES = ["Victim\nProcessing", "Defender\nProcessing", "Defender\nto\nVictim", "Attacker\nto\nVictim",
+             "Attacker\nto\nDefender"]
+BAR_LABELS = ["Tail arrival window", "Decision Window", "Signal \n Delay", "Tail start arrival delay",
+              "Tail start arrival delay"]
+BAR_COLORS = ["black"] * len(BAR_NAMES)
+
+# Diagrams per task of a render worker
+RENDER_CHUNK_SIZE = 50
+
+
+def timing_windows(AtoD, DtoV, AtoV, tail_time):
+    """
+    Windows of the timing diagram, vectorized over any number of defenders
+    :param AtoD: Distance between attacker and defender in m
+    :param DtoV: Distance between defender and victim in m
+    :param AtoV: Distance between attacker and victim in m
+    :param tail_time: in seconds
+    :return: start and end of each bar in seconds, shape (..., 5, 2) in the order of BAR_NAMES
+    """
+    AtoD, DtoV, AtoV, tail_time = np.broadcast_arrays(*[np.asarray(value, dtype=np.float64)
+                                                        for value in (AtoD, DtoV, AtoV, tail_time)])
+
+    # Initial tail arrival times
+    attacker_starts_sending_tail = np.zeros_like(AtoD)
+    tail_victim_start_arrival = attacker_starts_sending_tail + time(AtoV)
+    tail_defender_start_arrival = attacker_starts_sending_tail + time(AtoD)
+
+    # Tail full arrival window
+    tail_victim_end_arrival = tail_victim_start_arrival + tail_time
+
+    # Defender to Victim signal delay
+    defender_latest_jamming_start = tail_victim_end_arrival - time(DtoV)
+
+    windows = np.array([
+        [tail_victim_start_arrival, tail_victim_end_arrival],  # full tail arrival at the victim
+        [tail_defender_start_arrival, defender_latest_jamming_start],  # decision window
+        [defender_latest_jamming_start, tail_victim_end_arrival],  # latest jamming arrival
+        [attacker_starts_sending_tail, tail_victim_start_arrival],  # tail start arrival at the victim
+        [attacker_starts_sending_tail, tail_defender_start_arrival]  # tail start arrival at the defender
+    ])
+    return np.moveaxis(windows, (0, 1), (-2, -1))
+
+
+def bar_vertices(windows):
+    """
+    :param windows: Result of timing_windows
+    :return: PolyCollection vertices in graph units, shape (..., 5, 4, 2)
+    """
+    x = windows[..., [0, 0, 1, 1]] * graph_scale
+    y = np.arange(1, len(BAR_NAMES) + 1)[:, np.newaxis] + np.array([-.4, .4, .4, -.4])
+    return np.stack([x, np.broadcast_to(y, x.shape)], axis=-1)
+
+
+def x_ticks(windows):
+    """
+    :param windows: Windows of a single diagram, shape (5, 2)
+    :return: tick positions in graph units and labels
+    """
+    tail_victim_start_arrival = windows[3, 1]
+    tail_defender_start_arrival = windows[4, 1]
+    tail_victim_end_arrival = windows[0, 1]
+    defender_latest_jamming_start = windows[2, 0]
+
+    positions = np.array([0, tail_victim_start_arrival, tail_defender_start_arrival, tail_victim_end_arrival,
+                          defender_latest_jamming_start]) * graph_scale
+    labels = [
+        "0ms \n Attacker starts\n sending tail",
+        f"{round(tail_victim_start_arrival * 1000, 2)}ms \n Victim starts\n receiving",
+        f"{round(tail_defender_start_arrival * 1000, 2)}ms \n Defender starts\n receiving",
+        f"{round(tail_victim_end_arrival * 1000, 2)}ms \n Tails was\n received entirely",
+        f"{round(defender_latest_jamming_start * 1000, 2)}ms \n Latest jamming\n start time"
+    ]
+    return positions, labels
+
+
+class TimingDiagram:
+    """
+    Figure that is drawn once and reused for every diagram, only bars, ticks and texts are replaced
+    """
+
+    def __init__(self):
+        self.fig, self.ax = plt.subplots()
+        self.bars = PolyCollection([], facecolors=BAR_COLORS)
+        self.ax.add_collection(self.bars)
+
+        # Add y labels
+        self.ax.set_yticks(range(1, len(BAR_NAMES) + 1))
+        self.ax.set_yticklabels(BAR_NAMES, fontsize=10)
+
+        self.texts = [self.ax.text(0, y, "", horizontalalignment="center", verticalalignment="center",
+                                   weight="bold", fontsize=7, color="white") for y in range(1, len(BAR_NAMES) + 1)]
+
+        # Offset for the x tick of the latest jamming start, it overlaps with the end of the tail
+        self.offset = transforms.ScaledTranslation(-15 / 72, 0 / 72., self.fig.dpi_scale_trans)
+        self.tick_transform = None
+
+        self.fig.set_figwidth(7)
+        self.fig.subplots_adjust(bottom=0.3, left=0.12)
+
+    def draw(self, windows, file, title=None):
+        """
+        :param windows: Windows of a single diagram, shape (5, 2)
+        :param file: Output file, the format is taken from the extension
+        :param title: Optional title, e.g. the name of the defender
+        """
+        vertices = bar_vertices(windows)
+        self.bars.set_verts(vertices)
+        self.ax.ignore_existing_data_limits = True
+        self.ax.update_datalim(vertices.reshape(-1, 2))
+        self.ax.autoscale_view()
+
+        # Add x labels
+        positions, labels = x_ticks(windows)
+        self.ax.set_xticks(positions, labels, rotation=45, fontsize=9)
+        label = self.ax.xaxis.get_majorticklabels()[4]
+        if self.tick_transform is None:
+            self.tick_transform = label.get_transform()
+        label.set_transform(self.tick_transform + self.offset)
+
+        # Add text
+        for text, window, name in zip(self.texts, windows, BAR_LABELS):
+            text.set_x((window[0] + window[1]) / 2 * graph_scale)
+            text.set_text(f"{name} \n {round((window[1] - window[0]) * 1000, 2)}ms")
+
+        self.ax.set_title(title or "", fontsize=9)
+        self.fig.savefig(file)
+
+
+# Figure of each render worker, created once by render_diagrams
+worker_diagram = None
+
+
+def render_diagrams(jobs):
+    """
+    :param jobs: list of (windows, file, title)
+    :return: number of rendered diagrams
+    """
+    global worker_diagram
+    if worker_diagram is None:
+        plt.switch_backend("Agg")
+        worker_diagram = TimingDiagram()
+
+    for windows, file, title in jobs:
+        worker_diagram.draw(windows, file, title)
+    return len(jobs)
+
+
+def read_defenders(report):
+    """
+    :param report: report_Exp1.json, report_Exp2.json or the directory of a columnar report of Experiment 2
+    :return: names, AtoD, DtoV, AtoV (all in m) and decision delay of every defender
+    """
+    names, rows = [], []
+    if os.path.isdir(report):
+        from columnar_report import ColumnarReport
+        columnar_report = ColumnarReport(report)
+        slots = list(columnar_report.iter_rows("slots.csv"))
+        for row in columnar_report.iter_rows("defenders.csv"):
+            slot = slots[row["time_index"]]
+            names.append(f"{row['constellation']} {slot['time']} {row['satellite']}")
+            rows.append((row["AtoD"], row["DtoV"], slot["AtoV"] * 1000, row["decision_delay"]))
+    else:
+        with open(report, "r") as f:
+            results = json.load(f)["report"]
+
+        for name, value in results.items():
+            if "defenders" not in value:
+                # Experiment 1: AtoV in m
+                names.append(name)
+                rows.append((value["AtoD"], value["DtoV"], value["AtoV"], value["decision_delay"]))
+                continue
+
+            # Experiment 2: AtoV in km
+            for target_time, defenders in value["defenders"].items():
+                if not isinstance(defenders, dict):
+                    print(f"{report} is an event based report without distances, nothing to draw!")
+                    exit(1)
+                for satellite_name, defender in defenders.items():
+                    names.append(f"{name} {target_time} {satellite_name}")
+                    rows.append((defender["AtoD"], defender["DtoV"], defender["AtoV"] * 1000,
+                                 defender["decision_delay"]))
+
+    AtoD, DtoV, AtoV, decision_delay = np.array(rows, dtype=np.float64).reshape(-1, 4).T
+    return names, AtoD, DtoV, AtoV, decision_delay
+
+
+def file_name(name):
+    allowed_chars = string.ascii_letters + string.digits + "_"
+    return "".join(filter(lambda c: c in allowed_chars, list(name.replace(" ", "_"))))
+
+
+def render_report(report, output_dir, top=None, workers=None, file_format="pdf"):
+    """
+    Timing diagrams for the defenders of an experiment report
+    :param report: see read_defenders
+    :param output_dir: Directory of the diagrams, created if missing
+    :param top: Only the defenders with the longest decision delay, all if None
+    :param workers: Number of render processes, all cores if None, 1 to render in this process
+    :param file_format: Extension of the diagrams, e.g. "pdf" or "png"
+    :return: list of written files
+    """
+    names, AtoD, DtoV, AtoV, decision_delay = read_defenders(report)
+
+    # The tail time follows from the decision delay, so it does not have to be in the report
+    tail_times = decision_delay + time(DtoV) - time(AtoV) + time(AtoD)
+    windows = timing_windows(AtoD, DtoV, AtoV, tail_times)
+
+    order = np.argsort(-decision_delay, kind="stable")[:top]
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    jobs = []
+    for rank, index in enumerate(order):
+        file = os.path.join(output_dir, f"TimeWindow_{rank + 1:05d}_{file_name(names[index])}.{file_format}")
+        title = f"{names[index]} | decision delay {round(decision_delay[index] * 1000, 3)}ms"
+        jobs.append((windows[index], file, title))
+
+    start = timer.perf_counter()
+    chunks = [jobs[i:i + RENDER_CHUNK_SIZE] for i in range(0, len(jobs), RENDER_CHUNK_SIZE)]
+    if workers == 1:
+        rendered = sum(render_diagrams(chunk) for chunk in chunks)
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            rendered = sum(executor.map(render_diagrams, chunks))
+
+    print(f"Rendered {rendered} timing diagrams to {output_dir} in {round(timer.perf_counter() - start, 2)}s")
+    return [file for _, file, _ in jobs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Timing diagrams of the decision window. Without a report, the "
+                                                 "distances of decision_window_calc.py are drawn to TimeWindow.pdf")
+    parser.add_argument("report", nargs="?", help="report_Exp1.json, report_Exp2.json or a columnar report directory")
+    parser.add_argument("--top", type=int, help="Only the defenders with the longest decision delay")
+    parser.add_argument("--workers", type=int, help="Number of render processes, all cores by default")
+    parser.add_argument("--output-dir", default=os.path.join(BASE_DIR, "results", "timing_diagrams"))
+    parser.add_argument("--format", default="pdf", help="pdf, png, svg, ...")
+    args = parser.parse_args()
+
+    if args.report is None:
+        TimingDiagram().draw(timing_windows(AtoD, DtoV, AtoV, tail_time), "TimeWindow.pdf")
+        #plt.show()
+        return
+
+    render_report(args.report, args.output_dir, args.top, args.workers, args.format)
+
+
+if __name__ == "__main__":
+    main()